@@ -0,0 +1,195 @@
+"""Admission control, so order entry keeps its share of workers and database connections.
+
+Routes belong to a class (order entry, interactive reports, exports) with a
+limit on concurrent requests each. The limit is shared by the workers on the
+host through one lock file per slot (the same kind of lock as the SQLite write
+lock), so it holds for single-threaded gunicorn workers too. A request waits
+up to its class's queue timeout for a free slot and is then answered 503 with
+Retry-After instead of queueing behind the work already running. Routes without
+a class (health checks, login, static files) are never held back.
+
+A streamed response keeps its slot until its body has been sent.
+"""
+import functools
+import logging
+import math
+import os
+import threading
+import time
+
+from flask import jsonify, make_response, request
+
+try:
+    import fcntl
+except ImportError:  # Windows: limits apply per process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+def _class_settings(name, limit, wait):
+    return {
+        'limit': int(os.environ.get(f"ADMIT_{name}_LIMIT", str(limit))),
+        'wait': float(os.environ.get(f"ADMIT_{name}_WAIT", str(wait))),
+    }
+
+
+# Concurrent requests per class on this host (0: no limit) and seconds a request may wait for a slot
+ADMISSION_CLASSES = {
+    'entry': _class_settings('ENTRY', 32, 10),
+    'reports': _class_settings('REPORTS', 6, 3),
+    'exports': _class_settings('EXPORTS', 2, 1),
+    # Live balance streams hold a worker thread while open; keep the limit below the threads of the host
+    'streams': _class_settings('STREAMS', 4, 0),
+}
+# Seconds between attempts to take a slot held by another worker
+POLL_SECONDS = 0.01
+
+
+class _ReleasingBody:
+    """Streamed response body that gives its admission slot back once it is sent or closed"""
+
+    def __init__(self, body, release):
+        self.body = body
+        self.release = release
+
+    def __iter__(self):
+        try:
+            yield from self.body
+        finally:
+            self.release()
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self.release()
+
+
+class AdmissionGate:
+    """Per-class slots shared by the workers on a host, with per-process metrics"""
+
+    def __init__(self, directory, classes=ADMISSION_CLASSES):
+        self.directory = directory
+        self.classes = classes
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # Without fcntl the slots are counted in this process only
+        self._local = {name: threading.BoundedSemaphore(settings['limit'])
+                       for name, settings in classes.items() if settings['limit'] > 0}
+        self._metrics = {name: {'admitted': 0, 'rejected': 0, 'in_flight': 0, 'peak_in_flight': 0,
+                                'waiting': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0}
+                         for name in classes}
+
+    def _take_slot(self, name, limit):
+        """Lock the first free slot file of the class; the open file, or None if all are held"""
+        for index in range(limit):
+            slot = open(os.path.join(self.directory, f'{name}-{index}.lock'), 'a')
+            try:
+                fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return slot
+            except BlockingIOError:
+                slot.close()
+        return None
+
+    def _wait_for_slot(self, name, settings):
+        """A function releasing the slot, or None when none became free within the class's wait"""
+        if fcntl is None:
+            semaphore = self._local[name]
+            return semaphore.release if semaphore.acquire(timeout=settings['wait']) else None
+        deadline = time.monotonic() + settings['wait']
+        while True:
+            slot = self._take_slot(name, settings['limit'])
+            if slot is not None:
+                def release():
+                    fcntl.flock(slot, fcntl.LOCK_UN)
+                    slot.close()
+                return release
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(POLL_SECONDS)
+
+    def acquire(self, name):
+        """A function giving the slot back (safe to call more than once), or None if the class is saturated"""
+        settings = self.classes[name]
+        metrics = self._metrics[name]
+        if settings['limit'] <= 0:
+            release_slot = None
+        else:
+            with self._lock:
+                metrics['waiting'] += 1
+            started = time.monotonic()
+            release_slot = self._wait_for_slot(name, settings)
+            waited = time.monotonic() - started
+            with self._lock:
+                metrics['waiting'] -= 1
+                metrics['wait_seconds'] += waited
+                metrics['max_wait_seconds'] = max(metrics['max_wait_seconds'], waited)
+                if release_slot is None:
+                    metrics['rejected'] += 1
+                    return None
+
+        with self._lock:
+            metrics['admitted'] += 1
+            metrics['in_flight'] += 1
+            metrics['peak_in_flight'] = max(metrics['peak_in_flight'], metrics['in_flight'])
+        released = []
+
+        def release():
+            with self._lock:
+                if released:
+                    return
+                released.append(True)
+                metrics['in_flight'] -= 1
+            if release_slot is not None:
+                release_slot()
+        return release
+
+    def busy_response(self, name):
+        """Fast 503 telling the client when to try again"""
+        retry_after = max(1, math.ceil(self.classes[name]['wait']))
+        message = f'The server is busy ({name}), please try again in {retry_after} seconds'
+        if request.path.startswith('/api/') or request.accept_mimetypes.best == 'application/json':
+            response = jsonify({'error': message})
+        else:
+            response = make_response(message)
+            response.mimetype = 'text/plain'
+        response.status_code = 503
+        response.headers['Retry-After'] = str(retry_after)
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+    def admit(self, name):
+        """Route decorator: run the view only when a slot of the class is free"""
+        if name not in self.classes:
+            raise ValueError(f'Unknown admission class {name}')
+
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapped(*args, **kwargs):
+                release = self.acquire(name)
+                if release is None:
+                    logger.warning(f'Admission class {name} saturated, turned away {request.path}')
+                    return self.busy_response(name)
+                try:
+                    response = make_response(view(*args, **kwargs))
+                except BaseException:
+                    release()
+                    raise
+                if response.is_streamed and not response.direct_passthrough:
+                    # Streamed pages and CSVs do their queries while the body is sent
+                    response.response = _ReleasingBody(response.response, release)
+                else:
+                    release()
+                return response
+            return wrapped
+        return decorator
+
+    def metrics(self):
+        """Per-class limits and counters of this worker process"""
+        with self._lock:
+            return {name: {'limit': self.classes[name]['limit'], 'wait': self.classes[name]['wait'],
+                           **{key: round(value, 3) if isinstance(value, float) else value
+                              for key, value in metrics.items()}}
+                    for name, metrics in self._metrics.items()}
@@ -4,6 +4,11 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
+from admission import AdmissionGate
+from balance_events import BalanceHub, LocalBroker
+from sqlite_profile import configure_sqlite
+from plants import (PlantSession, plant_binds, create_plant_schema, use_plant, bind_key,
+                    PLANTS, PLANT_DATABASES, CENTRAL_TABLES)
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
@@ -22,7 +27,8 @@ def get_database_uri():
 class Base(DeclarativeBase):
     pass
 
-db = SQLAlchemy(model_class=Base)
+# Sessions route plant data to the plant's own database when it has one
+db = SQLAlchemy(model_class=Base, session_options={"class_": PlantSession})
 
 # create the app
 app = Flask(__name__)
@@ -35,47 +41,96 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
     "pool_recycle": 300,
     "pool_pre_ping": True,
 }
+# Plants with their own database (PLANT_DATABASES)
+app.config["SQLALCHEMY_BINDS"] = plant_binds()
 
 # initialize the app with the extension
 db.init_app(app)
 
+# Live balance updates: workers on this host share a spool file as broker
+balance_hub = BalanceHub(LocalBroker(
+    os.environ.get("BALANCE_BROKER_PATH", os.path.join(app.instance_path, "balance_events.log"))
+))
+
+# Concurrency limits per route class (entry, reports, exports), shared through slot files by the workers on this host
+admission = AdmissionGate(os.environ.get("ADMISSION_DIR", os.path.join(app.instance_path, "admission")))
+
 with app.app_context():
+    # WAL, pragmas and write serialisation for SQLite databases (the fallback, or any plant database)
+    for engine in db.engines.values():
+        configure_sqlite(engine)
+    
     # Import models and routes
     import models
     import routes
     
     # Create all tables
+    open_wip_exists = db.inspect(db.engine).has_table('open_wip')
     db.create_all()
+    create_plant_schema(db)
+    
+    # create_all does not add new columns or indexes to tables that already exist
+    from schema_upgrade import upgrade_tables
+    from order_users import backfill_order_users
+    from order_headers import backfill_order_headers
+    added_columns = upgrade_tables(db.engine, db.metadata.sorted_tables)
+    plant_added_columns = {}
+    for plant in PLANT_DATABASES:
+        plant_added_columns[plant] = upgrade_tables(
+            db.engines[bind_key(plant)],
+            [table for table in db.metadata.sorted_tables if table.name not in CENTRAL_TABLES])
+    
+    # Orders entered before user name/department were stored on each row
+    if 'user_name' in added_columns:
+        backfill_order_users()
+    
+    # Orders entered before production order numbers had their own table
+    if 'header_id' in added_columns:
+        backfill_order_headers()
+        db.session.commit()
+    for plant, plant_columns in plant_added_columns.items():
+        if 'header_id' in plant_columns:
+            with use_plant(plant):
+                backfill_order_headers()
+                db.session.commit()
+    
+    # Build the open-WIP index from existing orders the first time its table is created
+    if not open_wip_exists:
+        from open_wip import rebuild_open_wip
+        rebuild_open_wip()
     
     # Create default admin user if not exists
     from models import User, WorkCenter, Department
-    from werkzeug.security import generate_password_hash
     
     admin_user = User.query.filter_by(username='admin').first()
     if not admin_user:
         admin_user = User()
         admin_user.username = 'admin'
-        admin_user.password_hash = generate_password_hash('admin123')
+        admin_user.set_password('admin123')
         admin_user.is_admin = True
         db.session.add(admin_user)
     
-    # Create default workcenters if not exist
-    if WorkCenter.query.count() == 0:
-        default_workcenters = ['WC001 - Assembly', 'WC002 - Machining', 'WC003 - Welding', 'WC004 - Painting', 'WC005 - Quality Control']
-        for wc_name in default_workcenters:
-            workcenter = WorkCenter()
-            workcenter.name = wc_name
-            db.session.add(workcenter)
-    
-    # Create default departments if not exist
-    if Department.query.count() == 0:
-        default_departments = ['Engineering', 'Production', 'Quality Control', 'Maintenance', 'Operations', 'Management']
-        for dept_name in default_departments:
-            department = Department()
-            department.name = dept_name
-            db.session.add(department)
-    
     db.session.commit()
+    
+    for plant in PLANTS:
+        with use_plant(plant):
+            # Create default workcenters if not exist
+            if WorkCenter.query.count() == 0:
+                default_workcenters = ['WC001 - Assembly', 'WC002 - Machining', 'WC003 - Welding', 'WC004 - Painting', 'WC005 - Quality Control']
+                for wc_name in default_workcenters:
+                    workcenter = WorkCenter()
+                    workcenter.name = wc_name
+                    db.session.add(workcenter)
+            
+            # Create default departments if not exist
+            if Department.query.count() == 0:
+                default_departments = ['Engineering', 'Production', 'Quality Control', 'Maintenance', 'Operations', 'Management']
+                for dept_name in default_departments:
+                    department = Department()
+                    department.name = dept_name
+                    db.session.add(department)
+            
+            db.session.commit()
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
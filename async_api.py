@@ -0,0 +1,238 @@
+"""Async, read-only API for wall-mounted dashboards that poll every few seconds.
+
+Pollers are served by an event loop instead of occupying the sync gunicorn
+workers that order entry needs. Queries are built from the tables in
+models.py and run through an async driver (asyncpg, aiosqlite) with a pool
+of its own; identical polls arriving within LIVE_CACHE_SECONDS share one
+query, and unchanged responses are answered 304 through their ETag.
+Callers log in through the Flask app as usual: the Flask session cookie is
+read here to find the user's plant.
+
+Run it next to gunicorn and route /api/live/ to it:
+
+    uvicorn async_api:api --host 0.0.0.0 --port 5001 --workers 2
+
+or serve everything from one ASGI server, the Flask app behind the async
+routes (Flask then runs in the server's thread pool):
+
+    uvicorn async_api:application --host 0.0.0.0 --port 5000 --workers 2
+
+Needs the ``async`` extra (starlette, uvicorn, asyncpg, aiosqlite, greenlet).
+"""
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import time
+
+from itsdangerous import BadSignature
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine
+from starlette.applications import Starlette
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Mount, Route
+
+from app import app as flask_app, db
+from models import OpenWip, ProductionOrder, WorkCenter
+from plants import DEFAULT_PLANT, PLANT_DATABASES, bind_key
+from sqlite_profile import configure_sqlite
+
+# Connections per event-loop worker, per database
+ASYNC_POOL_SIZE = int(os.environ.get("ASYNC_POOL_SIZE", "10"))
+ASYNC_MAX_OVERFLOW = int(os.environ.get("ASYNC_MAX_OVERFLOW", "10"))
+# Identical polls within this many seconds share one query
+LIVE_CACHE_SECONDS = float(os.environ.get("LIVE_CACHE_SECONDS", "2"))
+MAX_RECENT_ORDERS = 500
+MAX_BALANCES = 5000
+
+# Sync drivers in DATABASE_URL / PLANT_DATABASES and their async counterparts
+ASYNC_DRIVERS = {'postgresql': 'postgresql+asyncpg', 'sqlite': 'sqlite+aiosqlite'}
+
+
+def async_url(url):
+    """The async-driver form of a database URL used by the Flask app"""
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f'No async driver configured for {backend} databases')
+    url = url.set(drivername=ASYNC_DRIVERS[backend])
+    if backend == 'postgresql' and 'sslmode' in url.query:
+        # asyncpg takes ssl= instead of libpq's sslmode=
+        url = url.update_query_dict({'ssl': url.query['sslmode']}).difference_update_query(['sslmode'])
+    return url
+
+
+class LiveCache:
+    """Results per key for a few seconds; concurrent misses for one key wait for a single query"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.entries = {}  # key -> (expires, task)
+
+    async def get(self, key, load):
+        now = time.monotonic()
+        entry = self.entries.get(key)
+        if entry is None or entry[0] <= now or (entry[1].done() and entry[1].exception() is not None):
+            if len(self.entries) > 1000:
+                self.entries = {k: v for k, v in self.entries.items() if v[0] > now}
+            entry = (now + self.seconds, asyncio.ensure_future(load()))
+            self.entries[key] = entry
+        return await asyncio.shield(entry[1])
+
+
+_engines = {}
+_cache = LiveCache(LIVE_CACHE_SECONDS)
+
+
+def engine_for(plant):
+    """Async engine for the plant's database (its own, or the main one), created on first use"""
+    key = bind_key(plant) if plant in PLANT_DATABASES else None
+    if key not in _engines:
+        with flask_app.app_context():
+            # The resolved URL of the Flask engine, e.g. SQLite paths under the instance folder
+            url = db.engines[key].url
+        options = {'pool_recycle': 300, 'pool_pre_ping': True}
+        if url.get_backend_name() != 'sqlite':
+            options.update(pool_size=ASYNC_POOL_SIZE, max_overflow=ASYNC_MAX_OVERFLOW)
+        engine = create_async_engine(async_url(url), **options)
+        configure_sqlite(engine.sync_engine)
+        _engines[key] = engine
+    return _engines[key]
+
+
+def flask_session(request):
+    """Contents of the Flask session cookie, or {} if it is missing, expired or not signed by this app"""
+    cookie = request.cookies.get(flask_app.config['SESSION_COOKIE_NAME'])
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    if not cookie or serializer is None:
+        return {}
+    try:
+        return serializer.loads(cookie, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return {}
+
+
+def _int_arg(request, name, default=None, maximum=None):
+    value = request.query_params.get(name)
+    if value in (None, ''):
+        return default
+    value = int(value)
+    if value < 0:
+        raise ValueError(name)
+    return min(value, maximum) if maximum else value
+
+
+def _json_response(request, payload):
+    """JSON with an ETag of its body; 304 when the poller already has this version"""
+    body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    etag = '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type='application/json', headers=headers)
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+async def _recent_orders(plant, workcenter_id, since_id, limit):
+    query = select(
+        ProductionOrder.id, ProductionOrder.production_order, ProductionOrder.workcenter_id, WorkCenter.name,
+        ProductionOrder.quantity, ProductionOrder.order_type, ProductionOrder.remark, ProductionOrder.user_name,
+        ProductionOrder.created_at,
+    ).join(WorkCenter, WorkCenter.id == ProductionOrder.workcenter_id).where(ProductionOrder.plant == plant)
+    if workcenter_id is not None:
+        query = query.where(ProductionOrder.workcenter_id == workcenter_id)
+    if since_id is not None:
+        query = query.where(ProductionOrder.id > since_id)
+    query = query.order_by(ProductionOrder.id.desc()).limit(limit)
+    async with engine_for(plant).connect() as connection:
+        rows = (await connection.execute(query)).all()
+    return [{
+        'id': order_id,
+        'production_order': production_order,
+        'workcenter_id': order_workcenter_id,
+        'workcenter_name': workcenter_name,
+        'quantity': quantity,
+        'order_type': order_type,
+        'remark': remark or '',
+        'user_name': user_name,
+        'created_at': _isoformat(created_at),
+    } for order_id, production_order, order_workcenter_id, workcenter_name, quantity, order_type, remark,
+        user_name, created_at in rows]
+
+
+async def _balances(plant, workcenter_id, limit):
+    # open_wip has no plant column; its work center tells the plant apart in a shared database
+    query = select(
+        OpenWip.production_order, OpenWip.workcenter_id, WorkCenter.name, OpenWip.balance, OpenWip.updated_at,
+    ).join(WorkCenter, WorkCenter.id == OpenWip.workcenter_id).where(WorkCenter.plant == plant)
+    if workcenter_id is not None:
+        query = query.where(OpenWip.workcenter_id == workcenter_id)
+    query = query.order_by(OpenWip.updated_at.desc(), OpenWip.production_order).limit(limit)
+    async with engine_for(plant).connect() as connection:
+        rows = (await connection.execute(query)).all()
+    return [{
+        'production_order': production_order,
+        'workcenter_id': balance_workcenter_id,
+        'workcenter_name': workcenter_name,
+        'balance': balance,
+        'updated_at': _isoformat(updated_at),
+    } for production_order, balance_workcenter_id, workcenter_name, balance, updated_at in rows]
+
+
+async def recent_orders(request):
+    """Newest orders of the user's plant; since_id returns only orders after the last one a poller has"""
+    session = flask_session(request)
+    if 'user_id' not in session:
+        return JSONResponse({'error': 'Login required'}, status_code=401)
+    plant = session.get('plant') or DEFAULT_PLANT
+    try:
+        workcenter_id = _int_arg(request, 'workcenter')
+        since_id = _int_arg(request, 'since_id')
+        limit = _int_arg(request, 'limit', 50, MAX_RECENT_ORDERS)
+    except ValueError:
+        return JSONResponse({'error': 'workcenter, since_id and limit must be whole numbers'}, status_code=400)
+
+    orders = await _cache.get(('recent_orders', plant, workcenter_id, since_id, limit),
+                              lambda: _recent_orders(plant, workcenter_id, since_id, limit))
+    return _json_response(request, {'orders': orders, 'last_id': orders[0]['id'] if orders else since_id})
+
+
+async def balances(request):
+    """Open WIP balances (non-zero) of the user's plant, most recently changed first"""
+    session = flask_session(request)
+    if 'user_id' not in session:
+        return JSONResponse({'error': 'Login required'}, status_code=401)
+    plant = session.get('plant') or DEFAULT_PLANT
+    try:
+        workcenter_id = _int_arg(request, 'workcenter')
+        limit = _int_arg(request, 'limit', 500, MAX_BALANCES)
+    except ValueError:
+        return JSONResponse({'error': 'workcenter and limit must be whole numbers'}, status_code=400)
+
+    rows = await _cache.get(('balances', plant, workcenter_id, limit),
+                            lambda: _balances(plant, workcenter_id, limit))
+    return _json_response(request, {'balances': rows})
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_app):
+    yield
+    for engine in list(_engines.values()):
+        await engine.dispose()
+    _engines.clear()
+
+
+ROUTES = [
+    Route('/api/live/recent_orders', recent_orders),
+    Route('/api/live/balances', balances),
+]
+
+# The read-only tier alone, behind a proxy that routes /api/live/ here
+api = Starlette(routes=ROUTES, lifespan=lifespan)
+
+# Everything from one ASGI server: the async routes, then the Flask app for all other paths
+application = Starlette(routes=ROUTES + [Mount('/', app=WSGIMiddleware(flask_app))], lifespan=lifespan)
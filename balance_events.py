@@ -0,0 +1,227 @@
+import json
+import os
+import queue
+import threading
+import time
+import logging
+
+from sqlalchemy import case, func, tuple_
+
+logger = logging.getLogger(__name__)
+
+
+class LocalBroker:
+    """Append-only spool file shared by every worker on the host.
+
+    Stands in for a real pub/sub broker: publishers append one JSON line per
+    event and every worker tails the file from its own position. A full spool
+    is rotated to ``<path>.1``; positions are (inode, offset) pairs, so a
+    reader notices the rotation and finishes the old file before starting on
+    the new one. Each event is read with the position just after it, which a
+    reconnecting client can hand back to pick up where it left off.
+    """
+
+    def __init__(self, path, max_bytes=1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+
+    def publish(self, event):
+        line = json.dumps(event, separators=(',', ':')) + '\n'
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'ab') as spool:
+            spool.write(line.encode('utf-8'))
+            size = spool.tell()
+        if size > self.max_bytes:
+            try:
+                os.replace(self.path, self.path + '.1')
+            except OSError:
+                # Another worker rotated first, or the file is held open (Windows)
+                pass
+
+    def end_position(self):
+        """Position just after the last event written so far"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None, 0
+        return stat.st_ino, stat.st_size
+
+    def read_since(self, position):
+        """Return ([(event, position_after_it), ...], new_position) for everything appended after position."""
+        inode, offset = position
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            # Not written yet, or rotated and not written since
+            return [], position
+        events = []
+        if inode is not None and stat.st_ino != inode:
+            # Rotated since the last read: the rest of the old file comes first
+            try:
+                rotated = os.stat(self.path + '.1')
+            except OSError:
+                rotated = None
+            if rotated is not None and rotated.st_ino == inode:
+                events, _ = self._read(self.path + '.1', inode, offset, rotated.st_size)
+            else:
+                logger.warning('Balance spool rotated more than once between reads, some events were missed')
+            offset = 0
+        elif stat.st_size < offset:
+            # Truncated in place, start again from the top
+            offset = 0
+        new_events, offset = self._read(self.path, stat.st_ino, offset, stat.st_size)
+        return events + new_events, (stat.st_ino, offset)
+
+    def _read(self, path, inode, offset, size):
+        """Events on the complete lines between offset and size, and the offset after the last of them"""
+        if size <= offset:
+            return [], offset
+        try:
+            with open(path, 'rb') as spool:
+                spool.seek(offset)
+                data = spool.read(size - offset)
+        except FileNotFoundError:
+            return [], offset
+        # Only consume complete lines; a partial write is picked up next poll
+        complete = data.rfind(b'\n') + 1
+        events = []
+        end = offset
+        for line in data[:complete].splitlines(keepends=True):
+            end += len(line)
+            try:
+                events.append((json.loads(line), (inode, end)))
+            except ValueError:
+                continue
+        return events, offset + complete
+
+
+class BalanceHub:
+    """Fans balance deltas out to the SSE subscribers of this worker."""
+
+    def __init__(self, broker, poll_interval=0.5, queue_size=100):
+        self.broker = broker
+        self.poll_interval = poll_interval
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def subscribe(self, since=None):
+        """Queue of (event, position) pairs; since, a position a client saw last, replays what came after it.
+
+        Replayed events may repeat or come after ones the hub delivers, so
+        readers skip events at or before the last position they passed on.
+        """
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._tail, name='balance-hub', daemon=True)
+                self._thread.start()
+        if since is not None:
+            try:
+                missed, _ = self.broker.read_since(since)
+            except OSError as e:
+                logger.warning('Balance hub could not read spool: %s', e)
+                missed = [({'reload': True}, None)]
+            if len(missed) >= self.queue_size:
+                # Too far behind to catch up through the queue
+                self._overflow(subscriber)
+            else:
+                for entry in missed:
+                    try:
+                        subscriber.put_nowait(entry)
+                    except queue.Full:
+                        self._overflow(subscriber)
+                        break
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, rows, plant=None):
+        if rows:
+            self.broker.publish({'rows': rows, 'plant': plant, 'ts': time.time()})
+
+    def _tail(self):
+        position = self.broker.end_position()
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    return
+            try:
+                events, position = self.broker.read_since(position)
+            except OSError as e:
+                logger.warning('Balance hub could not read spool: %s', e)
+                events = []
+            for event, event_position in events:
+                self._dispatch(event, event_position)
+            time.sleep(self.poll_interval)
+
+    def _dispatch(self, event, position):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait((event, position))
+            except queue.Full:
+                self._overflow(subscriber)
+
+    def _overflow(self, subscriber):
+        """Slow client: tell it to reload instead of buffering forever"""
+        self.unsubscribe(subscriber)
+        try:
+            subscriber.get_nowait()
+        except queue.Empty:
+            pass
+        subscriber.put_nowait(({'reload': True}, None))
+
+
+def balance_key(production_order, workcenter_id):
+    return f"{production_order}_{workcenter_id}"
+
+
+def compute_balance_rows(session, model, keys):
+    """Current IN/OUT totals for the given (production_order, workcenter_id) keys.
+
+    One grouped query restricted to the affected keys, so a commit costs a
+    single incremental lookup regardless of history length. Keys with no rows
+    left (after a delete) are reported with zero totals and deleted=True.
+    """
+    keys = {(po, int(wc_id)) for po, wc_id in keys if po is not None and wc_id is not None}
+    if not keys:
+        return []
+
+    results = session.query(
+        model.production_order,
+        model.workcenter_id,
+        func.coalesce(func.sum(case((model.order_type == 'IN', model.quantity), else_=0)), 0),
+        func.coalesce(func.sum(case((model.order_type == 'OUT', model.quantity), else_=0)), 0),
+    ).filter(
+        tuple_(model.production_order, model.workcenter_id).in_(list(keys))
+    ).group_by(model.production_order, model.workcenter_id).all()
+
+    rows = []
+    for production_order, workcenter_id, total_in, total_out in results:
+        keys.discard((production_order, workcenter_id))
+        rows.append({
+            'key': balance_key(production_order, workcenter_id),
+            'production_order': production_order,
+            'workcenter_id': workcenter_id,
+            'total_in': int(total_in),
+            'total_out': int(total_out),
+            'balance': int(total_in) - int(total_out),
+        })
+    for production_order, workcenter_id in keys:
+        rows.append({
+            'key': balance_key(production_order, workcenter_id),
+            'production_order': production_order,
+            'workcenter_id': workcenter_id,
+            'total_in': 0,
+            'total_out': 0,
+            'balance': 0,
+            'deleted': True,
+        })
+    return rows
@@ -0,0 +1,234 @@
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import and_, bindparam, case, delete, exists, func, literal, select, update
+
+from app import app, db
+from models import ProductionOrder, BalanceCheckpoint, BalanceSnapshot
+from plants import plant_option
+
+# Rows inserted per statement when writing a checkpoint
+SNAPSHOT_BATCH_SIZE = 1000
+
+
+def _totals_query(start=None, end=None, search='', workcenter_id=None, all_plants=False):
+    """Grouped IN/OUT totals per (production_order, workcenter_id) for orders created in [start, end)"""
+    query = db.session.query(
+        ProductionOrder.production_order,
+        ProductionOrder.workcenter_id,
+        func.coalesce(func.sum(case((ProductionOrder.order_type == 'IN', ProductionOrder.quantity), else_=0)), 0),
+        func.coalesce(func.sum(case((ProductionOrder.order_type == 'OUT', ProductionOrder.quantity), else_=0)), 0),
+    )
+    if start is not None:
+        query = query.filter(ProductionOrder.created_at >= start)
+    if end is not None:
+        query = query.filter(ProductionOrder.created_at < end)
+    if search:
+        query = query.filter(ProductionOrder.production_order.contains(search))
+    if workcenter_id:
+        query = query.filter(ProductionOrder.workcenter_id == workcenter_id)
+    return query.group_by(ProductionOrder.production_order, ProductionOrder.workcenter_id).execution_options(
+        all_plants=all_plants
+    )
+
+
+def latest_checkpoint(before):
+    return BalanceCheckpoint.query.filter(
+        BalanceCheckpoint.taken_at <= before
+    ).order_by(BalanceCheckpoint.taken_at.desc()).first()
+
+
+def create_checkpoint(taken_at):
+    """Store balances for every (production_order, workcenter_id) as of taken_at.
+
+    Built from the previous checkpoint plus the orders created since, so a
+    nightly run only reads one day of history. A checkpoint covers every
+    plant in the database it is stored in.
+    """
+    existing = BalanceCheckpoint.query.filter_by(taken_at=taken_at).first()
+    if existing:
+        return existing
+
+    previous = latest_checkpoint(taken_at)
+    totals = {}
+    if previous:
+        for row in BalanceSnapshot.query.filter_by(checkpoint_id=previous.id):
+            totals[(row.production_order, row.workcenter_id)] = [row.total_in, row.total_out]
+    for production_order, workcenter_id, total_in, total_out in _totals_query(
+            start=previous.taken_at if previous else None, end=taken_at, all_plants=True):
+        current = totals.setdefault((production_order, workcenter_id), [0, 0])
+        current[0] += int(total_in)
+        current[1] += int(total_out)
+
+    checkpoint = BalanceCheckpoint()
+    checkpoint.taken_at = taken_at
+    checkpoint.row_count = len(totals)
+    db.session.add(checkpoint)
+    db.session.flush()
+
+    rows = [{
+        'checkpoint_id': checkpoint.id,
+        'production_order': production_order,
+        'workcenter_id': workcenter_id,
+        'total_in': total_in,
+        'total_out': total_out,
+    } for (production_order, workcenter_id), (total_in, total_out) in totals.items()]
+    for start in range(0, len(rows), SNAPSHOT_BATCH_SIZE):
+        db.session.execute(BalanceSnapshot.__table__.insert(), rows[start:start + SNAPSHOT_BATCH_SIZE])
+
+    db.session.commit()
+    return checkpoint
+
+
+def balances_as_of(as_of, search='', workcenter_id=None):
+    """IN/OUT totals per (production_order, workcenter_id) for orders created before as_of.
+
+    Answered from the nearest earlier checkpoint plus the orders created
+    since it, instead of re-aggregating the whole history.
+    """
+    checkpoint = latest_checkpoint(as_of)
+    totals = {}
+    if checkpoint:
+        query = BalanceSnapshot.query.filter_by(checkpoint_id=checkpoint.id)
+        if search:
+            query = query.filter(BalanceSnapshot.production_order.contains(search))
+        if workcenter_id:
+            query = query.filter(BalanceSnapshot.workcenter_id == workcenter_id)
+        for row in query:
+            totals[(row.production_order, row.workcenter_id)] = [row.total_in, row.total_out]
+
+    for production_order, workcenter_id_, total_in, total_out in _totals_query(
+            start=checkpoint.taken_at if checkpoint else None, end=as_of,
+            search=search, workcenter_id=workcenter_id):
+        current = totals.setdefault((production_order, workcenter_id_), [0, 0])
+        current[0] += int(total_in)
+        current[1] += int(total_out)
+    return totals
+
+
+def _adjust_checkpoints(changes, latest):
+    """Apply (created_at, production_order, workcenter_id, quantity_in, quantity_out) changes to checkpoints.
+
+    A checkpoint counts the orders created before taken_at, so a change goes
+    to the checkpoints taken after its created_at. Backdated inserts add a
+    snapshot row where a checkpoint has none for the pair, and rows a delete
+    leaves at zero are removed, as a fresh checkpoint would not have them.
+    """
+    # Changes to one pair at the same instant are applied together
+    grouped = {}
+    for created_at, production_order, workcenter_id, quantity_in, quantity_out in changes:
+        if created_at is not None and created_at < latest:
+            current = grouped.setdefault((created_at, production_order, int(workcenter_id)), [0, 0])
+            current[0] += quantity_in
+            current[1] += quantity_out
+    params = [{
+        'order_created_at': created_at,
+        'order_number': production_order,
+        'order_workcenter_id': workcenter_id,
+        'delta_in': delta_in,
+        'delta_out': delta_out,
+    } for (created_at, production_order, workcenter_id), (delta_in, delta_out) in grouped.items()
+        if delta_in or delta_out]
+    if not params:
+        return 0
+
+    snapshot = BalanceSnapshot.__table__
+    later_checkpoints = select(BalanceCheckpoint.id).where(BalanceCheckpoint.taken_at > bindparam('order_created_at'))
+    same_pair = and_(snapshot.c.production_order == bindparam('order_number'),
+                     snapshot.c.workcenter_id == bindparam('order_workcenter_id'))
+    added = [row for row in params if row['delta_in'] > 0 or row['delta_out'] > 0]
+    if added:
+        db.session.execute(snapshot.insert().from_select(
+            ['checkpoint_id', 'production_order', 'workcenter_id', 'total_in', 'total_out'],
+            select(BalanceCheckpoint.id, bindparam('order_number', type_=snapshot.c.production_order.type),
+                   bindparam('order_workcenter_id', type_=snapshot.c.workcenter_id.type), literal(0), literal(0)).where(
+                BalanceCheckpoint.taken_at > bindparam('order_created_at'),
+                ~exists().where(snapshot.c.checkpoint_id == BalanceCheckpoint.id, same_pair),
+            )
+        ), added)
+    db.session.execute(update(snapshot).where(snapshot.c.checkpoint_id.in_(later_checkpoints), same_pair).values(
+        total_in=snapshot.c.total_in + bindparam('delta_in'),
+        total_out=snapshot.c.total_out + bindparam('delta_out'),
+    ), params)
+    removed = [row for row in params if row['delta_in'] < 0 or row['delta_out'] < 0]
+    if removed:
+        db.session.execute(delete(snapshot).where(
+            snapshot.c.checkpoint_id.in_(later_checkpoints), same_pair,
+            snapshot.c.total_in == 0, snapshot.c.total_out == 0,
+        ), removed)
+    return len(params)
+
+
+def _latest_taken_at():
+    return db.session.query(func.max(BalanceCheckpoint.taken_at)).scalar()
+
+
+def checkpoints_inserted(records):
+    """Count inserted orders (dicts or ProductionOrder rows) in checkpoints taken after them; the caller commits.
+
+    Only backdated orders, e.g. synced from an offline terminal or imported,
+    are older than a checkpoint.
+    """
+    records = [record if isinstance(record, dict) else {
+        'created_at': record.created_at, 'production_order': record.production_order,
+        'workcenter_id': record.workcenter_id, 'order_type': record.order_type, 'quantity': record.quantity,
+    } for record in records]
+    created = [record['created_at'] for record in records if record['created_at'] is not None]
+    if not created:
+        return 0
+    latest = _latest_taken_at()
+    if latest is None or latest <= min(created):
+        return 0
+    return _adjust_checkpoints([
+        (record['created_at'], record['production_order'], record['workcenter_id'],
+         int(record['quantity'] or 0) if record['order_type'] == 'IN' else 0,
+         int(record['quantity'] or 0) if record['order_type'] == 'OUT' else 0)
+        for record in records
+    ], latest)
+
+
+def checkpoints_deleting(order_filter):
+    """Take the orders matched by order_filter out of the checkpoints that count them; call before deleting.
+
+    The checkpoints are adjusted in place rather than dropped, so purging
+    old orders keeps the checkpoint history usable. The caller commits.
+    """
+    latest = _latest_taken_at()
+    if latest is None:
+        return 0
+    totals = db.session.query(
+        ProductionOrder.created_at, ProductionOrder.production_order, ProductionOrder.workcenter_id,
+        func.coalesce(func.sum(case((ProductionOrder.order_type == 'IN', ProductionOrder.quantity), else_=0)), 0),
+        func.coalesce(func.sum(case((ProductionOrder.order_type == 'OUT', ProductionOrder.quantity), else_=0)), 0),
+    ).filter(order_filter, ProductionOrder.created_at < latest).group_by(
+        ProductionOrder.created_at, ProductionOrder.production_order, ProductionOrder.workcenter_id
+    )
+    return _adjust_checkpoints([(created_at, production_order, workcenter_id, -int(total_in), -int(total_out))
+                                for created_at, production_order, workcenter_id, total_in, total_out in totals],
+                               latest)
+
+
+@app.cli.command('balance-snapshot')
+@plant_option
+@click.option('--date', 'date_str', default=None,
+              help='Take the checkpoint at the start of this UTC day (YYYY-MM-DD); defaults to today.')
+@click.option('--keep-days', default=0, type=int,
+              help='Delete checkpoints older than this many days (0 keeps all).')
+def balance_snapshot_command(date_str, keep_days):
+    """Store a balance checkpoint; schedule nightly (e.g. cron: flask --app main balance-snapshot)"""
+    if date_str:
+        taken_at = datetime.strptime(date_str, '%Y-%m-%d')
+    else:
+        taken_at = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+
+    checkpoint = create_checkpoint(taken_at)
+    click.echo(f'Balance checkpoint at {checkpoint.taken_at} UTC: {checkpoint.row_count} balances')
+
+    if keep_days > 0:
+        cutoff = taken_at - timedelta(days=keep_days)
+        old_ids = [row.id for row in db.session.query(BalanceCheckpoint.id).filter(BalanceCheckpoint.taken_at < cutoff)]
+        if old_ids:
+            BalanceSnapshot.query.filter(BalanceSnapshot.checkpoint_id.in_(old_ids)).delete(synchronize_session=False)
+            BalanceCheckpoint.query.filter(BalanceCheckpoint.id.in_(old_ids)).delete(synchronize_session=False)
+            db.session.commit()
+            click.echo(f'Removed {len(old_ids)} checkpoint(s) older than {cutoff.date()}')
@@ -0,0 +1,63 @@
+"""Password verification throughput for the login path.
+
+Compares werkzeug's default hash against PASSWORD_HASH_METHOD (or --method),
+both inline on the calling thread (the old do_login behaviour) and through
+the bounded hashing pool used by User.check_password.
+
+    python benchmarks/bench_login.py --method scrypt:16384:8:1 --threads 16
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.security import generate_password_hash, check_password_hash  # noqa: E402
+
+import passwords  # noqa: E402
+
+
+def run(verify, password_hash, threads, seconds):
+    count = [0] * threads
+    stop = time.perf_counter() + seconds
+
+    def worker(slot):
+        while time.perf_counter() < stop:
+            verify(password_hash, 'secret-password')
+            count[slot] += 1
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return sum(count) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--method', default=passwords.HASH_METHOD or 'scrypt:16384:8:1',
+                        help='Hash method to compare against the werkzeug default')
+    parser.add_argument('--threads', type=int, default=16, help='Concurrent logins')
+    parser.add_argument('--seconds', type=float, default=5.0, help='Duration of each run')
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    hashes = [
+        ('werkzeug default', generate_password_hash('secret-password')),
+        (args.method, generate_password_hash('secret-password', method=args.method)),
+    ]
+    print(f'{cores} cores, {args.threads} concurrent logins, hashing pool of {passwords.HASH_WORKERS} threads')
+    print(f'{"method":<28}{"mode":<8}{"logins/s":>12}{"logins/s/core":>16}')
+    for label, password_hash in hashes:
+        for mode, verify in (('inline', check_password_hash), ('pool', passwords.verify_password)):
+            rate = run(verify, password_hash, args.threads, args.seconds)
+            busy_cores = min(cores, passwords.HASH_WORKERS if mode == 'pool' else args.threads)
+            print(f'{label:<28}{mode:<8}{rate:>12.1f}{rate / busy_cores:>16.1f}')
+
+
+if __name__ == '__main__':
+    main()
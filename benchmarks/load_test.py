@@ -0,0 +1,361 @@
+"""Shift-change load test for a running (or locally launched) gunicorn instance.
+
+Virtual operators log in, open IN/OUT entry pages and submit batches through
+save_orders or, for a share of them, the offline sync API; virtual supervisors
+poll balance_report and download the Excel export. Concurrency is ramped in
+stages and each stage reports throughput, latency percentiles and error rate,
+overall and per endpoint. Only the standard library is used, so it runs
+anywhere the app does.
+
+Form posts answer with a redirect whether they worked or not, so a redirect
+only counts as a success when it goes where a success goes and flashes no
+error (read from the session cookie); sync batches count when every line is
+saved.
+
+    # against an instance that is already running
+    python benchmarks/load_test.py --url http://127.0.0.1:5000
+
+    # launch gunicorn on SQLite, then on a local PostgreSQL database
+    python benchmarks/load_test.py --launch --database-url sqlite:////tmp/load_test.db
+    python benchmarks/load_test.py --launch --database-url postgresql://localhost/load_test --out pg.csv
+"""
+import argparse
+import base64
+import csv
+import http.cookiejar
+import json
+import os
+import random
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+import zlib
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OPERATOR_PASSWORD = 'load-test-123'
+# Part of the sync keys, so a run against a database used before stores its lines again
+RUN_ID = uuid.uuid4().hex[:8]
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # Time each request on its own; whether a redirect is a success is decided by Session.request
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = []
+        self._lock = threading.Lock()
+
+    def add(self, endpoint, seconds, ok):
+        with self._lock:
+            self.samples.append((endpoint, seconds, ok))
+
+    def drain(self):
+        with self._lock:
+            samples, self.samples = self.samples, []
+        return samples
+
+
+def session_flashes(cookie):
+    """Flashed (category, message) pairs in a Flask session cookie, read without checking its signature"""
+    payload = cookie.lstrip('.').split('.')[0]
+    data = base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4))
+    if cookie.startswith('.'):
+        data = zlib.decompress(data)
+    # Flask stores each (category, message) tuple as {" t": [category, message]}
+    return [tuple(item[' t'] if isinstance(item, dict) else item)
+            for item in json.loads(data).get('_flashes', [])]
+
+
+class Session:
+    def __init__(self, base_url, recorder, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.recorder = recorder
+        self.timeout = timeout
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies), _NoRedirect())
+
+    def flashes(self):
+        for cookie in self.cookies:
+            if cookie.name == 'session' and cookie.value:
+                try:
+                    return session_flashes(cookie.value)
+                except (ValueError, zlib.error):
+                    return []
+        return []
+
+    def request(self, endpoint, path, data=None, json_data=None, redirect_to=(), check=None):
+        """Send one request and record whether it succeeded; returns (ok, body).
+
+        A redirect is a success only to one of the redirect_to paths and when
+        it flashes no error; check(body), if given, decides for other answers
+        below 400.
+        """
+        headers = {}
+        if json_data is not None:
+            body = json.dumps(json_data).encode()
+            headers['Content-Type'] = 'application/json'
+        else:
+            body = urllib.parse.urlencode(data, doseq=True).encode() if data is not None else None
+        flashed_before = len(self.flashes())
+        started = time.perf_counter()
+        status = location = None
+        content = b''
+        try:
+            with self.opener.open(urllib.request.Request(self.base_url + path, data=body, headers=headers),
+                                  timeout=self.timeout) as response:
+                content = response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            # Including redirects, which _NoRedirect does not follow
+            status, location = e.code, e.headers.get('Location')
+            e.close()
+        except (urllib.error.URLError, OSError):
+            pass
+        elapsed = time.perf_counter() - started
+
+        if status is None or status >= 400:
+            ok = False
+        elif status >= 300:
+            ok = (urllib.parse.urlparse(location or '').path in redirect_to
+                  and not any(category == 'error' for category, _ in self.flashes()[flashed_before:]))
+        else:
+            ok = check(content) if check else True
+        self.recorder.add(endpoint, elapsed, ok)
+        return ok, content
+
+    def login(self, username, password):
+        return self.request('login', '/login', {'username': username, 'password': password},
+                            redirect_to=('/menu', '/admin/dashboard'))[0]
+
+
+def all_saved(content):
+    """A sync response in which every line was stored"""
+    try:
+        results = json.loads(content)['results']
+    except (ValueError, KeyError, TypeError):
+        return False
+    return all(result.get('status') == 'saved' for result in results)
+
+
+def operator(session, username, stop, args, worker_id):
+    if not session.login(username, OPERATOR_PASSWORD):
+        return
+    workcenter_ids = []
+    sequence = 0
+    while not stop.is_set():
+        ok, page = session.request('in_orders', '/in_orders')
+        if ok and not workcenter_ids:
+            workcenter_ids = re.findall(rb'<option value="(\d+)">', page) or [b'1']
+        wc_ids = [wc.decode() for wc in workcenter_ids] or ['1']
+
+        batch = []
+        for _ in range(args.batch_size):
+            sequence += 1
+            batch.append((random.choice(wc_ids), f'LT-{worker_id}-{sequence}'))
+        # Part of the batches arrive from terminals' offline queues; their JSON reports each line's result
+        synced = random.random() < args.sync_share
+        if synced:
+            session.request('sync_orders IN', '/api/orders/sync', json_data={'orders': [
+                {'key': f'{RUN_ID}-{po}-IN', 'workcenter_id': wc, 'production_order': po,
+                 'quantity': random.randint(1, 50), 'order_type': 'IN', 'remark': 'load test'} for wc, po in batch
+            ]}, check=all_saved)
+        else:
+            session.request('save_orders IN', '/save_orders', {
+                'order_type': 'IN', 'orders': [f'{wc}|{po}|{random.randint(1, 50)}|load test' for wc, po in batch],
+            }, redirect_to=('/menu',))
+        time.sleep(args.think_time)
+
+        session.request('out_orders', '/out_orders')
+        if synced:
+            session.request('sync_orders OUT', '/api/orders/sync', json_data={'orders': [
+                {'key': f'{RUN_ID}-{po}-OUT', 'workcenter_id': wc, 'production_order': po,
+                 'quantity': 1, 'order_type': 'OUT'} for wc, po in batch
+            ]}, check=all_saved)
+        else:
+            session.request('save_orders OUT', '/save_orders', {
+                'order_type': 'OUT', 'orders': [f'{wc}|{po}|1|' for wc, po in batch],
+            }, redirect_to=('/menu',))
+        time.sleep(args.think_time)
+
+
+def supervisor(session, stop, args):
+    if not session.login(args.admin_user, args.admin_password):
+        return
+    polls = 0
+    while not stop.is_set():
+        session.request('balance_report', '/balance_report')
+        polls += 1
+        if args.export_every and polls % args.export_every == 0:
+            session.request('export_excel', '/export_excel')
+        time.sleep(args.poll_interval)
+
+
+def ensure_operators(args, count):
+    session = Session(args.url, Recorder(), args.timeout)
+    if not session.login(args.admin_user, args.admin_password):
+        sys.exit(f'Could not log in as {args.admin_user}')
+    for i in range(count):
+        session.request('setup', '/admin/create_user', {
+            'username': f'load_op_{i}', 'name': f'Load Operator {i}', 'department': '', 'password': OPERATOR_PASSWORD,
+        })
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def summarize(users, samples, seconds):
+    rows = []
+    groups = {'ALL': samples}
+    for endpoint, latency, ok in samples:
+        groups.setdefault(endpoint, []).append((endpoint, latency, ok))
+    for endpoint, group in groups.items():
+        if endpoint == 'login':
+            continue
+        latencies = [latency * 1000 for _, latency, _ in group]
+        errors = sum(1 for _, _, ok in group if not ok)
+        rows.append({
+            'users': users,
+            'endpoint': endpoint,
+            'requests': len(group),
+            'throughput_rps': round(len(group) / seconds, 2),
+            'p50_ms': round(percentile(latencies, 50), 1),
+            'p95_ms': round(percentile(latencies, 95), 1),
+            'p99_ms': round(percentile(latencies, 99), 1),
+            'mean_ms': round(statistics.fmean(latencies), 1) if latencies else 0.0,
+            'error_pct': round(errors * 100 / len(group), 2) if group else 0.0,
+        })
+    return rows
+
+
+def run_stage(args, users, recorder):
+    stop = threading.Event()
+    supervisors = max(0, round(users * args.supervisor_ratio))
+    operators = max(1, users - supervisors)
+    threads = []
+    for i in range(operators):
+        session = Session(args.url, recorder, args.timeout)
+        # Production order numbers stay unique across stages
+        threads.append(threading.Thread(target=operator, args=(session, f'load_op_{i}', stop, args, f'{users}.{i}'),
+                                        daemon=True))
+    for _ in range(supervisors):
+        session = Session(args.url, recorder, args.timeout)
+        threads.append(threading.Thread(target=supervisor, args=(session, stop, args), daemon=True))
+
+    for thread in threads:
+        thread.start()
+    time.sleep(args.warmup)
+    recorder.drain()
+    started = time.perf_counter()
+    time.sleep(args.stage_seconds)
+    samples = recorder.drain()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=args.timeout + 5)
+    return summarize(users, samples, elapsed)
+
+
+def launch_gunicorn(args):
+    env = dict(os.environ)
+    if args.database_url:
+        env['DATABASE_URL'] = args.database_url
+    host, port = urllib.parse.urlparse(args.url).hostname, urllib.parse.urlparse(args.url).port or 80
+    # Create tables and seed data once, so workers do not race each other on a fresh database
+    subprocess.run([sys.executable, '-c', 'import main'], cwd=REPO_ROOT, env=env, check=True)
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--bind', f'{host}:{port}', '--workers', str(args.workers),
+         '--threads', str(args.threads), '--log-level', 'warning', 'main:app'],
+        cwd=REPO_ROOT, env=env,
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return process
+        except OSError:
+            if process.poll() is not None:
+                sys.exit('gunicorn exited during startup')
+            time.sleep(0.5)
+    process.terminate()
+    sys.exit('gunicorn did not start listening within 60s')
+
+
+def print_curve(rows, slo_ms):
+    print(f'\n{"users":>6}{"req/s":>10}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"errors %":>10}')
+    best = max((row['throughput_rps'] for row in rows if row['endpoint'] == 'ALL'), default=0) or 1
+    for row in rows:
+        if row['endpoint'] != 'ALL':
+            continue
+        bar = '#' * int(40 * row['throughput_rps'] / best)
+        flag = '  <-- over SLO' if row['p95_ms'] > slo_ms or row['error_pct'] > 1 else ''
+        print(f'{row["users"]:>6}{row["throughput_rps"]:>10}{row["p50_ms"]:>10}{row["p95_ms"]:>10}'
+              f'{row["p99_ms"]:>10}{row["error_pct"]:>10}  {bar}{flag}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:5055', help='Base URL of the instance under test')
+    parser.add_argument('--launch', action='store_true', help='Start gunicorn locally for the run')
+    parser.add_argument('--database-url', help='DATABASE_URL for --launch (SQLite or local PostgreSQL)')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers for --launch')
+    parser.add_argument('--threads', type=int, default=1, help='gunicorn threads per worker for --launch')
+    parser.add_argument('--admin-user', default='admin')
+    parser.add_argument('--admin-password', default='admin123')
+    parser.add_argument('--stages', default='1,2,4,8,16,32', help='Comma-separated concurrent users per stage')
+    parser.add_argument('--stage-seconds', type=float, default=30, help='Measured duration of each stage')
+    parser.add_argument('--warmup', type=float, default=3, help='Unmeasured seconds at the start of each stage')
+    parser.add_argument('--supervisor-ratio', type=float, default=0.2, help='Share of users polling reports')
+    parser.add_argument('--batch-size', type=int, default=10, help='Order lines per save_orders submission')
+    parser.add_argument('--sync-share', type=float, default=0.5,
+                        help='Share of operator batches sent through /api/orders/sync instead of save_orders')
+    parser.add_argument('--think-time', type=float, default=1.0, help='Operator pause between submissions (s)')
+    parser.add_argument('--poll-interval', type=float, default=5.0, help='Supervisor pause between polls (s)')
+    parser.add_argument('--export-every', type=int, default=6, help='Supervisor exports Excel every N polls (0 = never)')
+    parser.add_argument('--timeout', type=float, default=60, help='Per-request timeout (s)')
+    parser.add_argument('--slo-ms', type=float, default=2000, help='p95 latency that counts as collapsed')
+    parser.add_argument('--out', default='load_test_results.csv', help='CSV file for the full results')
+    args = parser.parse_args()
+
+    stages = [int(users) for users in args.stages.split(',') if users.strip()]
+    process = launch_gunicorn(args) if args.launch else None
+    try:
+        ensure_operators(args, max(stages))
+        recorder = Recorder()
+        rows = []
+        for users in stages:
+            print(f'Stage: {users} concurrent users for {args.stage_seconds}s ...', flush=True)
+            stage_rows = run_stage(args, users, recorder)
+            rows.extend(stage_rows)
+            for row in stage_rows:
+                print(f'  {row["endpoint"]:<18}{row["throughput_rps"]:>8} req/s  p95 {row["p95_ms"]:>8} ms  '
+                      f'errors {row["error_pct"]}%')
+    finally:
+        if process:
+            process.terminate()
+            process.wait(timeout=30)
+
+    with open(args.out, 'w', newline='') as out_file:
+        writer = csv.DictWriter(out_file, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+    print_curve(rows, args.slo_ms)
+    print(f'\nFull results written to {args.out}')
+
+
+if __name__ == '__main__':
+    main()
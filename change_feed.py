@@ -0,0 +1,141 @@
+"""Cursor-based change feed over production orders.
+
+Inserts are read from production_order itself in id order; deletes are
+read from order_tombstone, written in the same transaction as the delete.
+The cursor "<order id>-<tombstone id>" holds the last id returned from each.
+"""
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import literal, select
+
+from app import db
+from models import ProductionOrder, OrderTombstone, WorkCenter
+from plants import current_plant
+
+# Newer rows after an unexplained id gap are held back this long, in case the gap is a slower transaction
+FEED_SETTLE_SECONDS = int(os.environ.get("FEED_SETTLE_SECONDS", "10"))
+MAX_PAGE_SIZE = 5000
+
+
+def parse_cursor(value):
+    """'<order id>-<tombstone id>' to a pair of ints; an empty cursor starts from the beginning"""
+    if not value:
+        return 0, 0
+    order_id, tombstone_id = value.split('-', 1)
+    return int(order_id), int(tombstone_id)
+
+
+def format_cursor(order_id, tombstone_id):
+    return f'{order_id}-{tombstone_id}'
+
+
+def record_tombstones(order_filter):
+    """Copy the orders matched by order_filter into order_tombstone before they are deleted; the caller commits"""
+    now = datetime.utcnow()
+    rows = select(
+        ProductionOrder.id, ProductionOrder.production_order, ProductionOrder.workcenter_id,
+        ProductionOrder.plant, ProductionOrder.user_department, literal(now, type_=OrderTombstone.deleted_at.type),
+    ).where(order_filter)
+    plant = current_plant()
+    if plant is not None:
+        rows = rows.where(ProductionOrder.plant == plant)
+    db.session.execute(OrderTombstone.__table__.insert().from_select(
+        ['order_id', 'production_order', 'workcenter_id', 'plant', 'user_department', 'deleted_at'], rows
+    ))
+
+
+def _recent(order, settle_before):
+    """Stored within the settle window; inserted_at, not created_at, which a terminal or import may have backdated"""
+    return order.inserted_at is not None and order.inserted_at > settle_before
+
+
+def _settled_inserts(orders, after_id):
+    """Drop rows from the first recent row that follows an id gap no tombstone explains.
+
+    Ids are looked up in production_order across all plants and without the
+    page's department filter: the sequence is shared by every plant in the
+    database, so orders a consumer may not see are not taken for gaps.
+    """
+    settle_before = datetime.utcnow() - timedelta(seconds=FEED_SETTLE_SECONDS)
+    first_recent = next((index for index, order in enumerate(orders) if _recent(order, settle_before)), None)
+    if first_recent is None:
+        return orders
+    # Gaps before older rows do not hold anything back; only the ids around recent rows are read
+    low = orders[first_recent - 1].id if first_recent else after_id
+    high = orders[-1].id
+    known_ids = {row.id for row in db.session.query(ProductionOrder.id).filter(
+        ProductionOrder.id > low, ProductionOrder.id < high
+    ).execution_options(all_plants=True)}
+    known_ids.update(row.order_id for row in db.session.query(OrderTombstone.order_id).filter(
+        OrderTombstone.order_id > low, OrderTombstone.order_id < high
+    ))
+    expected = low + 1
+    for index in range(first_recent, len(orders)):
+        order = orders[index]
+        gap = any(order_id not in known_ids for order_id in range(expected, order.id))
+        if gap and _recent(order, settle_before):
+            return orders[:index]
+        expected = order.id + 1
+    return orders
+
+
+def read_changes(cursor, limit, department=None):
+    """One page of changes after cursor; returns (changes, next_cursor, has_more).
+
+    With a department, only orders entered by users of that department are returned.
+    """
+    after_order_id, after_tombstone_id = parse_cursor(cursor)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    inserts = db.session.query(ProductionOrder, WorkCenter.name).join(WorkCenter).filter(
+        ProductionOrder.id > after_order_id
+    )
+    if department is not None:
+        inserts = inserts.filter(ProductionOrder.user_department == department)
+    fetched = inserts.order_by(ProductionOrder.id).limit(limit).all()
+    settled = _settled_inserts([order for order, _ in fetched], after_order_id)
+    # Held-back rows are not "more": the consumer should poll again later rather than at once
+    has_more = len(fetched) == limit and len(settled) == len(fetched)
+
+    changes = []
+    for order, workcenter_name in fetched[:len(settled)]:
+        changes.append({
+            'op': 'insert',
+            'id': order.id,
+            'production_order': order.production_order,
+            'workcenter_id': order.workcenter_id,
+            'workcenter_name': workcenter_name,
+            'quantity': order.quantity,
+            'order_type': order.order_type,
+            'remark': order.remark or '',
+            'user_name': order.user_name,
+            'user_department': order.user_department,
+            'created_at': order.created_at.isoformat() if order.created_at else None,
+        })
+        after_order_id = order.id
+
+    # Deletes follow the inserts of the same page, so a consumer never sees a delete before its insert
+    remaining = limit - len(changes)
+    if remaining > 0:
+        tombstones = OrderTombstone.query.filter(OrderTombstone.id > after_tombstone_id)
+        plant = current_plant()
+        if plant is not None:
+            tombstones = tombstones.filter(OrderTombstone.plant == plant)
+        if department is not None:
+            tombstones = tombstones.filter(OrderTombstone.user_department == department)
+        tombstones = tombstones.order_by(OrderTombstone.id).limit(remaining).all()
+        has_more = has_more or len(tombstones) == remaining
+        for tombstone in tombstones:
+            changes.append({
+                'op': 'delete',
+                'id': tombstone.order_id,
+                'production_order': tombstone.production_order,
+                'workcenter_id': tombstone.workcenter_id,
+                'deleted_at': tombstone.deleted_at.isoformat(),
+            })
+            after_tombstone_id = tombstone.id
+    else:
+        has_more = True
+
+    return changes, format_cursor(after_order_id, after_tombstone_id), has_more
@@ -0,0 +1,65 @@
+"""Liveness and readiness probes for load balancers and autoscaling.
+
+Liveness only says the worker answers requests; it never touches the
+database, so a slow database does not get healthy workers restarted.
+Readiness checks what a request needs from the databases: every engine's
+connection pool has a free connection, and a ``SELECT 1`` on each database
+returns within READY_MAX_DB_MS. Schema upgrades and seed data run while
+app.py is imported, before a worker serves anything, so they need no check.
+"""
+import os
+import time
+
+from sqlalchemy import text
+
+# Readiness fails when a database takes longer than this to answer SELECT 1
+READY_MAX_DB_MS = float(os.environ.get("READY_MAX_DB_MS", "500"))
+
+
+def pool_status(pool):
+    """Checked-out and overflow counts of a QueuePool; other pools (e.g. SQLite in memory) report what they have"""
+    status = {'class': type(pool).__name__}
+    for name, attribute in (('size', 'size'), ('checked_out', 'checkedout'), ('checked_in', 'checkedin'),
+                            ('overflow', 'overflow')):
+        if hasattr(pool, attribute):
+            status[name] = getattr(pool, attribute)()
+    if 'overflow' in status:
+        # QueuePool counts up from -size; report only connections opened beyond the pool size
+        status['overflow'] = max(status['overflow'], 0)
+    max_overflow = getattr(pool, '_max_overflow', None)
+    if max_overflow is not None and 'size' in status:
+        status['max_overflow'] = max_overflow
+        # A negative max_overflow means no limit
+        status['saturated'] = max_overflow >= 0 and status['checked_out'] >= status['size'] + max_overflow
+    else:
+        status['saturated'] = False
+    return status
+
+
+def probe_engine(engine):
+    """Pool status and SELECT 1 latency of one engine; a saturated pool is not probed (it would wait for a connection)"""
+    status = {'pool': pool_status(engine.pool)}
+    if status['pool']['saturated']:
+        status['ok'] = False
+        status['error'] = 'connection pool exhausted'
+        return status
+    started = time.perf_counter()
+    try:
+        with engine.connect() as connection:
+            connection.execute(text('SELECT 1'))
+    except Exception as e:
+        status['ok'] = False
+        status['error'] = type(e).__name__
+        return status
+    status['latency_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    status['ok'] = status['latency_ms'] <= READY_MAX_DB_MS
+    if not status['ok']:
+        status['error'] = f'SELECT 1 slower than {READY_MAX_DB_MS:g} ms'
+    return status
+
+
+def readiness(engines):
+    """Readiness report over {name: engine}; returns (ready, report)"""
+    databases = {name: probe_engine(engine) for name, engine in engines.items()}
+    ready = all(database['ok'] for database in databases.values())
+    return ready, {'status': 'ready' if ready else 'not ready', 'databases': databases}
@@ -1,4 +1,7 @@
-from app import app
+# Spawned worker processes (e.g. the Excel export pool) import this file as __mp_main__;
+# they need none of the app, so they skip its startup
+if __name__ != '__mp_main__':
+    from app import app
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
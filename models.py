@@ -1,6 +1,25 @@
 from app import db
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import event
+from sqlalchemy.orm import with_loader_criteria
+from passwords import hash_password, verify_password, needs_rehash
+from plants import PlantSession, current_plant, DEFAULT_PLANT
+
+class PlantMixin:
+    # Plant the row belongs to; set from the current plant on insert
+    plant = db.Column(db.String(20), nullable=False, index=True,
+                      default=lambda: current_plant() or DEFAULT_PLANT, server_default=DEFAULT_PLANT)
+
+@event.listens_for(PlantSession, 'do_orm_execute')
+def _limit_to_current_plant(execute_state):
+    # Queries, bulk updates and deletes only see rows of the current plant
+    plant = current_plant()
+    if plant is None or execute_state.execution_options.get('all_plants'):
+        return
+    if execute_state.is_select or execute_state.is_update or execute_state.is_delete:
+        execute_state.statement = execute_state.statement.options(
+            with_loader_criteria(PlantMixin, lambda cls: cls.plant == plant, include_aliases=True)
+        )
 
 # Association table for many-to-many relationship between WorkCenter and Department
 workcenter_department = db.Table('workcenter_department',
@@ -8,7 +27,7 @@ workcenter_department = db.Table('workcenter_department',
     db.Column('department_id', db.Integer, db.ForeignKey('department.id'), primary_key=True)
 )
 
-class User(db.Model):
+class User(PlantMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     name = db.Column(db.String(100), nullable=True)
@@ -20,15 +39,23 @@ class User(db.Model):
     is_active = db.Column(db.Boolean, default=True, nullable=False)
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
+    
+    def order_snapshot(self):
+        # (name, department) as stored on the orders this user enters
+        return self.name or self.username, self.department
+    
+    def password_needs_rehash(self):
+        # True when the stored hash was made with a different method or cost than configured
+        return needs_rehash(self.password_hash)
     
     def __repr__(self):
         return f'<User {self.username}>'
 
-class WorkCenter(db.Model):
+class WorkCenter(PlantMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     is_active = db.Column(db.Boolean, default=True, nullable=False)
@@ -40,7 +67,7 @@ class WorkCenter(db.Model):
     def __repr__(self):
         return f'<WorkCenter {self.name}>'
 
-class Department(db.Model):
+class Department(PlantMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     is_active = db.Column(db.Boolean, default=True, nullable=False)
@@ -52,7 +79,20 @@ class Department(db.Model):
     def __repr__(self):
         return f'<Department {self.name}>'
 
-class ProductionOrder(db.Model):
+class ProductionOrderHeader(PlantMixin, db.Model):
+    # One row per production order number and plant; orders reference it by header_id
+    id = db.Column(db.Integer, primary_key=True)
+    number = db.Column(db.String(50), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ux_production_order_header_plant_number', 'plant', 'number', unique=True),
+    )
+    
+    def __repr__(self):
+        return f'<ProductionOrderHeader {self.number}>'
+
+class ProductionOrder(PlantMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     production_order = db.Column(db.String(50), nullable=False)
     workcenter_id = db.Column(db.Integer, db.ForeignKey('work_center.id'), nullable=False)
@@ -61,10 +101,114 @@ class ProductionOrder(db.Model):
     remark = db.Column(db.Text, nullable=True)  # New remark field
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Copied from the user at insert time so reports and exports need no join to user
+    user_name = db.Column(db.String(100), nullable=True)
+    user_department = db.Column(db.String(100), nullable=True)
+    # Idempotency key of a line synced from a terminal's offline queue; unique so a resent line is stored once
+    client_key = db.Column(db.String(64), nullable=True, unique=True, index=True)
+    # Integer key of production_order (set on insert, backfilled for older rows)
+    header_id = db.Column(db.Integer, db.ForeignKey('production_order_header.id'), nullable=True)
+    # When the row was stored, by this server's clock; created_at can come from a terminal or an imported file
+    inserted_at = db.Column(db.DateTime, nullable=True, default=datetime.utcnow)
     
     # Relationships
+    header = db.relationship('ProductionOrderHeader')
     workcenter = db.relationship('WorkCenter', backref='production_orders')
     user = db.relationship('User', backref='production_orders')
     
+    __table_args__ = (
+        # Balance lookups and deletes are by (production order, work center); created_at orders each pair's history
+        db.Index('ix_production_order_order_workcenter_created', 'production_order', 'workcenter_id', 'created_at'),
+        # Department-scoped exports read newest first
+        db.Index('ix_production_order_department_created', 'user_department', 'created_at'),
+        # Date-range reads such as incremental Parquet exports
+        db.Index('ix_production_order_created', 'created_at'),
+        # Per-work-center Excel sheets read newest first
+        db.Index('ix_production_order_workcenter_created', 'workcenter_id', 'created_at'),
+        # Deletes and lookups by (header, work center), the integer form of the first index
+        db.Index('ix_production_order_header_workcenter_created', 'header_id', 'workcenter_id', 'created_at'),
+    )
+    
+    def set_user(self, user):
+        self.user_id = user.id
+        self.user_name, self.user_department = user.order_snapshot()
+    
     def __repr__(self):
         return f'<ProductionOrder {self.production_order} - {self.order_type}>'
+
+class OpenWip(db.Model):
+    # One row per (production order, work center) whose current balance is not zero
+    production_order = db.Column(db.String(50), primary_key=True)
+    workcenter_id = db.Column(db.Integer, primary_key=True, index=True)
+    balance = db.Column(db.Integer, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<OpenWip {self.production_order} - {self.workcenter_id}: {self.balance}>'
+
+class OrderTombstone(db.Model):
+    # One row per deleted production order, read by the change feed; id is the delete cursor
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, nullable=False, index=True)
+    production_order = db.Column(db.String(50), nullable=False)
+    workcenter_id = db.Column(db.Integer, nullable=False)
+    plant = db.Column(db.String(20), nullable=True, index=True)
+    # Department of the deleted order, so the feed shows non-admins only their department's deletes
+    user_department = db.Column(db.String(100), nullable=True)
+    deleted_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    def __repr__(self):
+        return f'<OrderTombstone {self.order_id}>'
+
+class PurgeJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(20), default='pending', nullable=False)  # 'pending', 'running', 'done' or 'failed'
+    pairs = db.Column(db.Text, nullable=False)  # JSON list of [header_id, workcenter_id]
+    total_rows = db.Column(db.Integer, default=0, nullable=False)
+    deleted_rows = db.Column(db.Integer, default=0, nullable=False)
+    error = db.Column(db.Text, nullable=True)
+    created_by = db.Column(db.Integer, nullable=True)  # user id, kept without FK so users stay deletable
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    def __repr__(self):
+        return f'<PurgeJob {self.id} - {self.status}>'
+
+class BalanceCheckpoint(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    taken_at = db.Column(db.DateTime, unique=True, index=True, nullable=False)  # Covers orders created before this instant (UTC)
+    row_count = db.Column(db.Integer, default=0, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<BalanceCheckpoint {self.taken_at}>'
+
+class BalanceSnapshot(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    checkpoint_id = db.Column(db.Integer, db.ForeignKey('balance_checkpoint.id', ondelete='CASCADE'), nullable=False)
+    production_order = db.Column(db.String(50), nullable=False)
+    workcenter_id = db.Column(db.Integer, nullable=False)
+    total_in = db.Column(db.Integer, default=0, nullable=False)
+    total_out = db.Column(db.Integer, default=0, nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_balance_snapshot_checkpoint_key', 'checkpoint_id', 'production_order', 'workcenter_id'),
+    )
+    
+    def __repr__(self):
+        return f'<BalanceSnapshot {self.production_order} - {self.workcenter_id}>'
+
+class ImportJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    filename = db.Column(db.String(255), nullable=False)
+    status = db.Column(db.String(20), default='pending', nullable=False)  # 'pending', 'validating', 'loading', 'done' or 'failed'
+    total_rows = db.Column(db.Integer, default=0, nullable=False)
+    loaded_rows = db.Column(db.Integer, default=0, nullable=False)
+    rejected_rows = db.Column(db.Integer, default=0, nullable=False)
+    error = db.Column(db.Text, nullable=True)
+    created_by = db.Column(db.Integer, nullable=True)  # user id, kept without FK so users stay deletable
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    def __repr__(self):
+        return f'<ImportJob {self.id} - {self.status}>'
@@ -0,0 +1,122 @@
+from datetime import datetime
+
+import click
+from sqlalchemy import and_, case, func, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import app, db
+from models import ProductionOrder, OpenWip
+from plants import plant_option
+
+# Keys written or cleaned up per statement
+WIP_BATCH_SIZE = 500
+
+
+def signed_quantity():
+    """IN adds to the balance, OUT takes from it"""
+    return case((ProductionOrder.order_type == 'IN', ProductionOrder.quantity), else_=-ProductionOrder.quantity)
+
+
+def join_open_wip(query):
+    """Restrict a ProductionOrder query to (production_order, workcenter_id) pairs with a non-zero balance"""
+    return query.join(OpenWip, and_(
+        OpenWip.production_order == ProductionOrder.production_order,
+        OpenWip.workcenter_id == ProductionOrder.workcenter_id,
+    ))
+
+
+def wip_deltas(records):
+    """Balance change per (production_order, workcenter_id) for newly inserted orders (dicts or ProductionOrder rows)"""
+    deltas = {}
+    for record in records:
+        if isinstance(record, dict):
+            production_order, workcenter_id = record['production_order'], record['workcenter_id']
+            order_type, quantity = record['order_type'], record['quantity']
+        else:
+            production_order, workcenter_id = record.production_order, record.workcenter_id
+            order_type, quantity = record.order_type, record.quantity
+        key = (production_order, workcenter_id)
+        deltas[key] = deltas.get(key, 0) + ((quantity or 0) if order_type == 'IN' else -(quantity or 0))
+    return deltas
+
+
+def wip_deltas_for_delete(order_filter):
+    """Balance change per (production_order, workcenter_id) if the orders matched by order_filter are deleted"""
+    rows = db.session.query(
+        ProductionOrder.production_order,
+        ProductionOrder.workcenter_id,
+        func.sum(signed_quantity()),
+    ).filter(order_filter).group_by(ProductionOrder.production_order, ProductionOrder.workcenter_id)
+    return {(production_order, workcenter_id): -int(balance or 0) for production_order, workcenter_id, balance in rows}
+
+
+def apply_wip_deltas(deltas):
+    """Add balance changes to the open-WIP index and drop pairs that reach zero; the caller commits.
+
+    The balance is incremented in the database rather than recomputed, so
+    concurrent saves for the same pair serialise on its row instead of
+    overwriting each other.
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    now = datetime.utcnow()
+    keys = list(deltas)
+    table = OpenWip.__table__
+    dialect = db.session.get_bind(mapper=OpenWip).dialect.name
+
+    for start in range(0, len(keys), WIP_BATCH_SIZE):
+        batch = keys[start:start + WIP_BATCH_SIZE]
+        if dialect in ('postgresql', 'sqlite'):
+            insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+            statement = insert(table)
+            statement = statement.on_conflict_do_update(
+                index_elements=['production_order', 'workcenter_id'],
+                set_={'balance': table.c.balance + statement.excluded.balance, 'updated_at': now},
+            )
+            db.session.execute(statement, [{
+                'production_order': production_order,
+                'workcenter_id': workcenter_id,
+                'balance': deltas[(production_order, workcenter_id)],
+                'updated_at': now,
+            } for production_order, workcenter_id in batch])
+        else:
+            for production_order, workcenter_id in batch:
+                updated = db.session.execute(table.update().where(
+                    table.c.production_order == production_order, table.c.workcenter_id == workcenter_id
+                ).values(balance=table.c.balance + deltas[(production_order, workcenter_id)], updated_at=now))
+                if updated.rowcount == 0:
+                    db.session.execute(table.insert().values(
+                        production_order=production_order, workcenter_id=workcenter_id,
+                        balance=deltas[(production_order, workcenter_id)], updated_at=now,
+                    ))
+
+        OpenWip.query.filter(
+            tuple_(OpenWip.production_order, OpenWip.workcenter_id).in_(batch),
+            OpenWip.balance == 0
+        ).delete(synchronize_session=False)
+
+
+def rebuild_open_wip():
+    """Recompute the open-WIP index from the full order history of the database, all plants in it; the caller commits"""
+    OpenWip.query.delete(synchronize_session=False)
+    balance = func.sum(signed_quantity())
+    totals = db.session.query(
+        ProductionOrder.production_order,
+        ProductionOrder.workcenter_id,
+        balance,
+        func.max(ProductionOrder.created_at),
+    ).group_by(ProductionOrder.production_order, ProductionOrder.workcenter_id).having(balance != 0)
+    result = db.session.execute(OpenWip.__table__.insert().from_select(
+        ['production_order', 'workcenter_id', 'balance', 'updated_at'], totals
+    ))
+    return result.rowcount
+
+
+@app.cli.command('rebuild-open-wip')
+@plant_option
+def rebuild_open_wip_command():
+    """Rebuild the open-WIP index, e.g. after orders were changed outside the application"""
+    count = rebuild_open_wip()
+    db.session.commit()
+    click.echo(f'Open WIP index rebuilt: {count} open pairs')
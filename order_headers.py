@@ -0,0 +1,127 @@
+"""Production order numbers, stored once per plant in production_order_header.
+
+Each IN/OUT row references its number by header_id, so lookups, deletes
+and grouping by production order compare integers instead of the free-text
+number repeated on every row. The number stays on production_order too,
+for reports and exports that display it.
+"""
+from datetime import datetime
+
+import click
+from sqlalchemy import and_, func, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import app, db
+from models import ProductionOrder, ProductionOrderHeader
+from plants import DEFAULT_PLANT, current_plant, plant_option
+
+# Numbers looked up or created per statement
+HEADER_BATCH_SIZE = 500
+
+
+def _plant():
+    # The plant new orders are stored under (see PlantMixin)
+    return current_plant() or DEFAULT_PLANT
+
+
+def header_ids(numbers, create=True):
+    """{number: header id} for the current plant, creating headers for new numbers unless create is False"""
+    numbers = list({number for number in numbers if number})
+    plant = _plant()
+    headers = db.session.query(ProductionOrderHeader.number, ProductionOrderHeader.id).filter(
+        ProductionOrderHeader.plant == plant
+    )
+    ids = {}
+    for start in range(0, len(numbers), HEADER_BATCH_SIZE):
+        ids.update(headers.filter(ProductionOrderHeader.number.in_(numbers[start:start + HEADER_BATCH_SIZE])))
+
+    missing = [number for number in numbers if number not in ids]
+    if not create or not missing:
+        return ids
+
+    now = datetime.utcnow()
+    table = ProductionOrderHeader.__table__
+    dialect = db.session.get_bind(mapper=ProductionOrderHeader).dialect.name
+    for start in range(0, len(missing), HEADER_BATCH_SIZE):
+        batch = missing[start:start + HEADER_BATCH_SIZE]
+        rows = [{'plant': plant, 'number': number, 'created_at': now} for number in batch]
+        if dialect in ('postgresql', 'sqlite'):
+            # Another save may create the same number at the same time; both then read the one row
+            insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+            db.session.execute(insert(table).on_conflict_do_nothing(index_elements=['plant', 'number']), rows)
+        else:
+            db.session.execute(table.insert(), rows)
+        ids.update(headers.filter(ProductionOrderHeader.number.in_(batch)))
+    return ids
+
+
+def assign_headers(records):
+    """Set header_id on new orders (dicts or ProductionOrder rows) before they are inserted"""
+    records = list(records)
+    # Pending ProductionOrder rows must not be flushed by the lookup, or header_id would cost an UPDATE each
+    with db.session.no_autoflush:
+        ids = header_ids(
+            record['production_order'] if isinstance(record, dict) else record.production_order for record in records
+        )
+    for record in records:
+        if isinstance(record, dict):
+            record['header_id'] = ids.get(record['production_order'])
+        else:
+            record.header_id = ids.get(record.production_order)
+
+
+def header_numbers(ids):
+    """{header id: number} for the given header ids"""
+    ids = list(set(ids))
+    numbers = {}
+    for start in range(0, len(ids), HEADER_BATCH_SIZE):
+        numbers.update(db.session.query(ProductionOrderHeader.id, ProductionOrderHeader.number).filter(
+            ProductionOrderHeader.id.in_(ids[start:start + HEADER_BATCH_SIZE])
+        ))
+    return numbers
+
+
+def number_pairs(pairs):
+    """(header_id, workcenter_id) pairs as (production_order, workcenter_id), e.g. for live balance updates"""
+    pairs = list(pairs)
+    numbers = header_numbers(header_id for header_id, _ in pairs)
+    return [(numbers[header_id], workcenter_id) for header_id, workcenter_id in pairs if header_id in numbers]
+
+
+def number_matches(search):
+    """Filter for orders whose production order number contains search, matched on the headers"""
+    return ProductionOrder.header_id.in_(
+        select(ProductionOrderHeader.id).where(ProductionOrderHeader.number.contains(search))
+    )
+
+
+def backfill_order_headers():
+    """Create headers for numbers that have none and link every order without a header_id; the caller commits.
+
+    Covers all plants in the database. Returns (headers created, orders linked).
+    """
+    headers = ProductionOrderHeader.__table__
+    orders = ProductionOrder.__table__
+    unlinked = select(orders.c.plant, orders.c.production_order, func.min(orders.c.created_at)).select_from(
+        orders.outerjoin(headers, and_(headers.c.plant == orders.c.plant,
+                                       headers.c.number == orders.c.production_order))
+    ).where(orders.c.header_id.is_(None), headers.c.id.is_(None)).group_by(
+        orders.c.plant, orders.c.production_order
+    )
+    created = db.session.execute(headers.insert().from_select(['plant', 'number', 'created_at'], unlinked))
+
+    linked = db.session.execute(orders.update().where(orders.c.header_id.is_(None)).values(
+        header_id=select(headers.c.id).where(
+            headers.c.plant == orders.c.plant, headers.c.number == orders.c.production_order
+        ).scalar_subquery()
+    ).execution_options(all_plants=True))
+    return created.rowcount, linked.rowcount
+
+
+@app.cli.command('backfill-order-headers')
+@plant_option
+def backfill_order_headers_command():
+    """Link orders stored without a header_id (e.g. by an older version during a rolling deploy) to their numbers"""
+    created, linked = backfill_order_headers()
+    db.session.commit()
+    click.echo(f'Created {created} production order header(s), linked {linked} order(s)')
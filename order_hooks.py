@@ -0,0 +1,26 @@
+"""Derived data kept in step with production_order inserts and deletes.
+
+Every code path that adds or removes order rows calls these inside its own
+transaction, before committing, so the derived tables commit (or roll back)
+together with the orders.
+"""
+from balance_snapshots import checkpoints_deleting, checkpoints_inserted
+from change_feed import record_tombstones
+from open_wip import apply_wip_deltas, wip_deltas, wip_deltas_for_delete
+
+
+def orders_inserted(records):
+    """Call after adding orders (dicts or ProductionOrder rows) to the session, before committing"""
+    records = list(records)
+    if not records:
+        return
+    apply_wip_deltas(wip_deltas(records))
+    # Backdated rows change history that balance checkpoints already counted
+    checkpoints_inserted(records)
+
+
+def orders_deleting(order_filter):
+    """Call before deleting the orders matched by order_filter"""
+    apply_wip_deltas(wip_deltas_for_delete(order_filter))
+    checkpoints_deleting(order_filter)
+    record_tombstones(order_filter)
@@ -0,0 +1,343 @@
+import csv
+import io
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from openpyxl import load_workbook  # type: ignore
+from sqlalchemy import case, func, or_
+
+from app import app, db
+from models import ProductionOrder, WorkCenter, User, ImportJob
+from order_headers import assign_headers
+from order_hooks import orders_inserted
+from plants import DEFAULT_PLANT, current_plant, in_current_plant
+
+# Uploads live here until their job is done (failed jobs keep theirs for a retry); reject files stay
+IMPORT_DIR = os.environ.get("IMPORT_DIR") or os.path.join(app.instance_path, 'imports')
+# Rows loaded (and committed) per batch
+BATCH_SIZE = int(os.environ.get("IMPORT_BATCH_SIZE", "5000"))
+# Production orders checked per missing-IN lookup
+LOOKUP_BATCH_SIZE = 500
+
+ALLOWED_EXTENSIONS = ('.xlsx', '.csv')
+REQUIRED_COLUMNS = ('production_order', 'workcenter_id', 'quantity', 'order_type')
+OPTIONAL_COLUMNS = ('remark', 'created_at', 'username')
+COPY_COLUMNS = ('production_order', 'workcenter_id', 'quantity', 'order_type', 'remark', 'user_id', 'created_at',
+                'user_name', 'user_department', 'plant', 'header_id', 'client_key', 'inserted_at')
+
+
+def upload_path(job):
+    return os.path.join(IMPORT_DIR, job.filename)
+
+
+def reject_path(job):
+    return os.path.join(IMPORT_DIR, f'import_{job.id}_rejects.csv')
+
+
+def client_key_prefix(job):
+    # Rows are stored with client_key <prefix><row number>, so a retried job skips the rows it already loaded
+    return f'import-{job.id}-'
+
+
+def _header(values):
+    return [str(value).strip().lower().replace(' ', '_') if value is not None else '' for value in values]
+
+
+def iter_rows(path):
+    """Yield one dict per data row, streamed from an xlsx (read-only mode) or CSV file"""
+    if path.lower().endswith('.xlsx'):
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = _header(next(rows, ()))
+            for values in rows:
+                if values and any(value is not None and value != '' for value in values):
+                    yield dict(zip(header, values))
+        finally:
+            workbook.close()
+    else:
+        with open(path, newline='', encoding='utf-8-sig') as csv_file:
+            reader = csv.reader(csv_file)
+            header = _header(next(reader, []))
+            for values in reader:
+                if any(value.strip() for value in values):
+                    yield dict(zip(header, values))
+
+
+def _parse_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    value = str(value).strip()
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"invalid created_at '{value}'")
+
+
+def parse_row(raw, workcenter_ids, user_ids, user_snapshots, default_user_id, now):
+    """Validate one raw row against master data held in memory; returns (record, reject_reason)"""
+    production_order = str(raw.get('production_order') or '').strip()
+    if not production_order:
+        return None, 'missing production_order'
+    if len(production_order) > 50:
+        return None, 'production_order longer than 50 characters'
+
+    try:
+        workcenter_id = int(float(str(raw.get('workcenter_id')).strip()))
+    except (TypeError, ValueError):
+        return None, f"invalid workcenter_id '{raw.get('workcenter_id')}'"
+    if workcenter_id not in workcenter_ids:
+        return None, f'unknown or inactive work center {workcenter_id}'
+
+    quantity = raw.get('quantity')
+    try:
+        quantity = int(float(str(quantity).strip())) if quantity not in (None, '') else 0
+    except ValueError:
+        return None, f"invalid quantity '{quantity}'"
+    if quantity < 0:
+        return None, 'negative quantity'
+
+    order_type = str(raw.get('order_type') or '').strip().upper()
+    if order_type not in ('IN', 'OUT'):
+        return None, f"order_type must be IN or OUT, got '{raw.get('order_type')}'"
+
+    created_at = now
+    if raw.get('created_at') not in (None, ''):
+        try:
+            created_at = _parse_datetime(raw['created_at'])
+        except ValueError as e:
+            return None, str(e)
+
+    user_id = default_user_id
+    username = str(raw.get('username') or '').strip()
+    if username:
+        if username not in user_ids:
+            return None, f"unknown user '{username}'"
+        user_id = user_ids[username]
+    user_name, user_department = user_snapshots.get(user_id, (None, None))
+
+    return {
+        'production_order': production_order,
+        'workcenter_id': workcenter_id,
+        'quantity': quantity,
+        'order_type': order_type,
+        'remark': str(raw.get('remark') or '').strip(),
+        'user_id': user_id,
+        'created_at': created_at,
+        'user_name': user_name,
+        'user_department': user_department,
+    }, None
+
+
+def blocked_production_orders(file_counts, job=None):
+    """Apply the save_orders missing-IN rule to every production order with OUT rows in the file.
+
+    IN/OUT entries of the last 30 days in the database are added to the
+    entries in the file itself. Rows a retried job already loaded are in the
+    file, so they are not counted again from the database.
+    """
+    out_orders = [po for po, (ins, outs) in file_counts.items() if outs]
+    thirty_days_ago = datetime.utcnow() - timedelta(days=30)
+    db_counts = {}
+    for start in range(0, len(out_orders), LOOKUP_BATCH_SIZE):
+        rows = db.session.query(
+            ProductionOrder.production_order,
+            func.sum(case((ProductionOrder.order_type == 'IN', 1), else_=0)),
+            func.sum(case((ProductionOrder.order_type == 'OUT', 1), else_=0)),
+        ).filter(
+            ProductionOrder.production_order.in_(out_orders[start:start + LOOKUP_BATCH_SIZE]),
+            ProductionOrder.created_at >= thirty_days_ago
+        )
+        if job is not None:
+            rows = rows.filter(or_(ProductionOrder.client_key.is_(None),
+                                   ~ProductionOrder.client_key.startswith(client_key_prefix(job))))
+        rows = rows.group_by(ProductionOrder.production_order)
+        for production_order, ins, outs in rows:
+            db_counts[production_order] = (int(ins or 0), int(outs or 0))
+
+    blocked = {}
+    for production_order in out_orders:
+        db_in, db_out = db_counts.get(production_order, (0, 0))
+        file_in, file_out = file_counts[production_order]
+        existing_in_orders = db_in + file_in
+        existing_out_orders = db_out + file_out
+        if existing_in_orders == 0:
+            blocked[production_order] = 'no IN entries found in the last 30 days'
+        elif existing_out_orders >= existing_in_orders * 2:
+            blocked[production_order] = (f'only {existing_in_orders} IN entries vs {existing_out_orders} OUT entries, '
+                                         f'balance may be incorrect')
+    return blocked
+
+
+def load_batch(records):
+    """Insert a batch with COPY on PostgreSQL, executemany elsewhere; the caller commits"""
+    # COPY skips column defaults
+    inserted_at = datetime.utcnow()
+    for record in records:
+        record['inserted_at'] = inserted_at
+    if db.session.get_bind(mapper=ProductionOrder).dialect.name == 'postgresql':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for record in records:
+            writer.writerow([record[column] for column in COPY_COLUMNS])
+        buffer.seek(0)
+        connection = db.session.connection(bind_arguments={'mapper': db.inspect(ProductionOrder)})
+        dbapi_connection = connection.connection.dbapi_connection
+        with dbapi_connection.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY production_order ({', '.join(COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer
+            )
+    else:
+        db.session.execute(ProductionOrder.__table__.insert(), records)
+
+
+def start_import_job(upload, user_id, after_load=None):
+    """Save the uploaded file, record an import job and run it on a background thread"""
+    extension = os.path.splitext(upload.filename or '')[1].lower()
+    if extension not in ALLOWED_EXTENSIONS:
+        raise ValueError('Only .xlsx and .csv files can be imported')
+
+    os.makedirs(IMPORT_DIR, exist_ok=True)
+    job = ImportJob()
+    job.filename = f'{uuid.uuid4().hex}{extension}'
+    job.created_by = user_id
+    upload.save(upload_path(job))
+    db.session.add(job)
+    db.session.commit()
+
+    _start_thread(job, after_load)
+    return job
+
+
+def retry_import_job(job, after_load=None):
+    """Run a failed import again from its kept upload; rows it already loaded are skipped.
+
+    Returns False if the job is not failed (e.g. already retried) or its upload is gone.
+    """
+    if job.status != 'failed' or not os.path.exists(upload_path(job)):
+        return False
+    # Only one retry of a job may start, however often it is requested
+    claimed = ImportJob.query.filter_by(id=job.id, status='failed').update(
+        {'status': 'pending', 'error': None, 'finished_at': None}, synchronize_session=False
+    )
+    db.session.commit()
+    if not claimed:
+        return False
+    _start_thread(job, after_load)
+    return True
+
+
+def _start_thread(job, after_load):
+    thread = threading.Thread(target=in_current_plant(run_import_job), args=(job.id, after_load),
+                              name=f'import-job-{job.id}', daemon=True)
+    thread.start()
+
+
+def run_import_job(job_id, after_load=None):
+    with app.app_context():
+        job = db.session.get(ImportJob, job_id)
+        if job is None:
+            return
+        path = upload_path(job)
+
+        try:
+            job.status = 'validating'
+            db.session.commit()
+
+            # Master data is small: validate against it in memory rather than per row
+            workcenter_ids = {row.id for row in db.session.query(WorkCenter.id).filter(WorkCenter.is_active == True)}
+            users = User.query.all()
+            user_ids = {user.username: user.id for user in users}
+            user_snapshots = {user.id: user.order_snapshot() for user in users}
+            now = datetime.utcnow()
+            plant = current_plant() or DEFAULT_PLANT
+
+            # First pass: count rows and collect IN/OUT entries per production order for the missing-IN rule
+            total_rows = 0
+            file_counts = {}
+            for raw in iter_rows(path):
+                total_rows += 1
+                if total_rows == 1:
+                    missing = [column for column in REQUIRED_COLUMNS if column not in raw]
+                    if missing:
+                        raise ValueError(f"Missing column(s): {', '.join(missing)}")
+                record, reason = parse_row(raw, workcenter_ids, user_ids, user_snapshots, job.created_by, now)
+                if record:
+                    counts = file_counts.setdefault(record['production_order'], [0, 0])
+                    counts[0 if record['order_type'] == 'IN' else 1] += 1
+            blocked = blocked_production_orders(file_counts, job)
+
+            job.total_rows = total_rows
+            # A retry counts every row again; rows loaded by the failed run are counted as they are skipped
+            job.loaded_rows = 0
+            job.rejected_rows = 0
+            job.status = 'loading'
+            db.session.commit()
+
+            # Second pass: load valid rows in bounded batches, write everything else to the reject file
+            changed_keys = set()
+            with open(reject_path(job), 'w', newline='', encoding='utf-8') as reject_file:
+                rejects = csv.writer(reject_file)
+                rejects.writerow(['row', 'reason'] + list(REQUIRED_COLUMNS + OPTIONAL_COLUMNS))
+                batch = []
+                for row_number, raw in enumerate(iter_rows(path), 2):
+                    record, reason = parse_row(raw, workcenter_ids, user_ids, user_snapshots, job.created_by, now)
+                    if record and record['order_type'] == 'OUT' and record['production_order'] in blocked:
+                        record, reason = None, blocked[record['production_order']]
+                    if record is None:
+                        rejects.writerow([row_number, reason] +
+                                         [raw.get(column, '') for column in REQUIRED_COLUMNS + OPTIONAL_COLUMNS])
+                        job.rejected_rows += 1
+                        continue
+
+                    record['plant'] = plant
+                    record['client_key'] = f'{client_key_prefix(job)}{row_number}'
+                    batch.append(record)
+                    changed_keys.add((record['production_order'], record['workcenter_id']))
+                    if len(batch) >= BATCH_SIZE:
+                        _commit_batch(job, batch)
+                        batch = []
+                if batch:
+                    _commit_batch(job, batch)
+
+            job.status = 'done'
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+            try:
+                os.remove(path)
+            except OSError as e:
+                app.logger.warning(f'Could not remove upload of import job {job_id}: {str(e)}')
+
+            if after_load and changed_keys:
+                keys = list(changed_keys)
+                for start in range(0, len(keys), LOOKUP_BATCH_SIZE):
+                    after_load(keys[start:start + LOOKUP_BATCH_SIZE])
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f'Import job {job_id} failed: {str(e)}')
+            job = db.session.get(ImportJob, job_id)
+            job.status = 'failed'
+            job.error = str(e)
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+
+
+def _commit_batch(job, batch):
+    """Load the rows of a batch not yet stored by an earlier run of the job, and commit"""
+    keys = [record['client_key'] for record in batch]
+    stored = set()
+    for start in range(0, len(keys), LOOKUP_BATCH_SIZE):
+        stored.update(key for key, in db.session.query(ProductionOrder.client_key).filter(
+            ProductionOrder.client_key.in_(keys[start:start + LOOKUP_BATCH_SIZE])
+        ).execution_options(all_plants=True))
+    records = [record for record in batch if record['client_key'] not in stored]
+    if records:
+        assign_headers(records)
+        orders_inserted(records)
+        load_batch(records)
+    job.loaded_rows += len(batch)
+    db.session.commit()
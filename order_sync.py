@@ -0,0 +1,152 @@
+"""Batched, idempotent order sync for terminals that queue entries offline.
+
+Each line carries a key generated on the terminal when the operator saved
+it. The key is stored on the order row under a unique index, so a batch
+that is sent again after a timeout, or by two tabs at once, inserts every
+line at most once.
+"""
+import os
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from models import ProductionOrder, WorkCenter
+from order_headers import assign_headers
+from order_hooks import orders_inserted
+from order_import import blocked_production_orders
+from plants import DEFAULT_PLANT, current_plant
+
+# Lines accepted per request; terminals send larger queues in several batches
+SYNC_BATCH_LIMIT = int(os.environ.get("ORDER_SYNC_BATCH_LIMIT", "500"))
+MAX_KEY_LENGTH = 64
+# Oldest entry time accepted from a terminal; each backdated line is added to the balance checkpoints taken after it
+SYNC_MAX_OFFLINE_HOURS = int(os.environ.get("ORDER_SYNC_MAX_OFFLINE_HOURS", "72"))
+
+
+def _parse_entered_at(value, now):
+    """Time the line was entered on the terminal (UTC, ISO 8601); never later than now"""
+    if not value:
+        return now
+    entered_at = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if entered_at.tzinfo is not None:
+        entered_at = entered_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return min(entered_at, now)
+
+
+def parse_line(raw, workcenter_ids, now):
+    """Validate one queued line; returns (record, None) or (None, reason)"""
+    order_type = str(raw.get('order_type') or '').strip().upper()
+    if order_type not in ('IN', 'OUT'):
+        return None, 'order_type must be IN or OUT'
+
+    production_order = str(raw.get('production_order') or '').strip()
+    if not production_order:
+        return None, 'missing production order'
+    if len(production_order) > 50:
+        return None, 'production order longer than 50 characters'
+
+    try:
+        workcenter_id = int(raw.get('workcenter_id'))
+    except (TypeError, ValueError):
+        return None, 'missing work center'
+    if workcenter_id not in workcenter_ids:
+        return None, f'unknown work center {workcenter_id}'
+
+    try:
+        quantity = int(raw.get('quantity'))
+    except (TypeError, ValueError):
+        return None, 'quantity is not a whole number'
+    if quantity <= 0:
+        return None, 'quantity must be positive'
+
+    try:
+        created_at = _parse_entered_at(raw.get('entered_at'), now)
+    except ValueError:
+        return None, 'entered_at is not an ISO 8601 time'
+    if created_at < now - timedelta(hours=SYNC_MAX_OFFLINE_HOURS):
+        return None, f'entered more than {SYNC_MAX_OFFLINE_HOURS} hours ago, enter it again'
+
+    return {
+        'production_order': production_order,
+        'workcenter_id': workcenter_id,
+        'quantity': quantity,
+        'order_type': order_type,
+        'remark': str(raw.get('remark') or '').strip(),
+        'created_at': created_at,
+    }, None
+
+
+def _save_lines(lines, user):
+    now = datetime.utcnow()
+    lines = [line if isinstance(line, dict) else {} for line in lines]
+    keys = [str(line.get('key') or '').strip() for line in lines]
+    existing = {key for key, in db.session.query(ProductionOrder.client_key).filter(
+        ProductionOrder.client_key.in_([key for key in keys if key])
+    ).execution_options(all_plants=True)}
+    workcenter_ids = {workcenter_id for workcenter_id, in db.session.query(WorkCenter.id)}
+
+    results = []
+    accepted = []
+    seen = set()
+    for key, line in zip(keys, lines):
+        if not key or len(key) > MAX_KEY_LENGTH:
+            results.append({'key': key, 'status': 'rejected', 'error': 'missing or invalid key'})
+            continue
+        if key in existing or key in seen:
+            results.append({'key': key, 'status': 'duplicate'})
+            continue
+        seen.add(key)
+        if str(line.get('user_id') or user.id) != str(user.id):
+            # Queued by someone else on a shared terminal; kept there until they sync it
+            results.append({'key': key, 'status': 'other_user'})
+            continue
+        record, error = parse_line(line, workcenter_ids, now)
+        if error:
+            results.append({'key': key, 'status': 'rejected', 'error': error})
+            continue
+        results.append({'key': key, 'status': 'saved'})
+        accepted.append((results[-1], key, record))
+
+    # The missing-IN rule of save_orders, counting the IN and OUT lines of this batch too
+    file_counts = {}
+    for _, _, record in accepted:
+        ins, outs = file_counts.get(record['production_order'], (0, 0))
+        file_counts[record['production_order']] = (ins + (record['order_type'] == 'IN'),
+                                                   outs + (record['order_type'] == 'OUT'))
+    blocked = blocked_production_orders(file_counts)
+
+    user_name, user_department = user.order_snapshot()
+    plant = current_plant() or DEFAULT_PLANT
+    records = []
+    for result, key, record in accepted:
+        reason = blocked.get(record['production_order'])
+        if reason and record['order_type'] == 'OUT':
+            result.update(status='rejected', error=f"Production Order '{record['production_order']}': {reason}")
+            continue
+        record.update(client_key=key, user_id=user.id, user_name=user_name, user_department=user_department,
+                      plant=plant)
+        records.append(record)
+
+    # One executemany for the batch, as in bulk imports
+    if records:
+        assign_headers(records)
+        db.session.execute(ProductionOrder.__table__.insert(), records)
+        orders_inserted(records)
+    db.session.commit()
+    return results, {(record['production_order'], record['workcenter_id']) for record in records}
+
+
+def sync_lines(lines, user):
+    """Insert queued lines not stored yet; returns (per-line results, changed balance keys).
+
+    Each result is {'key', 'status'} with status 'saved', 'duplicate' (stored
+    by an earlier sync), 'rejected' (with 'error'; the terminal does not
+    resend it on its own) or 'other_user'.
+    """
+    try:
+        return _save_lines(lines, user)
+    except IntegrityError:
+        # Another request stored some of these keys between our check and commit; they are duplicates now
+        db.session.rollback()
+        return _save_lines(lines, user)
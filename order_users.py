@@ -0,0 +1,33 @@
+import click
+
+from app import app, db
+from models import ProductionOrder, User
+from plants import plant_option
+
+
+def backfill_order_users(refresh=False):
+    """Copy each user's name and department onto their orders; the caller commits.
+
+    Only rows without a snapshot are filled unless refresh is set, in which
+    case every row takes the user's current values. One UPDATE per user, so
+    the cost follows the (small) number of users.
+    """
+    updated = 0
+    for user in User.query.all():
+        user_name, user_department = user.order_snapshot()
+        query = ProductionOrder.query.filter(ProductionOrder.user_id == user.id)
+        if not refresh:
+            query = query.filter(ProductionOrder.user_name.is_(None))
+        updated += query.update({'user_name': user_name, 'user_department': user_department},
+                                synchronize_session=False)
+    return updated
+
+
+@app.cli.command('backfill-order-users')
+@plant_option
+@click.option('--refresh', is_flag=True, help="Overwrite existing snapshots with each user's current name and department.")
+def backfill_order_users_command(refresh):
+    """Store user name and department on orders entered before they were recorded on each row"""
+    updated = backfill_order_users(refresh=refresh)
+    db.session.commit()
+    click.echo(f'Updated {updated} order(s)')
@@ -0,0 +1,215 @@
+"""Typed Parquet export of the order history for pandas, DuckDB and BI tools.
+
+pyarrow is optional (``pip install pyarrow`` or the ``parquet`` extra); the
+rest of the application runs without it. Rows are read through a
+server-side cursor and each chunk becomes one row group, so memory stays
+bounded by PARQUET_CHUNK_SIZE whatever the table size.
+
+    flask --app main export-parquet exports/orders.parquet
+    flask --app main export-parquet exports/orders --partition-by-date
+    flask --app main export-parquet exports/orders --partition-by-date --incremental
+"""
+import os
+from datetime import datetime, timedelta
+from itertools import groupby
+
+import click
+
+from app import app, db
+from models import ProductionOrder, WorkCenter
+from plants import plant_option
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# Rows per server-side cursor fetch and per Parquet row group
+PARQUET_CHUNK_SIZE = int(os.environ.get("PARQUET_CHUNK_SIZE", "50000"))
+PARQUET_COMPRESSION = os.environ.get("PARQUET_COMPRESSION", "zstd")
+# Hive-style partition directories, read back as a created_date column by pandas/DuckDB
+PARTITION_COLUMN = 'created_date'
+
+COLUMNS = [
+    ('id', ProductionOrder.id),
+    ('production_order', ProductionOrder.production_order),
+    ('workcenter_id', ProductionOrder.workcenter_id),
+    ('workcenter_name', WorkCenter.name),
+    ('quantity', ProductionOrder.quantity),
+    ('order_type', ProductionOrder.order_type),
+    ('remark', ProductionOrder.remark),
+    ('user_id', ProductionOrder.user_id),
+    ('user_name', ProductionOrder.user_name),
+    ('user_department', ProductionOrder.user_department),
+    ('plant', ProductionOrder.plant),
+    ('created_at', ProductionOrder.created_at),
+]
+
+
+def parquet_available():
+    return pa is not None
+
+
+def parquet_schema():
+    return pa.schema([
+        ('id', pa.int64()),
+        ('production_order', pa.string()),
+        ('workcenter_id', pa.int32()),
+        ('workcenter_name', pa.dictionary(pa.int32(), pa.string())),
+        ('quantity', pa.int32()),
+        ('order_type', pa.dictionary(pa.int8(), pa.string())),
+        ('remark', pa.string()),
+        ('user_id', pa.int32()),
+        ('user_name', pa.string()),
+        ('user_department', pa.dictionary(pa.int32(), pa.string())),
+        ('plant', pa.dictionary(pa.int32(), pa.string())),
+        # Stored times are UTC
+        ('created_at', pa.timestamp('us', tz='UTC')),
+    ])
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise RuntimeError('Parquet export needs pyarrow: pip install pyarrow')
+
+
+def _order_rows(since=None, partitioned=False):
+    """Stream export rows through a server-side cursor; by created_at when partitioning, else by id"""
+    query = db.session.query(*[column for _, column in COLUMNS]).join(
+        WorkCenter, WorkCenter.id == ProductionOrder.workcenter_id
+    )
+    if since is not None:
+        query = query.filter(ProductionOrder.created_at >= since)
+    if partitioned:
+        # Rows without a creation time belong to no partition
+        query = query.filter(ProductionOrder.created_at.isnot(None)).order_by(
+            ProductionOrder.created_at, ProductionOrder.id
+        )
+    else:
+        query = query.order_by(ProductionOrder.id)
+    return db.session.execute(query.statement.execution_options(yield_per=PARQUET_CHUNK_SIZE))
+
+
+def _record_batch(rows, schema):
+    names = [name for name, _ in COLUMNS]
+    return pa.RecordBatch.from_pydict(
+        {name: [row[index] for row in rows] for index, name in enumerate(names)}, schema=schema
+    )
+
+
+class _PartFile:
+    """Parquet file written under a temporary name and moved into place when complete"""
+
+    def __init__(self, path, schema):
+        self.path = path
+        self.temp_path = path + '.tmp'
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.writer = pq.ParquetWriter(self.temp_path, schema, compression=PARQUET_COMPRESSION)
+        self.rows = 0
+
+    def write(self, batch):
+        self.writer.write_batch(batch)
+        self.rows += batch.num_rows
+
+    def close(self):
+        self.writer.close()
+        os.replace(self.temp_path, self.path)
+
+    def discard(self):
+        self.writer.close()
+        os.remove(self.temp_path)
+
+
+def export_parquet(path):
+    """Write every order to one Parquet file, one row group per chunk; returns the row count"""
+    _require_pyarrow()
+    schema = parquet_schema()
+    part = _PartFile(path, schema)
+    try:
+        for chunk in _order_rows().partitions():
+            part.write(_record_batch(chunk, schema))
+    except Exception:
+        part.discard()
+        raise
+    part.close()
+    return part.rows
+
+
+def existing_partitions(directory):
+    """Dates of the created_date=YYYY-MM-DD partitions already in directory"""
+    dates = []
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name.startswith(PARTITION_COLUMN + '='):
+                try:
+                    dates.append(datetime.strptime(name.split('=', 1)[1], '%Y-%m-%d').date())
+                except ValueError:
+                    continue
+    return sorted(dates)
+
+
+def export_parquet_partitions(directory, incremental=False):
+    """Write one partition per UTC day of created_at; returns {date: rows}.
+
+    Incremental runs keep the partitions already written and start again
+    from the newest one, which may have been written while its day was
+    still open. Orders backdated into older partitions need a full run.
+    """
+    _require_pyarrow()
+    schema = parquet_schema()
+    since = None
+    if incremental:
+        dates = existing_partitions(directory)
+        if dates:
+            since = datetime.combine(dates[-1], datetime.min.time())
+
+    written = {}
+    part = None
+    part_date = None
+    try:
+        for chunk in _order_rows(since=since, partitioned=True).partitions():
+            # A chunk can span days; each day's rows go to that day's file
+            for day, rows in groupby(chunk, key=lambda row: row.created_at.date()):
+                if day != part_date:
+                    if part is not None:
+                        part.close()
+                        written[part_date] = part.rows
+                    part_date = day
+                    part = _PartFile(os.path.join(
+                        directory, f'{PARTITION_COLUMN}={day.isoformat()}', 'part-0.parquet'
+                    ), schema)
+                part.write(_record_batch(list(rows), schema))
+    except Exception:
+        if part is not None:
+            part.discard()
+        raise
+    if part is not None:
+        part.close()
+        written[part_date] = part.rows
+    return written
+
+
+@app.cli.command('export-parquet')
+@plant_option
+@click.argument('path')
+@click.option('--partition-by-date', is_flag=True,
+              help='Write PATH/created_date=YYYY-MM-DD/part-0.parquet per UTC day instead of one file.')
+@click.option('--incremental', is_flag=True,
+              help='With --partition-by-date, keep existing partitions and write only from the newest one on.')
+def export_parquet_command(path, partition_by_date, incremental):
+    """Export production orders with work center and user columns as Parquet"""
+    if incremental and not partition_by_date:
+        raise click.UsageError('--incremental needs --partition-by-date')
+    if not parquet_available():
+        raise click.ClickException('Parquet export needs pyarrow: pip install pyarrow')
+
+    started = datetime.utcnow()
+    if partition_by_date:
+        written = export_parquet_partitions(path, incremental=incremental)
+        rows = sum(written.values())
+        click.echo(f'{rows} orders written to {len(written)} partitions in {path}')
+    else:
+        rows = export_parquet(path)
+        click.echo(f'{rows} orders written to {path}')
+    click.echo(f'Took {(datetime.utcnow() - started) / timedelta(seconds=1):.1f}s')
@@ -0,0 +1,51 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# Werkzeug hash method including its cost, e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000".
+# Unset keeps werkzeug's default.
+HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD") or None
+# Threads allowed to hash at once per process, so a login burst cannot take every core
+HASH_WORKERS = int(os.environ.get("LOGIN_HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+# Logins allowed to wait for a hashing thread before new ones are turned away
+HASH_QUEUE = int(os.environ.get("LOGIN_HASH_QUEUE", str(HASH_WORKERS * 8)))
+# Seconds a login waits for a queue slot before giving up
+HASH_WAIT_SECONDS = float(os.environ.get("LOGIN_HASH_WAIT", "5"))
+
+_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='password-hash')
+_slots = threading.BoundedSemaphore(HASH_WORKERS + HASH_QUEUE)
+_method_prefix = None
+
+
+class HashingBusy(Exception):
+    """Raised when every hashing slot is taken for longer than LOGIN_HASH_WAIT"""
+
+
+def hash_password(password):
+    if HASH_METHOD:
+        return generate_password_hash(password, method=HASH_METHOD)
+    return generate_password_hash(password)
+
+
+def method_prefix():
+    """Canonical "method:cost" prefix produced by the configured hash method"""
+    global _method_prefix
+    if _method_prefix is None:
+        _method_prefix = hash_password('').split('$', 1)[0]
+    return _method_prefix
+
+
+def needs_rehash(password_hash):
+    return not password_hash or password_hash.split('$', 1)[0] != method_prefix()
+
+
+def verify_password(password_hash, password):
+    """Check a password on the bounded hashing pool instead of the request thread"""
+    if not _slots.acquire(timeout=HASH_WAIT_SECONDS):
+        raise HashingBusy()
+    try:
+        return _executor.submit(check_password_hash, password_hash, password).result()
+    finally:
+        _slots.release()
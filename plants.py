@@ -0,0 +1,141 @@
+"""Plant context and per-plant database routing.
+
+Every request runs for one plant, taken from the logged-in user. Plants
+listed in PLANT_DATABASES get their own database for all tables except
+``user``, which stays in the main database so logins can find any user;
+other plants share the main database and are told apart by their ``plant``
+column.
+
+    PLANTS=PUNE,CHENNAI,NAGPUR
+    DEFAULT_PLANT=PUNE
+    PLANT_DATABASES="CHENNAI=postgresql://db-chennai/pots;NAGPUR=postgresql://db-nagpur/pots"
+"""
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import click
+from flask import has_request_context, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.sql.util import find_tables
+
+DEFAULT_PLANT = os.environ.get("DEFAULT_PLANT", "MAIN").strip()
+# Tables kept in the main database whatever the plant
+CENTRAL_TABLES = {'user'}
+
+
+def _parse_databases(value):
+    databases = {}
+    for entry in (value or '').split(';'):
+        if '=' in entry:
+            plant, uri = entry.split('=', 1)
+            databases[plant.strip()] = uri.strip()
+    return databases
+
+
+PLANT_DATABASES = _parse_databases(os.environ.get("PLANT_DATABASES"))
+PLANTS = [plant.strip() for plant in os.environ.get("PLANTS", DEFAULT_PLANT).split(',') if plant.strip()]
+for _plant in [DEFAULT_PLANT] + list(PLANT_DATABASES):
+    if _plant not in PLANTS:
+        PLANTS.append(_plant)
+
+_plant_override = ContextVar('plant_override', default=None)
+
+
+def bind_key(plant):
+    return f'plant:{plant}'
+
+
+def plant_binds():
+    """SQLALCHEMY_BINDS entries for plants with their own database"""
+    return {bind_key(plant): uri for plant, uri in PLANT_DATABASES.items()}
+
+
+def current_plant():
+    """Plant of the current job or fan-out if one is set, else of the logged-in user, else None"""
+    plant = _plant_override.get()
+    if plant is None and has_request_context():
+        plant = session.get('plant')
+    return plant
+
+
+@contextmanager
+def use_plant(plant):
+    """Run queries for the given plant, e.g. on a background thread or while fanning out"""
+    token = _plant_override.set(plant)
+    try:
+        yield plant
+    finally:
+        _plant_override.reset(token)
+
+
+def in_current_plant(func):
+    """Wrap func so it runs for the plant that is current now, wherever it is called later (e.g. a thread)"""
+    plant = current_plant()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with use_plant(plant):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def fan_out(app, func, plants=None):
+    """Run func once per plant, in parallel, each in its own app context and session; returns {plant: result}"""
+    plants = list(plants or PLANTS)
+
+    def run(plant):
+        with app.app_context(), use_plant(plant):
+            return func()
+
+    with ThreadPoolExecutor(max_workers=len(plants), thread_name_prefix='plant-fan-out') as pool:
+        return dict(zip(plants, pool.map(run, plants)))
+
+
+def plant_option(command):
+    """Add --plant to a CLI command; without it the command works on the main database"""
+    @click.option('--plant', default=None, help='Plant to run for (needed for plants with their own database).')
+    @functools.wraps(command)
+    def wrapper(*args, plant=None, **kwargs):
+        with use_plant(plant):
+            return command(*args, **kwargs)
+    return wrapper
+
+
+class PlantSession(Session):
+    """Session that sends statements for plant data to the current plant's database, if it has one"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        plant = current_plant()
+        if bind is None and plant in PLANT_DATABASES and not self._touches_central(mapper, clause):
+            return self._db.engines[bind_key(plant)]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    @staticmethod
+    def _touches_central(mapper, clause):
+        if mapper is not None:
+            return inspect(mapper).local_table.name in CENTRAL_TABLES
+        if clause is not None:
+            return any(getattr(table, 'name', None) in CENTRAL_TABLES
+                       for table in find_tables(clause, include_crud=True, include_joins=True))
+        return False
+
+
+def create_plant_schema(db):
+    """Create missing tables in each plant database; foreign keys to central tables are left out"""
+    for plant in PLANT_DATABASES:
+        engine = db.engines[bind_key(plant)]
+        with engine.begin() as connection:
+            existing = set(inspect(connection).get_table_names())
+            for table in db.metadata.sorted_tables:
+                if table.name in CENTRAL_TABLES or table.name in existing:
+                    continue
+                foreign_keys = [constraint for constraint in table.foreign_key_constraints
+                                if constraint.referred_table.name not in CENTRAL_TABLES]
+                connection.execute(CreateTable(table, include_foreign_key_constraints=foreign_keys))
+                for index in table.indexes:
+                    index.create(connection)
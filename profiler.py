@@ -0,0 +1,308 @@
+"""On-demand profiling of single requests, for admins diagnosing a slow URL in place.
+
+An admin adds ``?_profile=1`` to a URL (or sends ``X-Profile: 1``) and that
+request runs under cProfile with tracemalloc. SQL statements on the request's
+thread and template rendering are timed as well. The result is stored in
+PROFILE_DIR as a pstats file (for ``python -m pstats`` or snakeviz) with a
+JSON summary shown at /admin/profiles/<id>; the response carries the id in
+``X-Profile-Id``. Streamed pages are profiled until their body has been sent.
+
+One request per worker process is profiled at a time; tracemalloc sees the
+whole process, so peak memory includes other threads of a threaded worker.
+"""
+import cProfile
+import json
+import logging
+import os
+import pstats
+import re
+import secrets
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+from flask import before_render_template, g, request, session, template_rendered
+from sqlalchemy import event
+
+from app import app, db
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(app.instance_path, "profiles"))
+# Profiles kept on disk; older ones are removed as new ones are stored
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", "50"))
+# Stack frames tracemalloc keeps per allocation
+PROFILE_TRACE_FRAMES = int(os.environ.get("PROFILE_TRACE_FRAMES", "5"))
+# Rows of each list in the summary
+TOP_FUNCTIONS = 30
+TOP_STATEMENTS = 10
+TOP_ALLOCATIONS = 10
+
+PROFILE_ID_PATTERN = re.compile(r'^[0-9]{8}-[0-9]{6}-[0-9a-f]{6}$')
+
+_running = threading.Lock()
+
+
+def profile_requested():
+    return request.args.get('_profile') == '1' or request.headers.get('X-Profile') == '1'
+
+
+def _short_path(filename):
+    """Paths inside the app relative to it, library paths from their package directory on"""
+    root = app.root_path + os.sep
+    if filename.startswith(root):
+        return filename[len(root):]
+    marker = os.sep + 'site-packages' + os.sep
+    if marker in filename:
+        return filename.split(marker, 1)[1]
+    return filename
+
+
+class RequestProfile:
+    """Profiler, SQL timings and template timings of the current request"""
+
+    def __init__(self):
+        self.id = f'{datetime.utcnow():%Y%m%d-%H%M%S}-{secrets.token_hex(3)}'
+        self.method = request.method
+        self.url = request.full_path if request.query_string else request.path
+        self.endpoint = request.endpoint
+        self.user = session.get('username')
+        self.thread = threading.get_ident()
+        self.profiler = cProfile.Profile()
+        self.statements = []  # (seconds, statement)
+        self.sql_seconds = 0.0
+        self.templates = []  # {'name', 'seconds', 'sql_seconds'}
+        self._template_started = {}
+        self._statement_started = None
+        self._started_tracemalloc = False
+        self.engines = []
+        self.finished = False
+
+    # SQL on this request's thread, on every engine
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == self.thread:
+            self._statement_started = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == self.thread and self._statement_started is not None:
+            elapsed = time.perf_counter() - self._statement_started
+            self._statement_started = None
+            self.sql_seconds += elapsed
+            self.statements.append((elapsed, statement))
+
+    # Streamed templates fire template_rendered after their last chunk, so the SQL they run is counted too
+    def _before_template(self, sender, template, context, **extra):
+        if threading.get_ident() == self.thread:
+            self._template_started[template.name] = (time.perf_counter(), self.sql_seconds)
+
+    def _template_done(self, sender, template, context, **extra):
+        started = self._template_started.pop(template.name, None)
+        if started is not None:
+            self.templates.append({
+                'name': template.name,
+                'seconds': time.perf_counter() - started[0],
+                'sql_seconds': self.sql_seconds - started[1],
+            })
+
+    def start(self):
+        # Kept for finish(), which may run after the app context of a streamed response is gone
+        self.engines = list(db.engines.values())
+        for engine in self.engines:
+            event.listen(engine, 'before_cursor_execute', self._before_execute)
+            event.listen(engine, 'after_cursor_execute', self._after_execute)
+        before_render_template.connect(self._before_template, app)
+        template_rendered.connect(self._template_done, app)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(PROFILE_TRACE_FRAMES)
+            self._started_tracemalloc = True
+        tracemalloc.reset_peak()
+        self.memory_before = tracemalloc.get_traced_memory()[0]
+        self.started = time.perf_counter()
+        self.cpu_started = time.thread_time()
+        self.profiler.enable()
+
+    def finish(self, status):
+        """Stop measuring and store the profile; safe to call more than once"""
+        if self.finished:
+            return
+        self.finished = True
+        try:
+            self.profiler.disable()
+            wall = time.perf_counter() - self.started
+            cpu = time.thread_time() - self.cpu_started
+            current, peak = tracemalloc.get_traced_memory()
+            allocations = tracemalloc.take_snapshot().statistics('lineno')[:TOP_ALLOCATIONS]
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+                self._started_tracemalloc = False
+
+            summary = {
+                'id': self.id,
+                'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+                'method': self.method,
+                'url': self.url,
+                'endpoint': self.endpoint,
+                'user': self.user,
+                'status': status,
+                'wall_seconds': wall,
+                'cpu_seconds': cpu,
+                'sql': {
+                    'count': len(self.statements),
+                    'seconds': self.sql_seconds,
+                    'slowest': [{'seconds': seconds, 'statement': statement[:2000]}
+                                for seconds, statement in sorted(self.statements, key=lambda s: s[0],
+                                                                 reverse=True)[:TOP_STATEMENTS]],
+                },
+                'templates': self.templates,
+                'memory': {
+                    'peak_bytes': peak - self.memory_before,
+                    'retained_bytes': current - self.memory_before,
+                    'top_allocations': [{
+                        'location': f'{_short_path(stat.traceback[0].filename)}:{stat.traceback[0].lineno}',
+                        'bytes': stat.size,
+                        'count': stat.count,
+                    } for stat in allocations],
+                },
+                'functions': self._hot_functions(),
+            }
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            self.profiler.dump_stats(os.path.join(PROFILE_DIR, f'{self.id}.prof'))
+            with open(os.path.join(PROFILE_DIR, f'{self.id}.json'), 'w') as summary_file:
+                json.dump(summary, summary_file)
+            _prune()
+        except Exception as e:
+            # Profiling must never fail the request it measures
+            logger.warning(f'Could not store profile {self.id}: {str(e)}')
+        finally:
+            self._stop_listening()
+            _running.release()
+
+    def _stop_listening(self):
+        for engine in self.engines:
+            if event.contains(engine, 'before_cursor_execute', self._before_execute):
+                event.remove(engine, 'before_cursor_execute', self._before_execute)
+                event.remove(engine, 'after_cursor_execute', self._after_execute)
+        before_render_template.disconnect(self._before_template, app)
+        template_rendered.disconnect(self._template_done, app)
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+
+    def _hot_functions(self):
+        """Functions by own time, with call counts and cumulative time"""
+        stats = pstats.Stats(self.profiler).stats
+        rows = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:TOP_FUNCTIONS]
+        return [{
+            'function': name,
+            'location': f'{_short_path(filename)}:{line}' if line else filename,
+            'calls': calls,
+            'own_seconds': own,
+            'cumulative_seconds': cumulative,
+        } for (filename, line, name), (_, calls, own, cumulative, _) in rows]
+
+
+class _ProfiledBody:
+    """Streamed response body that finishes its profile once it is sent or closed"""
+
+    def __init__(self, body, profile, status):
+        self.body = body
+        self.profile = profile
+        self.status = status
+
+    def __iter__(self):
+        try:
+            yield from self.body
+        finally:
+            self.profile.finish(self.status)
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self.profile.finish(self.status)
+
+
+@app.before_request
+def start_profile():
+    if not profile_requested() or not session.get('is_admin'):
+        return
+    if not _running.acquire(blocking=False):
+        logger.info(f'Profile of {request.path} skipped, another request is being profiled')
+        return
+    profile = None
+    try:
+        profile = RequestProfile()
+        profile.start()
+    except Exception:
+        if profile is not None:
+            profile.profiler.disable()
+            profile._stop_listening()
+        _running.release()
+        raise
+    g.request_profile = profile
+
+
+@app.after_request
+def attach_profile(response):
+    profile = g.pop('request_profile', None)
+    if profile is None:
+        return response
+    response.headers['X-Profile-Id'] = profile.id
+    if response.is_streamed and not response.direct_passthrough:
+        # Streamed pages run their queries and templates while the body is sent
+        response.response = _ProfiledBody(response.response, profile, response.status_code)
+    else:
+        profile.finish(response.status_code)
+    return response
+
+
+@app.teardown_request
+def abandon_profile(error=None):
+    # The view raised before after_request could finish the profile
+    profile = g.pop('request_profile', None)
+    if profile is not None:
+        profile.finish(500)
+
+
+def _prune():
+    summaries = sorted(name for name in os.listdir(PROFILE_DIR) if name.endswith('.json'))
+    for name in summaries[:max(len(summaries) - PROFILE_KEEP, 0)]:
+        for suffix in ('.json', '.prof'):
+            path = os.path.join(PROFILE_DIR, name[:-len('.json')] + suffix)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def list_profiles():
+    """Summaries of the stored profiles, newest first"""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(PROFILE_DIR), reverse=True):
+        if name.endswith('.json'):
+            profile = load_profile(name[:-len('.json')])
+            if profile:
+                profiles.append(profile)
+    return profiles
+
+
+def load_profile(profile_id):
+    """Summary of one profile, or None if the id is unknown"""
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        return None
+    try:
+        with open(os.path.join(PROFILE_DIR, f'{profile_id}.json')) as summary_file:
+            profile = json.load(summary_file)
+    except (OSError, ValueError):
+        return None
+    profile['created_at'] = datetime.fromisoformat(profile['created_at'])
+    return profile
+
+
+def profile_stats_path(profile_id):
+    """Path of the pstats file of a profile, or None if the id is unknown"""
+    if not PROFILE_ID_PATTERN.match(profile_id):
+        return None
+    path = os.path.join(PROFILE_DIR, f'{profile_id}.prof')
+    return path if os.path.exists(path) else None
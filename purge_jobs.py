@@ -0,0 +1,114 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+from app import app, db
+from models import ProductionOrder, PurgeJob
+from order_hooks import orders_deleting
+from plants import in_current_plant
+
+# Purges touching more rows than this run as a chunked background job
+BACKGROUND_THRESHOLD = int(os.environ.get("PURGE_BACKGROUND_THRESHOLD", "5000"))
+# Rows deleted (and committed) per chunk, keeps each transaction and its locks short
+CHUNK_SIZE = int(os.environ.get("PURGE_CHUNK_SIZE", "1000"))
+# Pairs matched per statement, keeps the tuple IN list a reasonable size
+PAIR_BATCH_SIZE = 500
+# Pause between chunks so order entry can get at the table
+CHUNK_PAUSE_SECONDS = 0.05
+
+
+def parse_pair_values(values):
+    """Turn "<header_id>:<workcenter_id>" form values into unique (header_id, workcenter_id) pairs"""
+    pairs = []
+    seen = set()
+    for value in values:
+        try:
+            header_id, workcenter_id = (int(part) for part in value.split(':'))
+        except ValueError:
+            continue
+        if (header_id, workcenter_id) not in seen:
+            seen.add((header_id, workcenter_id))
+            pairs.append((header_id, workcenter_id))
+    return pairs
+
+
+def pairs_filter(pairs):
+    return tuple_(ProductionOrder.header_id, ProductionOrder.workcenter_id).in_(pairs)
+
+
+def count_pair_rows(pairs):
+    total = 0
+    for start in range(0, len(pairs), PAIR_BATCH_SIZE):
+        total += ProductionOrder.query.filter(pairs_filter(pairs[start:start + PAIR_BATCH_SIZE])).count()
+    return total
+
+
+def delete_pairs(pairs):
+    """Set-based delete of every row for the given pairs; the caller commits"""
+    deleted = 0
+    for start in range(0, len(pairs), PAIR_BATCH_SIZE):
+        batch_filter = pairs_filter(pairs[start:start + PAIR_BATCH_SIZE])
+        orders_deleting(batch_filter)
+        deleted += ProductionOrder.query.filter(batch_filter).delete(synchronize_session=False)
+    return deleted
+
+
+def start_purge_job(pairs, user_id, total_rows, after_chunk=None):
+    """Record a purge job and run it on a background thread; returns the job"""
+    job = PurgeJob()
+    job.pairs = json.dumps(pairs)
+    job.total_rows = total_rows
+    job.created_by = user_id
+    db.session.add(job)
+    db.session.commit()
+
+    thread = threading.Thread(target=in_current_plant(run_purge_job), args=(job.id, after_chunk),
+                              name=f'purge-job-{job.id}', daemon=True)
+    thread.start()
+    return job
+
+
+def run_purge_job(job_id, after_chunk=None):
+    with app.app_context():
+        job = db.session.get(PurgeJob, job_id)
+        if job is None:
+            return
+        job.status = 'running'
+        db.session.commit()
+
+        try:
+            pairs = [(int(header_id), int(wc_id)) for header_id, wc_id in json.loads(job.pairs)]
+            for start in range(0, len(pairs), PAIR_BATCH_SIZE):
+                batch = pairs[start:start + PAIR_BATCH_SIZE]
+                while True:
+                    ids = [row.id for row in db.session.query(ProductionOrder.id)
+                           .filter(pairs_filter(batch)).limit(CHUNK_SIZE)]
+                    if not ids:
+                        break
+
+                    # One bounded transaction per chunk; progress commits with the delete
+                    orders_deleting(ProductionOrder.id.in_(ids))
+                    job.deleted_rows += ProductionOrder.query.filter(
+                        ProductionOrder.id.in_(ids)
+                    ).delete(synchronize_session=False)
+                    db.session.commit()
+                    time.sleep(CHUNK_PAUSE_SECONDS)
+
+                if after_chunk:
+                    after_chunk(batch)
+
+            job.status = 'done'
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f'Purge job {job_id} failed: {str(e)}')
+            job = db.session.get(PurgeJob, job_id)
+            job.status = 'failed'
+            job.error = str(e)
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
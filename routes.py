@@ -1,11 +1,131 @@
-from flask import render_template, request, redirect, url_for, flash, session, jsonify, make_response
-from app import app, db
-from models import User, WorkCenter, ProductionOrder, Department
+from flask import render_template, stream_template, get_flashed_messages, request, redirect, url_for, flash, session, jsonify, make_response, Response, send_file, stream_with_context
+from app import app, db, balance_hub, admission
+from models import User, WorkCenter, ProductionOrder, ProductionOrderHeader, Department, PurgeJob, ImportJob
+from balance_events import compute_balance_rows
+from balance_snapshots import balances_as_of
+from change_feed import read_changes
+from parquet_export import export_parquet, parquet_available
+from workcenter_export import export_workbook
+from health import readiness
+from open_wip import join_open_wip
+from order_hooks import orders_inserted, orders_deleting
+from order_headers import assign_headers, header_ids, number_matches, number_pairs
+from order_import import start_import_job, retry_import_job, reject_path
+from order_sync import sync_lines, SYNC_BATCH_LIMIT
+from passwords import HashingBusy
+from plants import PLANTS, current_plant, fan_out
+from profiler import list_profiles, load_profile, profile_stats_path
+from wip_aging import wip_aging, AGING_BANDS
+from purge_jobs import (parse_pair_values, count_pair_rows, delete_pairs, start_purge_job,
+                        BACKGROUND_THRESHOLD as PURGE_BACKGROUND_THRESHOLD)
+from sqlalchemy.orm import contains_eager, selectinload
 from datetime import datetime, timedelta
+import csv
 import io
+import os
+import tempfile
+import json
+import queue
+import time
 from openpyxl import Workbook  # type: ignore
 from openpyxl.styles import Font, PatternFill, Alignment  # type: ignore
 
+def publish_balance_changes(keys):
+    """Push fresh totals for the touched (production_order, workcenter_id) keys to live balance pages"""
+    try:
+        balance_hub.publish(compute_balance_rows(db.session, ProductionOrder, keys), plant=current_plant())
+    except Exception as e:
+        # Live updates are best effort; never fail the save or delete because of them
+        app.logger.warning(f'Could not publish balance changes: {str(e)}')
+
+# Report pages are streamed: rows are fetched in batches and flushed in ~8 KB chunks
+REPORT_ROW_BATCH_SIZE = 500
+STREAM_CHUNK_SIZE = 8192
+
+# A live balance stream is closed after this many seconds and the browser reconnects where it
+# left off, so no stream holds a worker thread and its admission slot for good
+BALANCE_STREAM_SECONDS = float(os.environ.get("BALANCE_STREAM_SECONDS", "300"))
+
+@app.template_filter('ist')
+def format_ist(value):
+    """Format a UTC datetime as IST (UTC + 5:30) for display"""
+    if not value:
+        return '-'
+    ist_time = value + timedelta(hours=5, minutes=30)
+    return ist_time.strftime('%Y-%m-%d %H:%M:%S')
+
+def stream_page(template_name, **context):
+    """Render a template as a streamed response so the browser gets the page while rows are still being read"""
+    # Pop flashed messages now: the session cookie goes out before the body is rendered
+    get_flashed_messages(with_categories=True)
+    chunks = stream_template(template_name, **context)
+    
+    def generate():
+        buffer = []
+        size = 0
+        for chunk in chunks:
+            buffer.append(chunk)
+            size += len(chunk)
+            if size >= STREAM_CHUNK_SIZE:
+                yield ''.join(buffer)
+                buffer = []
+                size = 0
+        if buffer:
+            yield ''.join(buffer)
+    
+    return Response(generate(), mimetype='text/html')
+
+def iter_balances(orders, key_func, summary=None):
+    """Aggregate IN/OUT totals over orders sorted by group, yielding each group as soon as it is complete"""
+    current_key = None
+    item = None
+    
+    for order in orders:
+        key = key_func(order)
+        if key != current_key:
+            if item is not None:
+                yield finish_balance(item, summary)
+            current_key = key
+            item = {
+                'production_order': order.production_order,
+                'header_id': order.header_id,
+                'workcenter_name': order.workcenter.name,
+                'workcenter_id': order.workcenter_id,
+                'user_name': order.user_name or '-',
+                'user_department': order.user_department or '-',
+                'total_in': 0,
+                'total_out': 0,
+                'balance': 0,
+                'remarks': set()  # Use set to avoid duplicate remarks
+            }
+        
+        if order.order_type == 'IN':
+            item['total_in'] += order.quantity
+        else:
+            item['total_out'] += order.quantity
+        
+        # Add remark if it exists and is not empty
+        if order.remark and order.remark.strip():
+            item['remarks'].add(order.remark.strip())
+    
+    if item is not None:
+        yield finish_balance(item, summary)
+
+def finish_balance(item, summary=None):
+    item['balance'] = item['total_in'] - item['total_out']
+    # Convert remarks set to comma-separated string
+    item['remarks_text'] = ', '.join(sorted(item['remarks'])) if item['remarks'] else '-'
+    
+    # Running counts for summaries rendered after the table
+    if summary is not None:
+        if item['balance'] > 0:
+            summary['available'] += 1
+        elif item['balance'] == 0:
+            summary['balanced'] += 1
+        else:
+            summary['shortage'] += 1
+    return item
+
 @app.route('/')
 def login():
     return render_template('login.html')
@@ -15,12 +135,29 @@ def do_login():
     username = request.form['username']
     password = request.form['password']
     
-    user = User.query.filter_by(username=username, is_active=True).first()
+    # Usernames are unique across plants; the plant comes from the user
+    user = User.query.filter_by(username=username, is_active=True).execution_options(all_plants=True).first()
     
-    if user and user.check_password(password):
+    try:
+        password_ok = user is not None and user.check_password(password)
+    except HashingBusy:
+        flash('Too many logins at once, please try again in a moment', 'error')
+        return redirect(url_for('login'))
+    
+    if user and password_ok:
+        # Upgrade hashes made with an older method or cost while we have the plain password
+        if user.password_needs_rehash():
+            try:
+                user.set_password(password)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                app.logger.warning(f'Could not rehash password for {user.username}: {str(e)}')
+        
         session['user_id'] = user.id
         session['username'] = user.username
         session['is_admin'] = user.is_admin
+        session['plant'] = user.plant
         
         if user.is_admin:
             return redirect(url_for('admin_dashboard'))
@@ -43,6 +180,7 @@ def menu():
     return render_template('menu.html')
 
 @app.route('/in_orders')
+@admission.admit('entry')
 def in_orders():
     if 'user_id' not in session:
         return redirect(url_for('login'))
@@ -69,6 +207,7 @@ def in_orders():
     return render_template('in_orders.html', workcenters=workcenters)
 
 @app.route('/out_orders')
+@admission.admit('entry')
 def out_orders():
     if 'user_id' not in session:
         return redirect(url_for('login'))
@@ -95,6 +234,7 @@ def out_orders():
     return render_template('out_orders.html', workcenters=workcenters)
 
 @app.route('/save_orders', methods=['POST'])
+@admission.admit('entry')
 def save_orders():
     if 'user_id' not in session:
         return redirect(url_for('login'))
@@ -158,7 +298,10 @@ def save_orders():
             return redirect(url_for('out_orders'))
     
     # Only save if no warnings
+    changed_keys = set()
+    new_orders = []
     try:
+        current_user = User.query.get(session['user_id'])
         for order_data in orders_data:
             if order_data:  # Skip empty entries
                 parts = order_data.split('|')
@@ -175,11 +318,16 @@ def save_orders():
                     new_order.quantity = int(quantity) if quantity else 0
                     new_order.remark = remark.strip() if remark else ""
                     new_order.order_type = order_type
-                    new_order.user_id = session['user_id']
+                    new_order.set_user(current_user)
                     db.session.add(new_order)
+                    new_orders.append(new_order)
+                    changed_keys.add((new_order.production_order, new_order.workcenter_id))
         
+        assign_headers(new_orders)
+        orders_inserted(new_orders)
         db.session.commit()
         flash(f'{order_type} orders saved successfully!', 'success')
+        publish_balance_changes(changed_keys)
         
     except Exception as e:
         db.session.rollback()
@@ -187,7 +335,35 @@ def save_orders():
     
     return redirect(url_for('menu'))
 
+@app.route('/api/orders/sync', methods=['POST'])
+@admission.admit('entry')
+def sync_orders():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Login required'}), 401
+    
+    payload = request.get_json(silent=True) or {}
+    lines = payload.get('orders')
+    if not isinstance(lines, list):
+        return jsonify({'error': 'Expected {"orders": [...]}'}), 400
+    if len(lines) > SYNC_BATCH_LIMIT:
+        return jsonify({'error': f'At most {SYNC_BATCH_LIMIT} orders per request'}), 413
+    
+    try:
+        current_user = User.query.get(session['user_id'])
+        results, changed_keys = sync_lines(lines, current_user)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Error saving orders: {str(e)}'}), 500
+    
+    publish_balance_changes(changed_keys)
+    saved = sum(1 for result in results if result['status'] == 'saved')
+    # Saves the operator is waiting for report on the next page, like save_orders; background syncs stay quiet
+    if payload.get('notify') and saved:
+        flash(f'{saved} orders saved successfully!', 'success')
+    return jsonify({'results': results, 'saved': saved})
+
 @app.route('/reports')
+@admission.admit('reports')
 def reports():
     if 'user_id' not in session:
         return redirect(url_for('login'))
@@ -197,7 +373,7 @@ def reports():
     date_from = request.args.get('date_from', '')
     date_to = request.args.get('date_to', '')
     
-    query = db.session.query(ProductionOrder).join(WorkCenter).join(User)
+    query = db.session.query(ProductionOrder).join(WorkCenter)
     
     # Apply filters
     if search:
@@ -216,13 +392,12 @@ def reports():
         date_to_obj = datetime.strptime(date_to, '%Y-%m-%d').date()
         query = query.filter(db.func.date(ProductionOrder.created_at) <= date_to_obj)
     
-    # Default sorting by created_at desc
-    orders = query.order_by(ProductionOrder.created_at.desc()).all()
+    order_count = query.count()
     
-    # Convert UTC times to IST for each order
-    for order in orders:
-        ist_time = order.created_at + timedelta(hours=5, minutes=30)
-        order.created_at_ist = ist_time.strftime('%Y-%m-%d %H:%M:%S')
+    # Default sorting by created_at desc; rows are read in batches while the page streams
+    orders = query.options(
+        contains_eager(ProductionOrder.workcenter)
+    ).order_by(ProductionOrder.created_at.desc()).yield_per(REPORT_ROW_BATCH_SIZE)
     
     # Get all work centers for the filter dropdown
     workcenters = WorkCenter.query.filter_by(is_active=True).all()
@@ -231,11 +406,12 @@ def reports():
     current_user = User.query.get(session['user_id'])
     has_excel_access = current_user and (current_user.excel_access or current_user.is_admin)
     
-    return render_template('reports.html', orders=orders, search=search, 
-                         workcenters=workcenters, workcenter_filter=workcenter_filter,
-                         date_from=date_from, date_to=date_to, has_excel_access=has_excel_access)
+    return stream_page('reports.html', orders=orders, order_count=order_count, search=search, 
+                       workcenters=workcenters, workcenter_filter=workcenter_filter,
+                       date_from=date_from, date_to=date_to, has_excel_access=has_excel_access)
 
 @app.route('/balance_report')
+@admission.admit('reports')
 def balance_report():
     if 'user_id' not in session:
         return redirect(url_for('login'))
@@ -244,13 +420,66 @@ def balance_report():
     workcenter_filter = request.args.get('workcenter', '')
     date_from = request.args.get('date_from', '')
     date_to = request.args.get('date_to', '')
+    as_of = request.args.get('as_of', '')
+    open_only = request.args.get('open_only') == '1'
+    
+    # Get all work centers for the filter dropdown
+    workcenters = WorkCenter.query.filter_by(is_active=True).all()
+    
+    # Get current user for Excel access check
+    current_user = User.query.get(session['user_id'])
+    has_excel_access = current_user and (current_user.excel_access or current_user.is_admin)
+    
+    if as_of:
+        from datetime import datetime
+        try:
+            # End of the chosen IST day, in UTC like created_at
+            as_of_end = datetime.strptime(as_of, '%Y-%m-%d') + timedelta(days=1) - timedelta(hours=5, minutes=30)
+        except ValueError:
+            flash(f"Invalid date '{as_of}', showing current balances.", 'warning')
+            as_of = ''
+    
+    if as_of:
+        # Point-in-time balance: nearest nightly checkpoint plus the orders created since
+        totals = balances_as_of(as_of_end, search=search,
+                                workcenter_id=int(workcenter_filter) if workcenter_filter else None)
+        workcenter_names = {wc.id: wc.name for wc in WorkCenter.query.all()}
+        # Header ids are only needed for the admins' purge checkboxes
+        headers = header_ids((production_order for production_order, _ in totals),
+                             create=False) if session.get('is_admin') else {}
+        
+        balance_list = []
+        for (production_order, workcenter_id), (total_in, total_out) in totals.items():
+            # Checkpoints cover every plant in the database; keep this plant's work centers
+            if workcenter_id not in workcenter_names:
+                continue
+            if open_only and total_in == total_out:
+                continue
+            balance_list.append({
+                'production_order': production_order,
+                'header_id': headers.get(production_order),
+                'workcenter_name': workcenter_names.get(workcenter_id, '-'),
+                'workcenter_id': workcenter_id,
+                'user_name': '-',
+                'user_department': '-',
+                'total_in': total_in,
+                'total_out': total_out,
+                'balance': total_in - total_out,
+                'remarks_text': '-'
+            })
+        balance_list.sort(key=lambda x: (x['production_order'], x['workcenter_name']))
+        
+        return render_template('balance_report.html', balance_data=balance_list, balance_count=len(balance_list),
+                             search=search, workcenters=workcenters, workcenter_filter=workcenter_filter,
+                             date_from='', date_to='', as_of=as_of, open_only=open_only,
+                             has_excel_access=has_excel_access, live_updates=False)
     
     # Get all production orders with user information
-    query = db.session.query(ProductionOrder).join(WorkCenter).join(User)
+    query = db.session.query(ProductionOrder).join(WorkCenter)
     
-    # Apply filters
+    # Apply filters; the number search scans the header table instead of every order row
     if search:
-        query = query.filter(ProductionOrder.production_order.contains(search))
+        query = query.filter(number_matches(search))
     
     if workcenter_filter:
         query = query.filter(ProductionOrder.workcenter_id == int(workcenter_filter))
@@ -265,56 +494,86 @@ def balance_report():
         date_to_obj = datetime.strptime(date_to, '%Y-%m-%d').date()
         query = query.filter(db.func.date(ProductionOrder.created_at) <= date_to_obj)
     
-    all_orders = query.all()
+    # Open WIP only: read just the history of pairs whose current balance is not zero
+    if open_only:
+        query = join_open_wip(query)
     
-    # Calculate balance for each production order per work center
-    balance_data = {}
-    
-    for order in all_orders:
-        key = f"{order.production_order}_{order.workcenter_id}"
-        
-        if key not in balance_data:
-            balance_data[key] = {
-                'production_order': order.production_order,
-                'workcenter_name': order.workcenter.name,
-                'workcenter_id': order.workcenter_id,
-                'user_name': order.user.name or order.user.username,
-                'user_department': order.user.department or '-',
-                'total_in': 0,
-                'total_out': 0,
-                'balance': 0,
-                'remarks': set()  # Use set to avoid duplicate remarks
-            }
-        
-        if order.order_type == 'IN':
-            balance_data[key]['total_in'] += order.quantity
-        else:
-            balance_data[key]['total_out'] += order.quantity
-        
-        # Add remark if it exists and is not empty
-        if order.remark and order.remark.strip():
-            balance_data[key]['remarks'].add(order.remark.strip())
+    balance_count = db.session.query(db.func.count()).select_from(
+        query.with_entities(ProductionOrder.header_id, ProductionOrder.workcenter_id).distinct().subquery()
+    ).scalar()
     
-    # Calculate balance for each entry and convert remarks set to string
-    for key in balance_data:
-        balance_data[key]['balance'] = balance_data[key]['total_in'] - balance_data[key]['total_out']
-        # Convert remarks set to comma-separated string
-        balance_data[key]['remarks_text'] = ', '.join(sorted(balance_data[key]['remarks'])) if balance_data[key]['remarks'] else '-'
+    # Grouped by header id, work center so each balance is complete as soon as its group ends;
+    # the header join only puts the groups in production order number order
+    orders = query.join(ProductionOrderHeader, ProductionOrderHeader.id == ProductionOrder.header_id).options(
+        contains_eager(ProductionOrder.workcenter)
+    ).order_by(
+        ProductionOrderHeader.number, ProductionOrder.header_id, WorkCenter.name, ProductionOrder.workcenter_id
+    ).yield_per(REPORT_ROW_BATCH_SIZE)
     
-    # Convert to list and sort by production order, work center
-    balance_list = list(balance_data.values())
-    balance_list.sort(key=lambda x: (x['production_order'], x['workcenter_name']))
+    # Calculate balance for each production order per work center
+    balance_data = iter_balances(orders, lambda order: (order.header_id, order.workcenter_id))
     
-    # Get all work centers for the filter dropdown
-    workcenters = WorkCenter.query.filter_by(is_active=True).all()
+    # Live totals are all-time, so only patch rows in place when no date range is applied
+    live_updates = not date_from and not date_to
     
-    # Get current user for Excel access check
-    current_user = User.query.get(session['user_id'])
-    has_excel_access = current_user and (current_user.excel_access or current_user.is_admin)
+    return stream_page('balance_report.html', balance_data=balance_data, balance_count=balance_count,
+                       search=search, workcenters=workcenters, workcenter_filter=workcenter_filter,
+                       date_from=date_from, date_to=date_to, as_of='', open_only=open_only,
+                       has_excel_access=has_excel_access, live_updates=live_updates)
+
+@app.route('/balance_report/stream')
+@admission.admit('streams')
+def balance_report_stream():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
     
-    return render_template('balance_report.html', balance_data=balance_list, search=search,
-                         workcenters=workcenters, workcenter_filter=workcenter_filter,
-                         date_from=date_from, date_to=date_to, has_excel_access=has_excel_access)
+    plant = current_plant()
+    # Reconnects send the id of the last event received; a client starting over after a 503 passes it as last_event_id
+    since = parse_event_id(request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+    deadline = time.monotonic() + BALANCE_STREAM_SECONDS
+    
+    def generate():
+        subscriber = balance_hub.subscribe(since)
+        last = since
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    # The browser reconnects after the retry delay, with the last event id
+                    return
+                try:
+                    event, position = subscriber.get(timeout=min(15, remaining))
+                except queue.Empty:
+                    # Keep proxies from closing an idle connection
+                    yield ': keepalive\n\n'
+                    continue
+                if position is not None:
+                    if last is not None and position[0] == last[0] and position[1] <= last[1]:
+                        # Replayed after a reconnect and delivered by the hub as well
+                        continue
+                    last = position
+                if event.get('plant') not in (None, plant):
+                    continue
+                event_id = f"id: {last[0]}-{last[1]}\n" if position is not None else ''
+                yield f"{event_id}data: {json.dumps(event)}\n\n"
+                if event.get('reload'):
+                    return
+        finally:
+            balance_hub.unsubscribe(subscriber)
+    
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def parse_event_id(value):
+    """Spool position (inode, offset) from a live balance event id, or None"""
+    try:
+        inode, offset = (value or '').split('-')
+        return int(inode), int(offset)
+    except ValueError:
+        return None
 
 # Admin Routes
 @app.route('/admin/dashboard')
@@ -330,7 +589,7 @@ def admin_dashboard():
     total_out_orders = ProductionOrder.query.filter_by(order_type='OUT').count()
     
     # Recent orders
-    recent_orders = ProductionOrder.query.join(WorkCenter).join(User).order_by(ProductionOrder.created_at.desc()).limit(10).all()
+    recent_orders = ProductionOrder.query.join(WorkCenter).order_by(ProductionOrder.created_at.desc()).limit(10).all()
     
     return render_template('admin_dashboard.html', 
                          total_users=total_users,
@@ -347,7 +606,7 @@ def admin_users():
     
     users = User.query.all()
     departments = Department.query.filter_by(is_active=True).all()
-    return render_template('admin_users.html', users=users, departments=departments)
+    return render_template('admin_users.html', users=users, departments=departments, plants=PLANTS)
 
 @app.route('/admin/create_user', methods=['POST'])
 def create_user():
@@ -361,8 +620,8 @@ def create_user():
     is_admin = 'is_admin' in request.form
     excel_access = 'excel_access' in request.form
     
-    # Check if username already exists
-    existing_user = User.query.filter_by(username=username).first()
+    # Check if username already exists (in any plant)
+    existing_user = User.query.filter_by(username=username).execution_options(all_plants=True).first()
     if existing_user:
         flash('Username already exists', 'error')
         return redirect(url_for('admin_users'))
@@ -392,8 +651,8 @@ def edit_user(user_id):
     user = User.query.get_or_404(user_id)
     new_username = request.form['username']
     
-    # Check if username already exists (excluding current user)
-    existing_user = User.query.filter_by(username=new_username).first()
+    # Check if username already exists in any plant (excluding current user)
+    existing_user = User.query.filter_by(username=new_username).execution_options(all_plants=True).first()
     if existing_user and existing_user.id != user_id:
         flash('Username already exists', 'error')
         return redirect(url_for('admin_users'))
@@ -407,6 +666,8 @@ def edit_user(user_id):
     user.is_admin = 'is_admin' in request.form
     user.excel_access = 'excel_access' in request.form
     user.is_active = 'is_active' in request.form
+    if request.form.get('plant') in PLANTS:
+        user.plant = request.form['plant']
     
     try:
         db.session.commit()
@@ -440,18 +701,28 @@ def delete_user(user_id):
     
     return redirect(url_for('admin_users'))
 
-@app.route('/admin/reports')
-def admin_reports():
-    if 'user_id' not in session or not session.get('is_admin'):
-        flash('Access denied. Admin privileges required.', 'error')
-        return redirect(url_for('login'))
-    
-    search = request.args.get('search', '')
-    workcenter_filter = request.args.get('workcenter', '')
-    date_from = request.args.get('date_from', '')
-    date_to = request.args.get('date_to', '')
+# Admin report columns the browser can sort by, and their CSV headers
+ADMIN_REPORT_COLUMNS = {
+    'production_order': (ProductionOrder.production_order, 'Production Order'),
+    'workcenter': (WorkCenter.name, 'Work Center'),
+    'quantity': (ProductionOrder.quantity, 'Quantity'),
+    'order_type': (ProductionOrder.order_type, 'Type'),
+    'remark': (ProductionOrder.remark, 'Remark'),
+    'user_name': (ProductionOrder.user_name, 'Name'),
+    'user_department': (ProductionOrder.user_department, 'Department'),
+    'created_at': (ProductionOrder.created_at, 'Date & Time (IST)'),
+}
+# Rows per page fetched by the virtualized report table
+ADMIN_REPORT_PAGE_MAX = 500
+
+def admin_report_query(args):
+    """Orders joined to their work center, filtered like the admin report form"""
+    search = args.get('search', '')
+    workcenter_filter = args.get('workcenter', '')
+    date_from = args.get('date_from', '')
+    date_to = args.get('date_to', '')
     
-    query = db.session.query(ProductionOrder).join(WorkCenter).join(User)
+    query = db.session.query(ProductionOrder).join(WorkCenter)
     
     # Apply filters
     if search:
@@ -461,31 +732,108 @@ def admin_reports():
         query = query.filter(ProductionOrder.workcenter_id == int(workcenter_filter))
     
     if date_from:
-        from datetime import datetime
         date_from_obj = datetime.strptime(date_from, '%Y-%m-%d').date()
         query = query.filter(db.func.date(ProductionOrder.created_at) >= date_from_obj)
     
     if date_to:
-        from datetime import datetime
         date_to_obj = datetime.strptime(date_to, '%Y-%m-%d').date()
         query = query.filter(db.func.date(ProductionOrder.created_at) <= date_to_obj)
     
-    # Default sorting by created_at desc
-    orders = query.order_by(ProductionOrder.created_at.desc()).all()
+    return query
+
+def admin_report_rows(query, args):
+    """Display columns of the filtered orders in the requested order (default: newest first)"""
+    sort = args.get('sort', 'created_at')
+    column = ADMIN_REPORT_COLUMNS.get(sort, ADMIN_REPORT_COLUMNS['created_at'])[0]
+    descending = args.get('dir', 'desc') != 'asc'
+    # The id breaks ties so pages never overlap or skip rows
+    order = [column.desc(), ProductionOrder.id.desc()] if descending else [column.asc(), ProductionOrder.id.asc()]
+    return query.with_entities(
+        ProductionOrder.id, ProductionOrder.production_order, WorkCenter.name, ProductionOrder.quantity,
+        ProductionOrder.order_type, ProductionOrder.remark, ProductionOrder.user_name,
+        ProductionOrder.user_department, ProductionOrder.created_at,
+    ).order_by(*order)
+
+@app.route('/admin/reports')
+@admission.admit('reports')
+def admin_reports():
+    if 'user_id' not in session or not session.get('is_admin'):
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('login'))
     
-    # Convert UTC times to IST for each order
-    for order in orders:
-        ist_time = order.created_at + timedelta(hours=5, minutes=30)
-        order.created_at_ist = ist_time.strftime('%Y-%m-%d %H:%M:%S')
+    # Only the count is read here; the table fetches its rows page by page from admin_reports_rows
+    order_count = admin_report_query(request.args).count()
     
     # Get all work centers for the filter dropdown
     workcenters = WorkCenter.query.filter_by(is_active=True).all()
     
-    return render_template('admin_reports.html', orders=orders, search=search,
-                         workcenters=workcenters, workcenter_filter=workcenter_filter,
-                         date_from=date_from, date_to=date_to)
+    return render_template('admin_reports.html', order_count=order_count, search=request.args.get('search', ''),
+                           workcenters=workcenters, workcenter_filter=request.args.get('workcenter', ''),
+                           date_from=request.args.get('date_from', ''), date_to=request.args.get('date_to', ''),
+                           page_size=ADMIN_REPORT_PAGE_MAX)
+
+@app.route('/admin/reports/rows')
+@admission.admit('reports')
+def admin_reports_rows():
+    if 'user_id' not in session or not session.get('is_admin'):
+        return jsonify({'error': 'Admin privileges required'}), 403
+    
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', 100, type=int), 1), ADMIN_REPORT_PAGE_MAX)
+    try:
+        query = admin_report_query(request.args)
+    except ValueError:
+        return jsonify({'error': 'Invalid filter'}), 400
+    
+    rows = admin_report_rows(query, request.args).offset(offset).limit(limit).all()
+    return jsonify({
+        'offset': offset,
+        'rows': [{
+            'id': order_id,
+            'production_order': production_order,
+            'workcenter': workcenter_name,
+            'quantity': quantity,
+            'order_type': order_type,
+            'remark': remark or '-',
+            'user_name': user_name or '-',
+            'user_department': user_department or '-',
+            'created_at': f'{format_ist(created_at)} IST',
+        } for order_id, production_order, workcenter_name, quantity, order_type, remark, user_name,
+            user_department, created_at in rows],
+    })
+
+@app.route('/admin/reports/export.csv')
+@admission.admit('exports')
+def admin_reports_csv():
+    if 'user_id' not in session or not session.get('is_admin'):
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('login'))
+    
+    # Same filters and order as the table on screen, streamed in batches instead of built in the browser
+    rows = admin_report_rows(admin_report_query(request.args), request.args).yield_per(REPORT_ROW_BATCH_SIZE)
+    
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow([header for _, header in ADMIN_REPORT_COLUMNS.values()])
+        for _, production_order, workcenter_name, quantity, order_type, remark, user_name, user_department, \
+                created_at in rows:
+            writer.writerow([production_order, workcenter_name, quantity, order_type, remark or '-',
+                             user_name or '-', user_department or '-', format_ist(created_at)])
+            if buffer.tell() >= STREAM_CHUNK_SIZE:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    
+    response = Response(stream_with_context(generate()), mimetype='text/csv')
+    response.headers['Content-Disposition'] = (
+        f'attachment; filename=production_orders_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+    )
+    return response
 
 @app.route('/admin/balance_report')
+@admission.admit('reports')
 def admin_balance_report():
     if 'user_id' not in session or not session.get('is_admin'):
         flash('Access denied. Admin privileges required.', 'error')
@@ -495,13 +843,15 @@ def admin_balance_report():
     workcenter_filter = request.args.get('workcenter', '')
     date_from = request.args.get('date_from', '')
     date_to = request.args.get('date_to', '')
+    open_only = request.args.get('open_only') == '1'
+    all_plants = request.args.get('plant') == 'ALL' and len(PLANTS) > 1
     
     # Get all production orders with user information
-    query = db.session.query(ProductionOrder).join(WorkCenter).join(User)
+    query = db.session.query(ProductionOrder).join(WorkCenter)
     
-    # Apply filters
+    # Apply filters; the number search scans the header table instead of every order row
     if search:
-        query = query.filter(ProductionOrder.production_order.contains(search))
+        query = query.filter(number_matches(search))
     
     if workcenter_filter:
         query = query.filter(ProductionOrder.workcenter_id == int(workcenter_filter))
@@ -516,66 +866,110 @@ def admin_balance_report():
         date_to_obj = datetime.strptime(date_to, '%Y-%m-%d').date()
         query = query.filter(db.func.date(ProductionOrder.created_at) <= date_to_obj)
     
-    all_orders = query.all()
-    
-    # Calculate balance for each production order per work center per user
-    balance_data = {}
+    # Open WIP only: pairs whose current balance is not zero
+    if open_only:
+        query = join_open_wip(query)
     
-    for order in all_orders:
-        key = f"{order.production_order}_{order.workcenter_id}_{order.user_id}"
-        
-        if key not in balance_data:
-            balance_data[key] = {
-                'production_order': order.production_order,
-                'workcenter_name': order.workcenter.name,
-                'workcenter_id': order.workcenter_id,
-                'user_name': order.user.name or order.user.username,
-                'user_department': order.user.department or '-',
-                'total_in': 0,
-                'total_out': 0,
-                'balance': 0,
-                'last_activity': order.created_at,
-                'remarks': set()  # Use set to avoid duplicate remarks
-            }
-        
-        if order.order_type == 'IN':
-            balance_data[key]['total_in'] += order.quantity
-        else:
-            balance_data[key]['total_out'] += order.quantity
+    # Get all work centers for the filter dropdown
+    workcenters = WorkCenter.query.filter_by(is_active=True).all()
+    summary = {'available': 0, 'balanced': 0, 'shortage': 0}
+    
+    if all_plants:
+        # Cross-plant view: each plant aggregates in its own database in parallel, results are merged here
+        grouped = query.join(
+            ProductionOrderHeader, ProductionOrderHeader.id == ProductionOrder.header_id
+        ).with_entities(
+            ProductionOrder.header_id, ProductionOrderHeader.number, WorkCenter.name, ProductionOrder.workcenter_id,
+            ProductionOrder.user_id,
+            db.func.max(ProductionOrder.user_name), db.func.max(ProductionOrder.user_department),
+            db.func.sum(db.case((ProductionOrder.order_type == 'IN', ProductionOrder.quantity), else_=0)),
+            db.func.sum(db.case((ProductionOrder.order_type == 'OUT', ProductionOrder.quantity), else_=0)),
+        ).group_by(ProductionOrder.header_id, ProductionOrderHeader.number, WorkCenter.name,
+                   ProductionOrder.workcenter_id, ProductionOrder.user_id)
+        results = fan_out(app, lambda: grouped.with_session(db.session()).all())
         
-        # Track the latest activity date
-        if order.created_at > balance_data[key]['last_activity']:
-            balance_data[key]['last_activity'] = order.created_at
+        balance_list = []
+        for plant, rows in results.items():
+            for header_id, production_order, workcenter_name, workcenter_id, user_id, user_name, user_department, \
+                    total_in, total_out in rows:
+                balance_list.append(finish_balance({
+                    'plant': plant,
+                    'production_order': production_order,
+                    'header_id': header_id,
+                    'workcenter_name': workcenter_name,
+                    'workcenter_id': workcenter_id,
+                    'user_name': user_name or '-',
+                    'user_department': user_department or '-',
+                    'total_in': int(total_in or 0),
+                    'total_out': int(total_out or 0),
+                    'remarks': set()
+                }, summary))
+        balance_list.sort(key=lambda x: (x['production_order'], x['workcenter_name'], x['plant'], x['user_name']))
         
-        # Add remark if it exists and is not empty
-        if order.remark and order.remark.strip():
-            balance_data[key]['remarks'].add(order.remark.strip())
+        return render_template('admin_balance_report.html', balance_data=balance_list,
+                             balance_count=len(balance_list), summary=summary, search=search,
+                             workcenters=workcenters, workcenter_filter=workcenter_filter, date_from=date_from,
+                             date_to=date_to, open_only=open_only, plants=PLANTS, all_plants=True)
+    
+    balance_count = db.session.query(db.func.count()).select_from(
+        query.with_entities(ProductionOrder.header_id, ProductionOrder.workcenter_id,
+                            ProductionOrder.user_id).distinct().subquery()
+    ).scalar()
+    
+    # Grouped by header id, work center, then user so each balance is complete as soon as its group ends;
+    # the header join only puts the groups in production order number order
+    orders = query.join(ProductionOrderHeader, ProductionOrderHeader.id == ProductionOrder.header_id).options(
+        contains_eager(ProductionOrder.workcenter)
+    ).order_by(
+        ProductionOrderHeader.number, ProductionOrder.header_id, WorkCenter.name, ProductionOrder.workcenter_id,
+        ProductionOrder.user_name, ProductionOrder.user_id
+    ).yield_per(REPORT_ROW_BATCH_SIZE)
     
-    # Calculate balance for each entry and convert remarks set to string
-    for key in balance_data:
-        balance_data[key]['balance'] = balance_data[key]['total_in'] - balance_data[key]['total_out']
-        # Convert UTC time to IST (UTC + 5:30)
-        ist_time = balance_data[key]['last_activity'] + timedelta(hours=5, minutes=30)
-        balance_data[key]['last_activity_ist'] = ist_time.strftime('%Y-%m-%d %H:%M:%S')
-        # Convert remarks set to comma-separated string
-        balance_data[key]['remarks_text'] = ', '.join(sorted(balance_data[key]['remarks'])) if balance_data[key]['remarks'] else '-'
+    # Calculate balance for each production order per work center per user
+    balance_data = iter_balances(
+        orders, lambda order: (order.header_id, order.workcenter_id, order.user_id), summary
+    )
+    
+    return stream_page('admin_balance_report.html', balance_data=balance_data, balance_count=balance_count,
+                       summary=summary, search=search, workcenters=workcenters,
+                       workcenter_filter=workcenter_filter, date_from=date_from, date_to=date_to,
+                       open_only=open_only, plants=PLANTS, all_plants=False)
+
+@app.route('/admin/wip_aging')
+@admission.admit('reports')
+def admin_wip_aging():
+    if 'user_id' not in session or not session.get('is_admin'):
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('login'))
     
-    # Convert to list and sort by production order, work center, then user name
-    balance_list = list(balance_data.values())
-    balance_list.sort(key=lambda x: (x['production_order'], x['workcenter_name'], x['user_name']))
+    search = request.args.get('search', '')
+    workcenter_filter = request.args.get('workcenter', '')
+    band_filter = request.args.get('band', '')
+    
+    # One windowed query over the history of open pairs; bands are counted over all of them
+    aging_rows, bands = wip_aging(search=search, workcenter_id=int(workcenter_filter) if workcenter_filter else None)
+    if band_filter:
+        aging_rows = [row for row in aging_rows if row['band'] == band_filter]
     
     # Get all work centers for the filter dropdown
     workcenters = WorkCenter.query.filter_by(is_active=True).all()
     
-    return render_template('admin_balance_report.html', balance_data=balance_list, search=search,
-                         workcenters=workcenters, workcenter_filter=workcenter_filter,
-                         date_from=date_from, date_to=date_to)
+    return render_template('admin_wip_aging.html', aging_rows=aging_rows, bands=bands, aging_bands=AGING_BANDS,
+                         search=search, workcenters=workcenters, workcenter_filter=workcenter_filter,
+                         band_filter=band_filter)
 
 @app.route('/admin/export_excel')
+@admission.admit('exports')
 def export_excel():
     if 'user_id' not in session or not session.get('is_admin'):
         return redirect(url_for('login'))
     
+    # Open WIP only: both sheets cover just the pairs whose current balance is not zero
+    open_only = request.args.get('open_only') == '1'
+    
+    if request.args.get('by_workcenter') == '1':
+        return export_excel_by_workcenter(open_only)
+    
     # Create workbook with two worksheets
     wb = Workbook()
     
@@ -601,7 +995,10 @@ def export_excel():
                 cell.alignment = Alignment(horizontal='center')
         
         # Get all orders
-        orders = db.session.query(ProductionOrder).join(WorkCenter).join(User).order_by(ProductionOrder.created_at.desc()).all()
+        query = db.session.query(ProductionOrder).join(WorkCenter)
+        if open_only:
+            query = join_open_wip(query)
+        orders = query.order_by(ProductionOrder.created_at.desc()).all()
         
         # Add data to first sheet
         for row, order in enumerate(orders, 2):
@@ -610,8 +1007,8 @@ def export_excel():
             ws1.cell(row=row, column=3, value=order.quantity)  # type: ignore
             ws1.cell(row=row, column=4, value=order.order_type)  # type: ignore
             ws1.cell(row=row, column=5, value=order.remark or '-')  # type: ignore
-            ws1.cell(row=row, column=6, value=order.user.name or order.user.username)  # type: ignore
-            ws1.cell(row=row, column=7, value=order.user.department or '-')  # type: ignore
+            ws1.cell(row=row, column=6, value=order.user_name or '-')  # type: ignore
+            ws1.cell(row=row, column=7, value=order.user_department or '-')  # type: ignore
             # Convert to IST (UTC + 5:30) for display
             ist_time = order.created_at + timedelta(hours=5, minutes=30)
             ws1.cell(row=row, column=8, value=ist_time.strftime('%Y-%m-%d %H:%M:%S') + ' IST')  # type: ignore
@@ -702,7 +1099,52 @@ def export_excel():
     
     return response
 
+def export_excel_by_workcenter(open_only):
+    """One sheet per work center plus the balance sheet, built by the export worker pool"""
+    # Written to a temporary file so the sheets are not all held in memory at once
+    fd, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    try:
+        export_workbook(path, open_only=open_only)
+    except Exception as e:
+        os.remove(path)
+        flash(f'Error exporting Excel: {str(e)}', 'error')
+        return redirect(url_for('admin_dashboard'))
+    
+    response = send_file(path, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                         as_attachment=True,
+                         download_name=f'production_orders_by_workcenter_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx')
+    response.call_on_close(lambda: os.remove(path))
+    return response
+
+@app.route('/admin/export_parquet')
+@admission.admit('exports')
+def export_parquet_file():
+    if 'user_id' not in session or not session.get('is_admin'):
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('login'))
+    
+    if not parquet_available():
+        flash('Parquet export needs pyarrow installed on the server.', 'error')
+        return redirect(url_for('admin_dashboard'))
+    
+    # Written to a temporary file so the rows are streamed from the database, not held in memory
+    fd, path = tempfile.mkstemp(suffix='.parquet')
+    os.close(fd)
+    try:
+        export_parquet(path)
+    except Exception as e:
+        os.remove(path)
+        flash(f'Error exporting Parquet: {str(e)}', 'error')
+        return redirect(url_for('admin_dashboard'))
+    
+    response = send_file(path, mimetype='application/vnd.apache.parquet', as_attachment=True,
+                         download_name=f'production_orders_{datetime.now().strftime("%Y%m%d_%H%M%S")}.parquet')
+    response.call_on_close(lambda: os.remove(path))
+    return response
+
 @app.route('/export_excel')
+@admission.admit('exports')
 def user_export_excel():
     if 'user_id' not in session:
         return redirect(url_for('login'))
@@ -716,6 +1158,9 @@ def user_export_excel():
     # Get current user for department filtering
     user_department = current_user.department
     
+    # Open WIP only: both sheets cover just the pairs whose current balance is not zero
+    open_only = request.args.get('open_only') == '1'
+    
     # Create workbook with two worksheets
     wb = Workbook()
     
@@ -741,9 +1186,11 @@ def user_export_excel():
                 cell.alignment = Alignment(horizontal='center')
         
         # Get orders filtered by user's department access (unless admin)
-        query = db.session.query(ProductionOrder).join(WorkCenter).join(User)
+        query = db.session.query(ProductionOrder).join(WorkCenter)
         if not current_user.is_admin and user_department:
-            query = query.filter(User.department == user_department)
+            query = query.filter(ProductionOrder.user_department == user_department)
+        if open_only:
+            query = join_open_wip(query)
         
         orders = query.order_by(ProductionOrder.created_at.desc()).all()
         
@@ -754,8 +1201,8 @@ def user_export_excel():
             ws1.cell(row=row, column=3, value=order.quantity)  # type: ignore
             ws1.cell(row=row, column=4, value=order.order_type)  # type: ignore
             ws1.cell(row=row, column=5, value=order.remark or '-')  # type: ignore
-            ws1.cell(row=row, column=6, value=order.user.name or order.user.username)  # type: ignore
-            ws1.cell(row=row, column=7, value=order.user.department or '-')  # type: ignore
+            ws1.cell(row=row, column=6, value=order.user_name or '-')  # type: ignore
+            ws1.cell(row=row, column=7, value=order.user_department or '-')  # type: ignore
             # Convert to IST (UTC + 5:30) for display
             ist_time = order.created_at + timedelta(hours=5, minutes=30)
             ws1.cell(row=row, column=8, value=ist_time.strftime('%Y-%m-%d %H:%M:%S') + ' IST')  # type: ignore
@@ -775,9 +1222,11 @@ def user_export_excel():
             cell.alignment = Alignment(horizontal='center')
     
     # Get balance data (filtered by user's department if not admin)
-    query = db.session.query(ProductionOrder).join(WorkCenter).join(User)
+    query = db.session.query(ProductionOrder).join(WorkCenter)
     if not current_user.is_admin and user_department:
-        query = query.filter(User.department == user_department)
+        query = query.filter(ProductionOrder.user_department == user_department)
+    if open_only:
+        query = join_open_wip(query)
     
     all_orders = query.all()
     
@@ -859,7 +1308,8 @@ def master_data():
         flash('Access denied. Admin privileges required.', 'error')
         return redirect(url_for('login'))
     
-    workcenters = WorkCenter.query.all()
+    # Departments of every work center in one query rather than one per row
+    workcenters = WorkCenter.query.options(selectinload(WorkCenter.departments)).all()
     departments = Department.query.all()
     return render_template('master_data.html', workcenters=workcenters, departments=departments)
 
@@ -1006,9 +1456,17 @@ def bulk_delete_orders():
         # Convert to integers for safety
         order_ids = [int(order_id) for order_id in order_ids]
         
+        # Remember which balances change before the rows are gone
+        changed_keys = set(db.session.query(ProductionOrder.production_order, ProductionOrder.workcenter_id)
+                           .filter(ProductionOrder.id.in_(order_ids)).distinct().all())
+        
+        # Open WIP balances and balance checkpoints that counted these orders
+        orders_deleting(ProductionOrder.id.in_(order_ids))
+        
         # Delete selected orders
         deleted_count = ProductionOrder.query.filter(ProductionOrder.id.in_(order_ids)).delete()
         db.session.commit()
+        publish_balance_changes(changed_keys)
         
         flash(f'Successfully deleted {deleted_count} production order(s).', 'success')
     except Exception as e:
@@ -1029,27 +1487,204 @@ def bulk_delete_by_production_order():
         flash('No production orders selected for deletion.', 'warning')
         return redirect(url_for('balance_report'))
     
+    pairs = parse_pair_values(production_orders)
+    
     try:
-        deleted_count = 0
+        total_rows = count_pair_rows(pairs)
         
-        for production_order_data in production_orders:
-            # Extract production order and workcenter_id from the value
-            parts = production_order_data.split('-')
-            if len(parts) >= 2:
-                production_order = '-'.join(parts[:-1])  # Handle production orders with dashes
-                workcenter_id = int(parts[-1])
-                
-                # Delete all orders for this production order and work center
-                count = ProductionOrder.query.filter_by(
-                    production_order=production_order,
-                    workcenter_id=workcenter_id
-                ).delete()
-                deleted_count += count
+        # Very large purges run in bounded chunks in the background so order entry is not blocked
+        if total_rows > PURGE_BACKGROUND_THRESHOLD:
+            job = start_purge_job(pairs, session['user_id'], total_rows,
+                                  after_chunk=lambda batch: publish_balance_changes(number_pairs(batch)))
+            flash(f'Deleting {total_rows} production order(s) in the background (purge job #{job.id}). '
+                  f'Progress: {url_for("purge_job_status", job_id=job.id)}', 'info')
+            return redirect(url_for('balance_report'))
         
+        # Delete all orders for the selected production order / work center pairs in one statement
+        changed_keys = number_pairs(pairs)
+        deleted_count = delete_pairs(pairs)
         db.session.commit()
+        publish_balance_changes(changed_keys)
         flash(f'Successfully deleted {deleted_count} production order(s).', 'success')
     except Exception as e:
         db.session.rollback()
         flash(f'Error deleting production orders: {str(e)}', 'error')
     
     return redirect(url_for('balance_report'))
+
+@app.route('/admin/purge_jobs/<int:job_id>')
+def purge_job_status(job_id):
+    if 'user_id' not in session or not session.get('is_admin'):
+        return jsonify({'error': 'Admin privileges required'}), 403
+    
+    job = PurgeJob.query.get_or_404(job_id)
+    percent = round(job.deleted_rows * 100 / job.total_rows, 1) if job.total_rows else 100.0
+    
+    return jsonify({
+        'id': job.id,
+        'status': job.status,
+        'total_rows': job.total_rows,
+        'deleted_rows': job.deleted_rows,
+        'percent': min(percent, 100.0),
+        'error': job.error,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    })
+
+# Bulk Import Routes
+@app.route('/admin/import_orders', methods=['GET', 'POST'])
+def import_orders():
+    if 'user_id' not in session or not session.get('is_admin'):
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('login'))
+    
+    if request.method == 'POST':
+        upload = request.files.get('import_file')
+        if not upload or not upload.filename:
+            flash('Please choose an .xlsx or .csv file to import.', 'warning')
+            return redirect(url_for('import_orders'))
+        
+        try:
+            job = start_import_job(upload, session['user_id'], after_load=publish_balance_changes)
+            flash(f'Import #{job.id} started. Progress is shown below.', 'success')
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Error starting import: {str(e)}', 'error')
+        return redirect(url_for('import_orders'))
+    
+    jobs = ImportJob.query.order_by(ImportJob.created_at.desc()).limit(20).all()
+    return render_template('admin_import.html', jobs=jobs)
+
+@app.route('/admin/import_jobs/<int:job_id>')
+def import_job_status(job_id):
+    if 'user_id' not in session or not session.get('is_admin'):
+        return jsonify({'error': 'Admin privileges required'}), 403
+    
+    job = ImportJob.query.get_or_404(job_id)
+    processed = job.loaded_rows + job.rejected_rows
+    percent = round(processed * 100 / job.total_rows, 1) if job.total_rows else 0.0
+    
+    return jsonify({
+        'id': job.id,
+        'status': job.status,
+        'total_rows': job.total_rows,
+        'loaded_rows': job.loaded_rows,
+        'rejected_rows': job.rejected_rows,
+        'percent': 100.0 if job.status == 'done' else min(percent, 100.0),
+        'error': job.error,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    })
+
+@app.route('/admin/import_jobs/<int:job_id>/retry', methods=['POST'])
+def retry_import(job_id):
+    if 'user_id' not in session or not session.get('is_admin'):
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('login'))
+    
+    job = ImportJob.query.get_or_404(job_id)
+    if retry_import_job(job, after_load=publish_balance_changes):
+        flash(f'Import #{job.id} restarted. Rows it already loaded are skipped.', 'success')
+    else:
+        flash(f'Import #{job.id} cannot be retried: only failed imports whose file is still kept can.', 'warning')
+    return redirect(url_for('import_orders'))
+
+@app.route('/admin/import_jobs/<int:job_id>/rejects')
+def import_job_rejects(job_id):
+    if 'user_id' not in session or not session.get('is_admin'):
+        return redirect(url_for('login'))
+    
+    job = ImportJob.query.get_or_404(job_id)
+    path = reject_path(job)
+    if not os.path.exists(path):
+        flash('No reject file for this import.', 'warning')
+        return redirect(url_for('import_orders'))
+    
+    return send_file(path, mimetype='text/csv', as_attachment=True,
+                     download_name=f'import_{job.id}_rejects.csv')
+
+# Change Feed
+@app.route('/api/changes')
+@admission.admit('reports')
+def order_changes():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Login required'}), 401
+    
+    current_user = User.query.get(session['user_id'])
+    if not current_user or (not current_user.excel_access and not current_user.is_admin):
+        return jsonify({'error': 'Excel export permission required'}), 403
+    
+    # Same scope as the Excel export: non-admins see their own department's orders only
+    department = None if current_user.is_admin else current_user.department
+    try:
+        changes, next_cursor, has_more = read_changes(request.args.get('cursor', ''),
+                                                      request.args.get('limit', 1000, type=int), department)
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    
+    if request.args.get('format') == 'jsonl':
+        # One change per line; the cursor to resume from is in the headers
+        def generate():
+            for change in changes:
+                yield json.dumps(change) + '\n'
+        response = Response(generate(), mimetype='application/x-ndjson')
+    else:
+        response = jsonify({'changes': changes, 'next_cursor': next_cursor, 'has_more': has_more})
+    response.headers['X-Next-Cursor'] = next_cursor
+    response.headers['X-Has-More'] = 'true' if has_more else 'false'
+    return response
+
+# Request Profiles: any page opened by an admin with ?_profile=1 (see profiler.py)
+@app.route('/admin/profiles')
+def admin_profiles():
+    if 'user_id' not in session or not session.get('is_admin'):
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('login'))
+    
+    return render_template('admin_profiles.html', profiles=list_profiles())
+
+@app.route('/admin/profiles/<profile_id>')
+def admin_profile(profile_id):
+    if 'user_id' not in session or not session.get('is_admin'):
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('login'))
+    
+    profile = load_profile(profile_id)
+    if profile is None:
+        flash('Profile not found; older profiles are removed as new ones are stored.', 'warning')
+        return redirect(url_for('admin_profiles'))
+    
+    return render_template('admin_profile.html', profile=profile)
+
+@app.route('/admin/profiles/<profile_id>/download')
+def admin_profile_download(profile_id):
+    if 'user_id' not in session or not session.get('is_admin'):
+        flash('Access denied. Admin privileges required.', 'error')
+        return redirect(url_for('login'))
+    
+    path = profile_stats_path(profile_id)
+    if path is None:
+        flash('Profile not found; older profiles are removed as new ones are stored.', 'warning')
+        return redirect(url_for('admin_profiles'))
+    
+    # pstats format: python -m pstats <file>, or snakeviz <file>
+    return send_file(path, mimetype='application/octet-stream', as_attachment=True,
+                     download_name=f'profile_{profile_id}.prof')
+
+# Health Checks: for the load balancer and autoscaler, no login
+@app.route('/health/live')
+def health_live():
+    # Never touches the database: a slow database must not get a working process restarted
+    response = jsonify({'status': 'alive'})
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/health/ready')
+def health_ready():
+    ready, report = readiness({name or 'default': engine for name, engine in db.engines.items()})
+    # Load per admission class of this worker; never affects readiness
+    report['admission'] = admission.metrics()
+    response = jsonify(report)
+    response.status_code = 200 if ready else 503
+    response.headers['Cache-Control'] = 'no-store'
+    return response
@@ -0,0 +1,47 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+
+# Indexes replaced by wider ones in the models
+OBSOLETE_INDEXES = {
+    'production_order': ['ix_production_order_order_workcenter'],
+}
+
+
+def add_missing_columns(engine, table):
+    """Add model columns that an existing table lacks (create_all only creates missing tables); returns their names"""
+    inspector = inspect(engine)
+    if not inspector.has_table(table.name):
+        return []
+    existing = {column['name'] for column in inspector.get_columns(table.name)}
+    missing = [column for column in table.columns if column.name not in existing]
+    if missing:
+        table_name = engine.dialect.identifier_preparer.format_table(table)
+        with engine.begin() as connection:
+            for column in missing:
+                column_ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                connection.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {column_ddl}'))
+    return [column.name for column in missing]
+
+
+def sync_indexes(engine, table):
+    """Create model indexes missing from an existing table and drop the ones they replace"""
+    inspector = inspect(engine)
+    if not inspector.has_table(table.name):
+        return
+    existing = {index['name'] for index in inspector.get_indexes(table.name)}
+    with engine.begin() as connection:
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(connection)
+        for name in OBSOLETE_INDEXES.get(table.name, []):
+            if name in existing:
+                connection.execute(text(f'DROP INDEX {engine.dialect.identifier_preparer.quote(name)}'))
+
+
+def upgrade_tables(engine, tables):
+    """Bring existing tables up to the models: new columns, new indexes; returns the names of added columns"""
+    added = set()
+    for table in tables:
+        added.update(add_missing_columns(engine, table))
+        sync_indexes(engine, table)
+    return added
@@ -0,0 +1,137 @@
+"""Production settings for SQLite databases.
+
+Small sites run on the SQLite fallback with several gunicorn workers. Each
+connection is switched to WAL (readers no longer block the writer and the
+writer no longer blocks readers) with synchronous=NORMAL, so a commit is an
+append to the WAL and the fsync happens once per checkpoint for all the
+commits since the last one (group commit). Write transactions are
+serialised by a lock taken at their first INSERT/UPDATE/DELETE and released
+when the connection goes back to the pool after commit or rollback: a thread
+lock inside the worker and a lock file shared by the workers on the host, so
+writers queue instead of polling SQLite's busy handler.
+"""
+import os
+import threading
+import time
+import logging
+
+from sqlalchemy import event
+
+try:
+    import fcntl
+except ImportError:  # Windows: serialise within the process only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Milliseconds a statement waits for a lock held by another connection before "database is locked"
+BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+# Bytes of the database file read through mmap, 0 to turn it off
+MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+# Page cache per connection; negative values are KiB
+CACHE_SIZE = int(os.environ.get("SQLITE_CACHE_SIZE", str(-64 * 1024)))
+SERIALIZE_WRITES = os.environ.get("SQLITE_SERIALIZE_WRITES", "1") != "0"
+
+
+class WriteLock:
+    """Exclusive across the threads of this process and, through a lock file, across processes.
+
+    Re-entrant so a thread writing to two connections at once does not wait
+    on itself. Held for connections rather than threads: a connection can be
+    checked in on another thread than the one that wrote on it (e.g. when a
+    streamed response is closed), so any thread may release it. Waits at most
+    ``timeout`` seconds, then lets the write go ahead under SQLite's own busy
+    handling instead of failing it here.
+    """
+
+    def __init__(self, path=None, timeout=BUSY_TIMEOUT_MS / 1000):
+        self.path = path
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._state = threading.Lock()  # guards _owner and _depth
+        self._owner = None  # thread that took the lock, for re-entry
+        self._depth = 0
+        self._file = None
+
+    def acquire(self):
+        """True if the lock is now held and must be released once"""
+        with self._state:
+            if self._depth and self._owner == threading.get_ident():
+                self._depth += 1
+                return True
+        if not self._lock.acquire(timeout=self.timeout):
+            logger.warning(f'SQLite write lock busy for {self.timeout}s, writing without it')
+            return False
+        with self._state:
+            self._owner = threading.get_ident()
+            self._depth = 1
+        if self.path and fcntl is not None:
+            self._lock_file()
+        return True
+
+    def release(self):
+        with self._state:
+            self._depth -= 1
+            if self._depth:
+                return
+            self._owner = None
+            if self._file is not None:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+                self._file.close()
+                self._file = None
+        self._lock.release()
+
+    def _lock_file(self):
+        lock_file = open(self.path, 'a')
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self._file = lock_file
+                return
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    lock_file.close()
+                    logger.warning(f'SQLite write lock file {self.path} busy for {self.timeout}s, writing without it')
+                    return
+                time.sleep(0.002)
+
+
+def _is_write(statement, context):
+    if context is not None and (context.isinsert or context.isupdate or context.isdelete):
+        return True
+    return statement.lstrip()[:7].upper() in ('INSERT ', 'UPDATE ', 'DELETE ', 'REPLACE')
+
+
+def configure_sqlite(engine):
+    """Apply the pragmas and write serialisation to a SQLite engine; other engines are left alone"""
+    if engine.dialect.name != 'sqlite':
+        return
+    database = engine.url.database
+    on_disk = bool(database) and database != ':memory:' and not database.startswith('file::memory:')
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+        if on_disk:
+            cursor.execute('PRAGMA journal_mode = WAL')
+        cursor.execute('PRAGMA synchronous = NORMAL')
+        cursor.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
+        cursor.execute(f'PRAGMA cache_size = {CACHE_SIZE}')
+        cursor.close()
+
+    if not SERIALIZE_WRITES:
+        return
+    write_lock = WriteLock(database + '-writelock' if on_disk else None)
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def lock_for_write(connection, cursor, statement, parameters, context, executemany):
+        if 'sqlite_write_lock' not in connection.info and _is_write(statement, context):
+            connection.info['sqlite_write_lock'] = write_lock.acquire()
+
+    @event.listens_for(engine, 'checkin')
+    def unlock(dbapi_connection, connection_record):
+        # A connection goes back to the pool once its transaction has committed or rolled back
+        if connection_record.info.pop('sqlite_write_lock', False):
+            write_lock.release()
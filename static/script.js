@@ -52,7 +52,7 @@ function debounce(func, wait) {
     };
 }
 
-// Table sorting functionality
+// Table sorting functionality for small, fully rendered tables (large reports use VirtualTable)
 function sortTable(tableId, column, dataType) {
     var table = document.getElementById(tableId);
     if (!table) return;
@@ -97,7 +97,7 @@ function sortTable(tableId, column, dataType) {
     }
 }
 
-// Export table to CSV
+// Export a fully rendered table to CSV (large reports use VirtualTable.exportCSV)
 function exportTableToCSV(tableId, filename) {
     var table = document.getElementById(tableId);
     if (!table) return;
@@ -138,6 +138,193 @@ function exportTableToCSV(tableId, filename) {
     }
 }
 
+// Virtualized table for large reports: only the rows in view (plus a margin) are in the DOM, pages of
+// rows are fetched from a JSON endpoint as the user scrolls, and sorting and CSV export are done by the
+// server. Rows must have a fixed height (rowHeight), which the table's CSS enforces.
+function VirtualTable(options) {
+    this.viewport = document.getElementById(options.viewportId);  // scrollable element around the table
+    this.table = this.viewport.querySelector('table');
+    this.tbody = this.table.querySelector('tbody');
+    this.url = options.url;
+    this.csvUrl = options.csvUrl;
+    this.params = options.params || {};
+    this.total = options.total;
+    this.columns = options.columns;
+    this.renderRow = options.renderRow;
+    this.rowHeight = options.rowHeight || 41;
+    this.pageSize = options.pageSize || 100;
+    this.overscan = options.overscan || 10;
+    // Pages kept in memory; pages far from the view are dropped and fetched again when needed
+    this.maxPages = options.maxPages || 20;
+    this.sort = options.sort || 'created_at';
+    this.dir = options.dir || 'desc';
+    this.pages = new Map();  // page number -> array of rows, or null while loading
+    this.generation = 0;  // responses of an older sort order are dropped
+    this.frame = null;
+
+    var self = this;
+    this.viewport.addEventListener('scroll', function() { self.scheduleRender(); });
+    window.addEventListener('resize', function() { self.scheduleRender(); });
+    this.table.querySelectorAll('th[data-sort]').forEach(function(header) {
+        header.addEventListener('click', function() { self.setSort(header.getAttribute('data-sort')); });
+    });
+    this.updateSortIndicators();
+    this.render();
+}
+
+VirtualTable.prototype.query = function(extra) {
+    var params = new URLSearchParams(this.params);
+    params.set('sort', this.sort);
+    params.set('dir', this.dir);
+    Object.keys(extra || {}).forEach(function(key) {
+        params.set(key, extra[key]);
+    });
+    return params.toString();
+};
+
+VirtualTable.prototype.scheduleRender = function() {
+    var self = this;
+    if (this.frame === null) {
+        this.frame = requestAnimationFrame(function() {
+            self.frame = null;
+            self.render();
+        });
+    }
+};
+
+VirtualTable.prototype.spacer = function(height) {
+    var row = document.createElement('tr');
+    row.className = 'virtual-spacer';
+    var cell = document.createElement('td');
+    cell.colSpan = this.columns;
+    cell.style.height = height + 'px';
+    cell.style.padding = '0';
+    cell.style.border = '0';
+    row.appendChild(cell);
+    return row;
+};
+
+VirtualTable.prototype.placeholder = function() {
+    var row = document.createElement('tr');
+    var cell = document.createElement('td');
+    cell.colSpan = this.columns;
+    cell.className = 'text-muted';
+    cell.textContent = 'Loading...';
+    row.appendChild(cell);
+    return row;
+};
+
+VirtualTable.prototype.render = function() {
+    var visible = Math.ceil(this.viewport.clientHeight / this.rowHeight);
+    var first = Math.max(0, Math.floor(this.viewport.scrollTop / this.rowHeight) - this.overscan);
+    var last = Math.min(this.total, first + visible + 2 * this.overscan);
+
+    var fragment = document.createDocumentFragment();
+    fragment.appendChild(this.spacer(first * this.rowHeight));
+    if (first % 2 === 0) {
+        // Keeps table-striped rows on the same stripe while scrolling
+        fragment.appendChild(this.spacer(0));
+    }
+    for (var index = first; index < last; index++) {
+        var page = this.pages.get(Math.floor(index / this.pageSize));
+        var row = page ? page[index % this.pageSize] : null;
+        fragment.appendChild(row ? this.renderRow(row) : this.placeholder());
+    }
+    fragment.appendChild(this.spacer((this.total - last) * this.rowHeight));
+    this.tbody.replaceChildren(fragment);
+
+    if (last > first) {
+        var firstPage = Math.floor(first / this.pageSize);
+        var lastPage = Math.floor((last - 1) / this.pageSize);
+        for (var number = firstPage; number <= lastPage; number++) {
+            if (!this.pages.has(number)) {
+                this.load(number);
+            }
+        }
+        this.evict(firstPage);
+    }
+};
+
+VirtualTable.prototype.load = function(number) {
+    var self = this;
+    var generation = this.generation;
+    this.pages.set(number, null);
+    fetch(this.url + '?' + this.query({offset: number * this.pageSize, limit: this.pageSize}), {
+        headers: {'Accept': 'application/json'},
+        credentials: 'same-origin'
+    }).then(function(response) {
+        if (!response.ok) {
+            throw new Error('HTTP ' + response.status);
+        }
+        return response.json();
+    }).then(function(data) {
+        if (generation === self.generation) {
+            self.pages.set(number, data.rows);
+            self.scheduleRender();
+        }
+    }).catch(function(error) {
+        console.warn('Could not load rows:', error);
+        if (generation === self.generation) {
+            // Retried on the next scroll
+            self.pages.delete(number);
+        }
+    });
+};
+
+VirtualTable.prototype.evict = function(currentPage) {
+    if (this.pages.size <= this.maxPages) {
+        return;
+    }
+    var numbers = Array.from(this.pages.keys()).sort(function(a, b) {
+        return Math.abs(b - currentPage) - Math.abs(a - currentPage);
+    });
+    for (var i = 0; this.pages.size > this.maxPages && i < numbers.length; i++) {
+        if (this.pages.get(numbers[i]) !== null) {
+            this.pages.delete(numbers[i]);
+        }
+    }
+};
+
+VirtualTable.prototype.setSort = function(sort) {
+    if (this.sort === sort) {
+        this.dir = this.dir === 'asc' ? 'desc' : 'asc';
+    } else {
+        this.sort = sort;
+        this.dir = 'asc';
+    }
+    this.generation++;
+    this.pages.clear();
+    this.viewport.scrollTop = 0;
+    this.updateSortIndicators();
+    this.render();
+};
+
+VirtualTable.prototype.updateSortIndicators = function() {
+    var self = this;
+    this.table.querySelectorAll('th[data-sort]').forEach(function(header) {
+        header.classList.remove('sort-asc', 'sort-desc');
+        if (header.getAttribute('data-sort') === self.sort) {
+            header.classList.add(self.dir === 'asc' ? 'sort-asc' : 'sort-desc');
+        }
+    });
+};
+
+// Rows currently held in memory, e.g. for "select all"
+VirtualTable.prototype.loadedRows = function() {
+    var rows = [];
+    this.pages.forEach(function(page) {
+        if (page) {
+            rows.push.apply(rows, page);
+        }
+    });
+    return rows;
+};
+
+// Downloads the whole filtered report in the current order, built by the server
+VirtualTable.prototype.exportCSV = function() {
+    window.location.href = this.csvUrl + '?' + this.query();
+};
+
 // Print functionality
 function printPage() {
     window.print();
@@ -221,3 +408,243 @@ document.addEventListener('scroll', resetSessionTimer);
 
 // Initialize session timer
 resetSessionTimer();
+
+// Offline order queue
+// IN/OUT entries are stored in IndexedDB first, each line with its own key, and
+// sent to the server in batches. The server stores a key at most once, so a
+// batch resent after a dropped connection never counts stock twice. Lines stay
+// queued until the server has confirmed them.
+var OrderQueue = (function() {
+    var DB_NAME = 'pots_offline';
+    var STORE = 'orders';
+    var SYNC_INTERVAL = 15000;  // ms between background syncs
+    var BATCH_SIZE = 200;       // lines per request
+    var dbPromise = null;
+    var running = null;
+
+    function openDb() {
+        if (!dbPromise) {
+            dbPromise = new Promise(function(resolve, reject) {
+                var request = indexedDB.open(DB_NAME, 1);
+                request.onupgradeneeded = function() {
+                    request.result.createObjectStore(STORE, { keyPath: 'key' });
+                };
+                request.onsuccess = function() { resolve(request.result); };
+                request.onerror = function() { reject(request.error); };
+            });
+        }
+        return dbPromise;
+    }
+
+    function withStore(mode, action) {
+        return openDb().then(function(db) {
+            return new Promise(function(resolve, reject) {
+                var tx = db.transaction(STORE, mode);
+                var result = action(tx.objectStore(STORE));
+                tx.oncomplete = function() { resolve(result && 'result' in result ? result.result : result); };
+                tx.onerror = function() { reject(tx.error); };
+            });
+        });
+    }
+
+    // Random v4 UUID; crypto.randomUUID needs HTTPS, getRandomValues does not
+    function newKey() {
+        var bytes = crypto.getRandomValues(new Uint8Array(16));
+        bytes[6] = (bytes[6] & 0x0f) | 0x40;
+        bytes[8] = (bytes[8] & 0x3f) | 0x80;
+        var hex = Array.from(bytes, function(b) { return b.toString(16).padStart(2, '0'); }).join('');
+        return hex.slice(0, 8) + '-' + hex.slice(8, 12) + '-' + hex.slice(12, 16) + '-' + hex.slice(16, 20) + '-' + hex.slice(20);
+    }
+
+    function currentUserId() {
+        return document.body.dataset.userId || '';
+    }
+
+    // lines: [{workcenter_id, production_order, quantity, remark}]
+    function add(orderType, lines) {
+        var enteredAt = new Date().toISOString();
+        var userId = currentUserId();
+        var queued = lines.map(function(line) {
+            return {
+                key: newKey(),
+                user_id: userId,
+                order_type: orderType,
+                workcenter_id: line.workcenter_id,
+                production_order: line.production_order,
+                quantity: line.quantity,
+                remark: line.remark || '',
+                entered_at: enteredAt,
+                status: 'pending',
+                error: null
+            };
+        });
+        return withStore('readwrite', function(store) {
+            queued.forEach(function(line) { store.put(line); });
+        }).then(function() { return queued; });
+    }
+
+    function all() {
+        return withStore('readonly', function(store) { return store.getAll(); });
+    }
+
+    function settle(results, sent) {
+        var byKey = {};
+        sent.forEach(function(line) { byKey[line.key] = line; });
+        return withStore('readwrite', function(store) {
+            results.forEach(function(result) {
+                var line = byKey[result.key];
+                if (!line) return;
+                if (result.status === 'saved' || result.status === 'duplicate') {
+                    store.delete(result.key);
+                } else if (result.status === 'rejected') {
+                    line.status = 'rejected';
+                    line.error = result.error;
+                    store.put(line);
+                }
+            });
+        });
+    }
+
+    function sendBatches(lines, notify, summary) {
+        if (lines.length === 0) {
+            return Promise.resolve(summary);
+        }
+        var batch = lines.slice(0, BATCH_SIZE);
+        var payload = batch.map(function(line) {
+            return {
+                key: line.key, user_id: line.user_id, order_type: line.order_type,
+                workcenter_id: line.workcenter_id, production_order: line.production_order,
+                quantity: line.quantity, remark: line.remark, entered_at: line.entered_at
+            };
+        });
+        return fetch(document.body.dataset.syncUrl, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            credentials: 'same-origin',
+            body: JSON.stringify({ orders: payload, notify: notify })
+        }).then(function(response) {
+            if (!response.ok) {
+                throw new Error('Sync failed with HTTP ' + response.status);
+            }
+            return response.json();
+        }).then(function(data) {
+            data.results.forEach(function(result) {
+                if (result.status === 'saved') summary.saved++;
+                if (result.status === 'rejected') summary.rejected.push(result.error);
+            });
+            return settle(data.results, batch);
+        }).then(function() {
+            return sendBatches(lines.slice(BATCH_SIZE), notify, summary);
+        });
+    }
+
+    // Send this user's pending lines; resolves to {saved, rejected: [errors], offline: bool}
+    function sync(notify) {
+        if (running) {
+            // One sync at a time; a sync asked for meanwhile runs after it
+            return running.then(function() { return sync(notify); });
+        }
+        var userId = currentUserId();
+        var summary = { saved: 0, rejected: [], offline: false };
+        running = all().then(function(lines) {
+            var pending = lines.filter(function(line) {
+                return line.status === 'pending' && String(line.user_id) === userId;
+            });
+            return sendBatches(pending, !!notify, summary);
+        }).catch(function(error) {
+            console.log('Orders kept in the offline queue:', error);
+            summary.offline = true;
+            return summary;
+        }).then(function(result) {
+            running = null;
+            renderStatus();
+            return result;
+        });
+        return running;
+    }
+
+    function discardRejected() {
+        return all().then(function(lines) {
+            return withStore('readwrite', function(store) {
+                lines.forEach(function(line) {
+                    if (line.status === 'rejected') store.delete(line.key);
+                });
+            });
+        }).then(renderStatus);
+    }
+
+    function retryRejected() {
+        return all().then(function(lines) {
+            return withStore('readwrite', function(store) {
+                lines.forEach(function(line) {
+                    if (line.status === 'rejected') {
+                        line.status = 'pending';
+                        line.error = null;
+                        store.put(line);
+                    }
+                });
+            });
+        }).then(function() { return sync(false); });
+    }
+
+    function renderStatus() {
+        var panel = document.getElementById('orderQueueStatus');
+        if (!panel) return Promise.resolve();
+        return all().then(function(lines) {
+            var userId = currentUserId();
+            var pending = lines.filter(function(line) { return line.status === 'pending' && String(line.user_id) === userId; });
+            var rejected = lines.filter(function(line) { return line.status === 'rejected' && String(line.user_id) === userId; });
+            if (pending.length === 0 && rejected.length === 0) {
+                panel.classList.add('d-none');
+                panel.innerHTML = '';
+                return;
+            }
+            var html = '';
+            if (pending.length) {
+                html += '<div><i class="fas fa-wifi me-2"></i><strong>' + pending.length +
+                    '</strong> order line(s) saved on this terminal, waiting to reach the server. ' +
+                    'They are sent automatically when the connection is back.</div>';
+            }
+            if (rejected.length) {
+                html += '<div class="mt-2"><i class="fas fa-exclamation-triangle me-2"></i><strong>' + rejected.length +
+                    '</strong> order line(s) were not accepted:<ul class="mb-2">';
+                rejected.forEach(function(line) {
+                    var text = line.order_type + ' ' + line.production_order + ' x ' + line.quantity + ': ' + (line.error || '');
+                    var item = document.createElement('li');
+                    item.textContent = text;
+                    html += item.outerHTML;
+                });
+                html += '</ul><button type="button" class="btn btn-sm btn-primary me-2" onclick="OrderQueue.retryRejected()">Retry</button>' +
+                    '<button type="button" class="btn btn-sm btn-outline-danger" onclick="OrderQueue.discardRejected()">Discard</button></div>';
+            }
+            panel.innerHTML = html;
+            panel.classList.remove('d-none');
+        });
+    }
+
+    function start() {
+        if (!window.indexedDB || !document.body.dataset.syncUrl) return;
+        renderStatus();
+        sync(false);
+        setInterval(function() { sync(false); }, SYNC_INTERVAL);
+        window.addEventListener('online', function() { sync(false); });
+    }
+
+    document.addEventListener('DOMContentLoaded', start);
+
+    return {
+        add: add,
+        sync: sync,
+        retryRejected: retryRejected,
+        discardRejected: discardRejected,
+        renderStatus: renderStatus
+    };
+})();
+
+// Queue entered lines, then try to send them right away.
+// Resolves to the sync summary; the lines are safe in the queue either way.
+function queueAndSyncOrders(orderType, lines) {
+    return OrderQueue.add(orderType, lines).then(function() {
+        return OrderQueue.sync(true);
+    });
+}
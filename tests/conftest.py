@@ -0,0 +1,54 @@
+"""Test setup: the application is imported once, against a throwaway SQLite database.
+
+app.py creates the schema and default data at import, so the environment
+has to point at the test database before anything imports it.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+_data_dir = tempfile.mkdtemp(prefix='pots-tests-')
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_data_dir, 'tests.db')}"
+os.environ["BALANCE_BROKER_PATH"] = os.path.join(_data_dir, 'balance_events.log')
+os.environ["ADMISSION_DIR"] = os.path.join(_data_dir, 'admission')
+os.environ["PROFILE_DIR"] = os.path.join(_data_dir, 'profiles')
+os.environ["IMPORT_DIR"] = os.path.join(_data_dir, 'imports')
+os.environ.setdefault("SESSION_SECRET", "tests")
+# Cheap hashes so logins do not dominate the timings
+os.environ.setdefault("PASSWORD_HASH_METHOD", "pbkdf2:sha256:1000")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import app as flask_app
+    flask_app.config['TESTING'] = True
+    return flask_app
+
+
+@pytest.fixture(scope='session')
+def db(app):
+    from app import db as database
+    return database
+
+
+# Sections test modules report after the run, e.g. the measured query budgets
+_summary = pytest.StashKey[dict]()
+
+
+@pytest.fixture(scope='session')
+def summary_sections(request):
+    """{title: lines} printed in the terminal summary when pytest runs with -v"""
+    return request.config.stash.setdefault(_summary, {})
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    if config.getoption('verbose') <= 0:
+        return
+    for title, lines in config.stash.get(_summary, {}).items():
+        terminalreporter.write_sep('-', title)
+        for line in lines:
+            terminalreporter.write_line(line)
@@ -0,0 +1,68 @@
+"""Admission control: saturated classes answer 503 quickly, health checks are never held back."""
+import pytest
+
+
+@pytest.fixture
+def admin(app):
+    client = app.test_client()
+    assert client.post('/login', data={'username': 'admin', 'password': 'admin123'}).status_code == 302
+    return client
+
+
+@pytest.fixture
+def gate(app, monkeypatch):
+    from app import admission
+    for settings in admission.classes.values():
+        monkeypatch.setitem(settings, 'wait', 0.05)
+    return admission
+
+
+def hold(gate, name):
+    """Take every slot of the class; returns the release functions"""
+    releases = [gate.acquire(name) for _ in range(gate.classes[name]['limit'])]
+    assert all(releases)
+    return releases
+
+
+def test_saturated_class_is_turned_away(app, admin, gate):
+    releases = hold(gate, 'exports')
+    try:
+        rejected_before = gate.metrics()['exports']['rejected']
+        response = admin.get('/admin/export_excel')
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
+        assert gate.metrics()['exports']['rejected'] == rejected_before + 1
+
+        # Other classes and the health checks are unaffected
+        assert admin.get('/admin/reports').status_code == 200
+        assert app.test_client().get('/health/live').status_code == 200
+        ready = app.test_client().get('/health/ready')
+        assert ready.status_code == 200
+        assert ready.get_json()['admission']['exports']['in_flight'] >= len(releases)
+    finally:
+        for release in releases:
+            release()
+    assert admin.get('/admin/export_excel').status_code == 200
+
+
+def test_api_gets_json_503(admin, gate):
+    releases = hold(gate, 'entry')
+    try:
+        response = admin.post('/api/orders/sync', json={'orders': []})
+        assert response.status_code == 503
+        assert 'error' in response.get_json()
+    finally:
+        for release in releases:
+            release()
+
+
+def test_streamed_page_holds_its_slot_until_sent(admin, gate, monkeypatch):
+    monkeypatch.setitem(gate.classes['reports'], 'limit', 1)
+    response = admin.get('/admin/balance_report', buffered=False)
+    assert response.status_code == 200
+    assert gate.acquire('reports') is None
+    response.get_data()
+    response.close()
+    release = gate.acquire('reports')
+    assert release is not None
+    release()
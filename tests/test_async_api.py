@@ -0,0 +1,75 @@
+"""The async read-only API: login through the Flask session, plant filtering and ETag revalidation."""
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip('starlette')
+pytest.importorskip('aiosqlite')
+pytest.importorskip('httpx')
+
+from starlette.testclient import TestClient  # noqa: E402
+
+
+@pytest.fixture
+def live(app, db, monkeypatch):
+    """TestClient for the async API with the session cookie of a logged-in admin, and two orders"""
+    import async_api
+    from models import ProductionOrder, User, WorkCenter
+    from order_headers import assign_headers
+    from order_hooks import orders_inserted
+
+    # Every request in a test should see the database as it is
+    monkeypatch.setattr(async_api._cache, 'seconds', 0)
+
+    with app.app_context():
+        admin = User.query.filter_by(username='admin').first()
+        workcenter = WorkCenter.query.order_by(WorkCenter.id).first()
+        records = [{
+            'production_order': number, 'workcenter_id': workcenter.id, 'quantity': 5, 'order_type': 'IN',
+            'remark': '', 'user_id': admin.id, 'user_name': admin.name, 'user_department': admin.department,
+            'plant': plant, 'created_at': datetime.utcnow(),
+        } for number, plant in (('LIVE-MAIN', admin.plant), ('LIVE-OTHER', 'OTHER'))]
+        assign_headers(records)
+        db.session.execute(ProductionOrder.__table__.insert(), records)
+        orders_inserted(records)
+        db.session.commit()
+
+    flask_client = app.test_client()
+    assert flask_client.post('/login', data={'username': 'admin', 'password': 'admin123'}).status_code == 302
+    cookie = flask_client.get_cookie(app.config['SESSION_COOKIE_NAME']).value
+
+    with TestClient(async_api.api) as client:
+        client.cookies.set(app.config['SESSION_COOKIE_NAME'], cookie)
+        yield client
+
+
+def test_login_required(live):
+    live.cookies.clear()
+    assert live.get('/api/live/recent_orders').status_code == 401
+    assert live.get('/api/live/balances').status_code == 401
+
+
+def test_recent_orders_only_show_the_session_plant(live):
+    response = live.get('/api/live/recent_orders', params={'limit': 100})
+    assert response.status_code == 200
+    numbers = [order['production_order'] for order in response.json()['orders']]
+    assert 'LIVE-MAIN' in numbers
+    assert 'LIVE-OTHER' not in numbers
+
+    # A poller passing the last id it has gets nothing new
+    last_id = response.json()['last_id']
+    assert live.get('/api/live/recent_orders', params={'since_id': last_id}).json()['orders'] == []
+
+
+def test_balances(live):
+    response = live.get('/api/live/balances', params={'limit': 5000})
+    assert response.status_code == 200
+    assert any(row['production_order'] == 'LIVE-MAIN' for row in response.json()['balances'])
+    assert live.get('/api/live/balances', params={'limit': 'many'}).status_code == 400
+
+
+def test_unchanged_response_is_not_modified(live):
+    first = live.get('/api/live/balances')
+    again = live.get('/api/live/balances', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
+    assert again.content == b''
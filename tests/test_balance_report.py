@@ -0,0 +1,92 @@
+"""Point-in-time balances: the as_of date is an IST day, and a bad date falls back to current balances."""
+import uuid
+from datetime import datetime
+
+
+def login(app, username, password):
+    client = app.test_client()
+    assert client.post('/login', data={'username': username, 'password': password}).status_code == 302
+    return client
+
+
+def test_as_of_ends_with_the_ist_day(app, db):
+    from models import ProductionOrder, User
+    from order_headers import assign_headers
+    from order_hooks import orders_inserted
+
+    number = f'ASOF-{uuid.uuid4().hex[:8]}'
+    with app.app_context():
+        admin = User.query.filter_by(username='admin').first()
+        # 2026-03-01 20:00 UTC is 2026-03-02 01:30 IST
+        records = [{
+            'production_order': number, 'workcenter_id': 1, 'quantity': 7, 'order_type': 'IN', 'remark': '',
+            'user_id': admin.id, 'user_name': admin.name, 'user_department': admin.department,
+            'plant': admin.plant, 'created_at': datetime(2026, 3, 1, 20, 0),
+        }]
+        assign_headers(records)
+        db.session.execute(ProductionOrder.__table__.insert(), records)
+        orders_inserted(records)
+        db.session.commit()
+
+    client = login(app, 'admin', 'admin123')
+    before = client.get('/balance_report', query_string={'as_of': '2026-03-01', 'search': number})
+    after = client.get('/balance_report', query_string={'as_of': '2026-03-02', 'search': number})
+    row = f'<strong>{number}</strong>'.encode()
+    assert row not in before.data
+    assert row in after.data
+
+
+def test_invalid_as_of_shows_current_balances(app):
+    client = login(app, 'admin', 'admin123')
+    response = client.get('/balance_report', query_string={'as_of': '2026-13-01'})
+    assert response.status_code == 200
+    assert b'Invalid date' in response.data
+    assert b' as of 2026-13-01' not in response.data
+
+
+def test_checkpoints_follow_backdated_inserts_and_deletes(app, db):
+    from balance_snapshots import balances_as_of, create_checkpoint
+    from models import BalanceCheckpoint, BalanceSnapshot, ProductionOrder, User
+    from order_headers import assign_headers
+    from order_hooks import orders_deleting, orders_inserted
+
+    number = f'CKPT-{uuid.uuid4().hex[:8]}'
+    with app.app_context():
+        admin = User.query.filter_by(username='admin').first()
+
+        def insert(order_type, quantity, created_at):
+            records = [{
+                'production_order': number, 'workcenter_id': 1, 'quantity': quantity, 'order_type': order_type,
+                'remark': '', 'user_id': admin.id, 'user_name': admin.name, 'user_department': admin.department,
+                'plant': admin.plant, 'created_at': created_at,
+            }]
+            assign_headers(records)
+            db.session.execute(ProductionOrder.__table__.insert(), records)
+            orders_inserted(records)
+            db.session.commit()
+
+        def delete(order_filter):
+            order_filter = db.and_(ProductionOrder.production_order == number, order_filter)
+            orders_deleting(order_filter)
+            ProductionOrder.query.filter(order_filter).delete(synchronize_session=False)
+            db.session.commit()
+
+        def as_of(day):
+            return balances_as_of(datetime(2025, 12, day), search=number).get((number, 1))
+
+        insert('IN', 10, datetime(2025, 12, 2))
+        insert('OUT', 3, datetime(2025, 12, 4))
+        checkpoints = [create_checkpoint(datetime(2025, 12, day)).id for day in (3, 5)]
+        assert as_of(6) == [10, 3]
+
+        # Synced late, entered before both checkpoints
+        insert('IN', 5, datetime(2025, 12, 1))
+        assert (as_of(4), as_of(6)) == ([15, 0], [15, 3])
+
+        # Purging an old order adjusts the checkpoints instead of dropping them
+        delete(ProductionOrder.order_type == 'OUT')
+        assert (as_of(4), as_of(6)) == ([15, 0], [15, 0])
+        delete(ProductionOrder.order_type == 'IN')
+        assert (as_of(4), as_of(6)) == (None, None)
+        assert BalanceCheckpoint.query.filter(BalanceCheckpoint.id.in_(checkpoints)).count() == 2
+        assert BalanceSnapshot.query.filter_by(production_order=number).count() == 0
@@ -0,0 +1,56 @@
+"""Live balance stream: each connection ends after a while, a reconnect catches up, and open streams are capped."""
+import re
+
+import pytest
+
+
+@pytest.fixture
+def admin(app):
+    client = app.test_client()
+    assert client.post('/login', data={'username': 'admin', 'password': 'admin123'}).status_code == 302
+    return client
+
+
+@pytest.fixture
+def short_streams(monkeypatch):
+    import routes
+    monkeypatch.setattr(routes, 'BALANCE_STREAM_SECONDS', 0.3)
+
+
+def row(key, balance):
+    return {'key': key, 'production_order': key, 'workcenter_id': 1,
+            'total_in': balance, 'total_out': 0, 'balance': balance}
+
+
+def test_reconnect_replays_missed_events_once(admin, short_streams):
+    from app import balance_hub
+
+    balance_hub.publish([row('STREAM-A_1', 1)])
+    inode, offset = balance_hub.broker.end_position()
+    balance_hub.publish([row('STREAM-B_1', 2)])
+
+    # Ends by itself, after delivering what was published since the client's last event
+    response = admin.get('/balance_report/stream', headers={'Last-Event-ID': f'{inode}-{offset}'})
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    assert 'STREAM-A_1' not in body
+    assert 'STREAM-B_1' in body
+    last_id = re.findall(r'^id: (\S+)$', body, re.MULTILINE)[-1]
+
+    balance_hub.publish([row('STREAM-C_1', 3)])
+    body = admin.get('/balance_report/stream', query_string={'last_event_id': last_id}).get_data(as_text=True)
+    assert 'STREAM-B_1' not in body
+    assert 'STREAM-C_1' in body
+
+
+def test_open_streams_are_capped(admin, short_streams, monkeypatch):
+    from app import admission
+
+    monkeypatch.setitem(admission.classes['streams'], 'limit', 1)
+    release = admission.acquire('streams')
+    assert release is not None
+    try:
+        assert admin.get('/balance_report/stream').status_code == 503
+    finally:
+        release()
+    assert admin.get('/balance_report/stream').status_code == 200
@@ -0,0 +1,131 @@
+"""Change feed: what a consumer may read, and when new rows are held back."""
+from datetime import datetime, timedelta
+
+import pytest
+
+
+def insert_orders(db, records):
+    from models import ProductionOrder
+    from order_headers import assign_headers
+    from order_hooks import orders_inserted
+    assign_headers(records)
+    db.session.execute(ProductionOrder.__table__.insert(), records)
+    orders_inserted(records)
+    db.session.commit()
+
+
+def read_all(client, cursor=''):
+    changes = []
+    while True:
+        page = client.get('/api/changes', query_string={'cursor': cursor, 'limit': 5000}).get_json()
+        changes.extend(page['changes'])
+        cursor = page['next_cursor']
+        if not page['has_more']:
+            return changes
+
+
+def login(app, username, password):
+    client = app.test_client()
+    assert client.post('/login', data={'username': username, 'password': password}).status_code == 302
+    return client
+
+
+def test_other_plants_ids_are_not_gaps(app, db):
+    from models import ProductionOrder, User
+
+    with app.app_context():
+        admin = User.query.filter_by(username='admin').first()
+        plant = admin.plant
+        last_id = db.session.query(db.func.max(ProductionOrder.id)).execution_options(all_plants=True).scalar() or 0
+        # A shared database: another plant's order sits between this plant's new orders
+        insert_orders(db, [{
+            'production_order': f'GAP-{order_plant}', 'workcenter_id': 1, 'quantity': 1, 'order_type': 'IN',
+            'remark': '', 'user_id': admin.id, 'user_name': admin.name, 'user_department': admin.department,
+            'plant': order_plant, 'created_at': datetime.utcnow(),
+        } for order_plant in (plant, 'GAP-OTHER', plant)])
+
+    inserted = [change['production_order'] for change in read_all(login(app, 'admin', 'admin123'), f'{last_id}-0')
+                if change['op'] == 'insert']
+    assert inserted == [f'GAP-{plant}', f'GAP-{plant}']
+
+
+@pytest.fixture
+def department_orders(app, db):
+    """One kept and one deleted order per department, entered an hour ago; returns {department: username}"""
+    from models import ProductionOrder, User
+    from order_hooks import orders_deleting
+
+    with app.app_context():
+        users = {}
+        for department in ('Production', 'Quality Control'):
+            username = f'feed-{department.split()[0].lower()}'
+            user = User.query.filter_by(username=username).first() or User()
+            user.username = username
+            user.name = f'Feed {department}'
+            user.department = department
+            user.excel_access = True
+            user.set_password('feed')
+            db.session.add(user)
+            users[department] = user
+        db.session.commit()
+
+        insert_orders(db, [{
+            'production_order': f'FEED-{department.split()[0].upper()}-{kind}', 'workcenter_id': 1, 'quantity': 1,
+            'order_type': 'IN', 'remark': 'confidential', 'user_id': user.id, 'user_name': user.name,
+            'user_department': department, 'plant': user.plant,
+            'created_at': datetime.utcnow() - timedelta(hours=1),
+        } for department, user in users.items() for kind in ('KEPT', 'DELETED')])
+
+        deleted = ProductionOrder.production_order.like('FEED-%-DELETED')
+        orders_deleting(deleted)
+        ProductionOrder.query.filter(deleted).delete(synchronize_session=False)
+        db.session.commit()
+        return {department: user.username for department, user in users.items()}
+
+
+def test_non_admin_reads_only_own_department(app, department_orders):
+    changes = read_all(login(app, department_orders['Production'], 'feed'))
+    inserted = {change['production_order'] for change in changes if change['op'] == 'insert'}
+    deleted = {change['production_order'] for change in changes if change['op'] == 'delete'}
+    assert 'FEED-PRODUCTION-KEPT' in inserted
+    assert 'FEED-PRODUCTION-DELETED' in deleted
+    assert not any(number.startswith('FEED-QUALITY') for number in inserted | deleted)
+    assert all(change['user_department'] == 'Production' for change in changes if change['op'] == 'insert')
+
+
+def test_admin_reads_every_department(app, department_orders):
+    inserted = {change['production_order'] for change in read_all(login(app, 'admin', 'admin123'))
+                if change['op'] == 'insert'}
+    assert {'FEED-PRODUCTION-KEPT', 'FEED-QUALITY-KEPT'} <= inserted
+
+
+def test_backdated_row_behind_a_gap_is_held_back(app, db):
+    from models import OrderTombstone, ProductionOrder, User
+
+    with app.app_context():
+        admin = User.query.filter_by(username='admin').first()
+        last_id = max(
+            db.session.query(db.func.max(ProductionOrder.id)).execution_options(all_plants=True).scalar() or 0,
+            db.session.query(db.func.max(OrderTombstone.order_id)).scalar() or 0,
+        )
+
+        def order(order_id, number):
+            # Entered offline an hour ago, as /api/orders/sync stores it
+            return {'id': order_id, 'production_order': number, 'workcenter_id': 1, 'quantity': 1,
+                    'order_type': 'IN', 'remark': '', 'user_id': admin.id, 'user_name': admin.name,
+                    'user_department': admin.department, 'plant': admin.plant,
+                    'created_at': datetime.utcnow() - timedelta(hours=1)}
+
+        earlier, later = order(last_id + 1, 'BACKDATED-EARLIER'), order(last_id + 2, 'BACKDATED-LATER')
+        # The next id is still held by an open transaction when the synced row commits
+        insert_orders(db, [later])
+
+    client = login(app, 'admin', 'admin123')
+    page = client.get('/api/changes', query_string={'cursor': f'{last_id}-0'}).get_json()
+    assert [change for change in page['changes'] if change['op'] == 'insert'] == []
+    assert page['next_cursor'].startswith(f'{last_id}-')
+
+    with app.app_context():
+        insert_orders(db, [earlier])
+    inserted = [change['production_order'] for change in read_all(client, f'{last_id}-0') if change['op'] == 'insert']
+    assert inserted == ['BACKDATED-EARLIER', 'BACKDATED-LATER']
@@ -0,0 +1,16 @@
+"""Health checks: readiness follows the database probe only."""
+
+
+def test_ready_follows_the_database_probe(app, monkeypatch):
+    import health
+
+    client = app.test_client()
+    response = client.get('/health/ready')
+    assert response.status_code == 200
+    assert set(response.get_json()) >= {'status', 'databases'}
+    assert 'startup' not in response.get_json()
+
+    monkeypatch.setattr(health, 'READY_MAX_DB_MS', -1)
+    response = client.get('/health/ready')
+    assert response.status_code == 503
+    assert not any(database['ok'] for database in response.get_json()['databases'].values())
@@ -0,0 +1,70 @@
+"""Bulk import: a failed import can be retried without loading any row twice."""
+import io
+import os
+import uuid
+
+import pytest
+
+
+@pytest.fixture
+def admin(app):
+    client = app.test_client()
+    assert client.post('/login', data={'username': 'admin', 'password': 'admin123'}).status_code == 302
+    return client
+
+
+@pytest.fixture
+def sync_jobs(monkeypatch):
+    """Run import jobs in the request instead of on a background thread"""
+    import order_import
+    monkeypatch.setattr(order_import, '_start_thread',
+                        lambda job, after_load: order_import.run_import_job(job.id, after_load))
+    return order_import
+
+
+def test_failed_import_is_retried_without_duplicates(app, db, admin, sync_jobs, monkeypatch):
+    from models import ImportJob, ProductionOrder
+
+    number = f'RETRY-{uuid.uuid4().hex[:8]}'
+    rows = ['production_order,workcenter_id,quantity,order_type'] + [f'{number},1,{n},IN' for n in range(1, 8)]
+    monkeypatch.setattr(sync_jobs, 'BATCH_SIZE', 3)
+
+    # The second batch fails: the first stays loaded and the job is marked failed
+    load_batch = sync_jobs.load_batch
+    calls = []
+
+    def failing_load(records):
+        calls.append(len(records))
+        if len(calls) == 2:
+            raise RuntimeError('connection lost')
+        load_batch(records)
+
+    monkeypatch.setattr(sync_jobs, 'load_batch', failing_load)
+    upload = ('\n'.join(rows) + '\n').encode()
+    response = admin.post('/admin/import_orders', data={'import_file': (io.BytesIO(upload), 'orders.csv')},
+                          content_type='multipart/form-data')
+    assert response.status_code == 302
+
+    def stored():
+        with app.app_context():
+            return sorted(quantity for quantity, in db.session.query(ProductionOrder.quantity).filter(
+                ProductionOrder.production_order == number))
+
+    with app.app_context():
+        job = ImportJob.query.order_by(ImportJob.id.desc()).first()
+        job_id, path = job.id, sync_jobs.upload_path(job)
+    assert admin.get(f'/admin/import_jobs/{job_id}').get_json()['status'] == 'failed'
+    assert stored() == [1, 2, 3]
+    assert os.path.exists(path)
+
+    response = admin.post(f'/admin/import_jobs/{job_id}/retry')
+    assert response.status_code == 302
+    job = admin.get(f'/admin/import_jobs/{job_id}').get_json()
+    assert job['status'] == 'done'
+    assert job['loaded_rows'] == 7
+    assert stored() == [1, 2, 3, 4, 5, 6, 7]
+    assert not os.path.exists(path)
+
+    # A finished import is not run again
+    admin.post(f'/admin/import_jobs/{job_id}/retry')
+    assert stored() == [1, 2, 3, 4, 5, 6, 7]
@@ -0,0 +1,55 @@
+"""Offline order sync: each key is stored once, and stale entries are refused."""
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def admin(app):
+    client = app.test_client()
+    assert client.post('/login', data={'username': 'admin', 'password': 'admin123'}).status_code == 302
+    return client
+
+
+def line(number, key, **fields):
+    return dict({'key': key, 'order_type': 'IN', 'production_order': number, 'workcenter_id': 1, 'quantity': 2},
+                **fields)
+
+
+def stored(app, db, number):
+    from models import ProductionOrder
+    with app.app_context():
+        return db.session.query(ProductionOrder).filter(ProductionOrder.production_order == number).count()
+
+
+def test_same_key_in_one_batch_is_stored_once(app, db, admin):
+    number, key = f'SYNC-{uuid.uuid4().hex[:8]}', uuid.uuid4().hex
+    response = admin.post('/api/orders/sync', json={'orders': [line(number, key), line(number, key)]})
+    assert [result['status'] for result in response.get_json()['results']] == ['saved', 'duplicate']
+    assert stored(app, db, number) == 1
+
+
+def test_same_key_in_later_batch_is_duplicate(app, db, admin):
+    number, key = f'SYNC-{uuid.uuid4().hex[:8]}', uuid.uuid4().hex
+    first = admin.post('/api/orders/sync', json={'orders': [line(number, key)]})
+    again = admin.post('/api/orders/sync', json={'orders': [line(number, key)]})
+    assert first.get_json()['results'][0]['status'] == 'saved'
+    assert again.get_json()['results'][0]['status'] == 'duplicate'
+    assert stored(app, db, number) == 1
+
+
+def test_entries_older_than_offline_window_are_rejected(app, db, admin):
+    from order_sync import SYNC_MAX_OFFLINE_HOURS
+
+    number = f'SYNC-{uuid.uuid4().hex[:8]}'
+    old = datetime.utcnow() - timedelta(hours=SYNC_MAX_OFFLINE_HOURS + 1)
+    recent = datetime.utcnow() - timedelta(hours=SYNC_MAX_OFFLINE_HOURS - 1)
+    response = admin.post('/api/orders/sync', json={'orders': [
+        line(number, uuid.uuid4().hex, entered_at=old.isoformat() + 'Z'),
+        line(number, uuid.uuid4().hex, entered_at=recent.isoformat() + 'Z'),
+    ]})
+    results = response.get_json()['results']
+    assert results[0]['status'] == 'rejected' and 'hours ago' in results[0]['error']
+    assert results[1]['status'] == 'saved'
+    assert stored(app, db, number) == 1
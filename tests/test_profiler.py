@@ -0,0 +1,62 @@
+"""Per-request profiles: admin only, stored with a summary page and a pstats download."""
+import pstats
+
+
+def login(app, username, password):
+    client = app.test_client()
+    assert client.post('/login', data={'username': username, 'password': password}).status_code == 302
+    return client
+
+
+def test_admin_request_is_profiled(app, tmp_path):
+    client = login(app, 'admin', 'admin123')
+    response = client.get('/admin/reports?_profile=1')
+    assert response.status_code == 200
+    profile_id = response.headers['X-Profile-Id']
+
+    from profiler import load_profile
+    profile = load_profile(profile_id)
+    assert profile['endpoint'] == 'admin_reports'
+    assert profile['sql']['count'] >= 1
+    assert [template['name'] for template in profile['templates']] == ['admin_reports.html']
+    assert profile['memory']['peak_bytes'] > 0
+    assert profile['functions']
+
+    page = client.get(f'/admin/profiles/{profile_id}')
+    assert page.status_code == 200
+    assert b'admin_reports.html' in page.data
+
+    download = client.get(f'/admin/profiles/{profile_id}/download')
+    assert download.status_code == 200
+    path = tmp_path / 'request.prof'
+    path.write_bytes(download.data)
+    assert pstats.Stats(str(path)).total_calls > 0
+
+
+def test_streamed_page_is_profiled_until_sent(app):
+    client = login(app, 'admin', 'admin123')
+    response = client.get('/admin/balance_report', headers={'X-Profile': '1'}, buffered=False)
+    profile_id = response.headers['X-Profile-Id']
+
+    from profiler import load_profile
+    assert load_profile(profile_id) is None
+    response.get_data()
+    response.close()
+    profile = load_profile(profile_id)
+    assert [template['name'] for template in profile['templates']] == ['admin_balance_report.html']
+    assert profile['templates'][0]['sql_seconds'] > 0
+
+
+def test_only_admins_are_profiled(app):
+    client = app.test_client()
+    with client.session_transaction() as client_session:
+        client_session.update(user_id=1, username='operator', is_admin=False)
+    response = client.get('/reports?_profile=1')
+    assert response.status_code == 200
+    assert 'X-Profile-Id' not in response.headers
+
+
+def test_unknown_profile(app):
+    client = login(app, 'admin', 'admin123')
+    assert client.get('/admin/profiles/../../app.py').status_code in (302, 404)
+    assert client.get('/admin/profiles/20260101-000000-abcdef/download').status_code == 302
@@ -0,0 +1,360 @@
+"""Query budgets for every route.
+
+The order history is seeded at 1x and then 10x ``QUERY_BUDGET_ORDERS`` rows
+and every route in routes.py is requested through the test client at both
+sizes. Each case asserts:
+
+- the SQL statements run by the request stay within ``max_statements`` and
+  do not grow with the data (an N+1 adds statements per row), and
+- the runtime at 10x is at most ``max_growth`` times the runtime at 1x
+  (10x data allows ~10 for pages that list every row; aggregated or paged
+  routes should barely move). Superlinear query patterns fail either way.
+
+A route without a case fails ``test_every_route_has_a_case``; add a case
+with a budget measured on your change (``pytest tests -v`` lists them after the run).
+
+    python -m pytest tests
+"""
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+BASE_ORDERS = int(os.environ.get("QUERY_BUDGET_ORDERS", "300"))
+SCALE = 10
+# Best of this many requests per measurement, to keep timings steady
+REPEATS = 3
+# Requests faster than this are compared as if they took this long; below it the ratio is noise
+TIME_FLOOR = 0.005
+
+# Workcenters, departments and users in the seeded plant
+WORKCENTERS = 5
+OPERATORS = 4
+# Orders per production order: IN, IN, OUT at the same work center
+ORDERS_PER_PAIR = 3
+
+# Never requested, with the reason
+SKIPPED = {
+    'static': 'served by Flask, no queries',
+    'balance_report_stream': 'server-sent events, no queries; covered by tests/test_balance_stream.py',
+    'logout': 'would end the test client session',
+    'do_login': 'measured by benchmarks/bench_login.py',
+}
+
+
+@dataclass
+class Case:
+    endpoint: str
+    path: object  # str, or callable(ids) -> str
+    max_statements: int
+    max_growth: float
+    method: str = 'GET'
+    data: object = None  # dict, or callable(ids) -> dict
+    json: object = None  # JSON body instead of form data, same forms as data
+    user: str = 'admin'
+    label: str = ''
+    status: tuple = (200, 302)
+
+    @property
+    def id(self):
+        return self.label or self.endpoint
+
+
+CONSTANT = 3.0
+LINEAR = 15.0
+
+CASES = [
+    Case('login', '/', 2, CONSTANT),
+    Case('menu', '/menu', 2, CONSTANT, user='operator'),
+    Case('in_orders', '/in_orders', 5, CONSTANT, user='operator'),
+    Case('out_orders', '/out_orders', 5, CONSTANT, user='operator'),
+    Case('save_orders', '/save_orders', 10, CONSTANT, method='POST', user='operator', label='save_orders_in',
+         data={'order_type': 'IN', 'orders': ['1|BUDGET-SAVE|5|', '2|BUDGET-SAVE|5|']}),
+    Case('save_orders', '/save_orders', 11, CONSTANT, method='POST', user='operator', label='save_orders_out',
+         data={'order_type': 'OUT', 'orders': ['1|BUDGET-SAVE|5|']}),
+    Case('sync_orders', '/api/orders/sync', 11, CONSTANT, method='POST', user='operator',
+         json=lambda ids: {'orders': [
+             {'key': f'budget-{time.monotonic_ns()}-{line}', 'order_type': 'IN', 'workcenter_id': ids['workcenter'],
+              'production_order': 'BUDGET-SYNC', 'quantity': 1} for line in range(20)
+         ]}),
+    Case('reports', '/reports', 6, LINEAR, user='operator'),
+    Case('reports', '/reports', 6, LINEAR, label='reports_admin'),
+    Case('balance_report', '/balance_report', 6, LINEAR, user='operator'),
+    Case('balance_report', '/balance_report?open_only=1', 6, LINEAR, user='operator', label='balance_report_open_only'),
+    Case('balance_report', lambda ids: f'/balance_report?as_of={ids["today"]}', 7, LINEAR,
+         user='operator', label='balance_report_as_of'),
+    Case('admin_dashboard', '/admin/dashboard', 7, CONSTANT),
+    Case('admin_users', '/admin/users', 4, CONSTANT),
+    Case('create_user', '/admin/create_user', 4, CONSTANT, method='POST',
+         data=lambda ids: {'username': f'budget-{time.monotonic_ns()}', 'password': 'x', 'department': 'Production'}),
+    Case('edit_user', lambda ids: f'/admin/edit_user/{ids["operator"]}', 5, CONSTANT, method='POST',
+         data=lambda ids: {'username': 'budget-operator', 'name': 'Budget Operator', 'department': 'Production',
+                           'excel_access': '1', 'is_active': '1'}),
+    Case('delete_user', lambda ids: f'/admin/delete_user/{ids["spare_user"]()}', 5, CONSTANT, method='POST'),
+    Case('admin_reports', '/admin/reports', 4, CONSTANT),
+    Case('admin_reports_rows', '/admin/reports/rows?offset=100&limit=100', 3, LINEAR),
+    Case('admin_reports_rows', '/admin/reports/rows?offset=0&limit=500&sort=workcenter&dir=asc', 3, LINEAR,
+         label='admin_reports_rows_sorted'),
+    Case('admin_reports_csv', '/admin/reports/export.csv?sort=quantity', 3, LINEAR),
+    Case('admin_balance_report', '/admin/balance_report', 5, LINEAR),
+    Case('admin_balance_report', '/admin/balance_report?open_only=1', 5, LINEAR, label='admin_balance_report_open_only'),
+    Case('admin_balance_report', '/admin/balance_report?plant=ALL', 5, LINEAR, label='admin_balance_report_all_plants'),
+    Case('admin_wip_aging', '/admin/wip_aging', 4, LINEAR),
+    Case('export_excel', '/admin/export_excel', 8, LINEAR),
+    Case('export_excel', '/admin/export_excel?by_workcenter=1', 10, LINEAR, label='export_excel_by_workcenter'),
+    Case('export_parquet_file', '/admin/export_parquet', 3, LINEAR),
+    Case('user_export_excel', '/export_excel', 8, LINEAR, user='operator'),
+    Case('master_data', '/admin/master_data', 5, CONSTANT),
+    Case('create_workcenter', '/admin/create_workcenter', 3, CONSTANT, method='POST',
+         data=lambda ids: {'name': f'WC-BUDGET-{time.monotonic_ns()}'}),
+    Case('edit_workcenter', lambda ids: f'/admin/edit_workcenter/{ids["workcenter"]}', 4, CONSTANT, method='POST',
+         data={'name': 'WC001 - Assembly', 'is_active': '1'}),
+    Case('delete_workcenter', lambda ids: f'/admin/delete_workcenter/{ids["spare_workcenter"]()}', 6, CONSTANT,
+         method='POST'),
+    Case('create_department', '/admin/create_department', 3, CONSTANT, method='POST',
+         data=lambda ids: {'name': f'Dept-{time.monotonic_ns()}'}),
+    Case('edit_department', lambda ids: f'/admin/edit_department/{ids["department"]}', 3, CONSTANT, method='POST',
+         data={'name': 'Production', 'is_active': '1'}),
+    Case('delete_department', lambda ids: f'/admin/delete_department/{ids["spare_department"]()}', 5, CONSTANT,
+         method='POST'),
+    Case('bulk_delete_orders', '/admin/bulk_delete_orders', 11, CONSTANT, method='POST',
+         data=lambda ids: {'order_ids': ids['saved_order_ids']()}),
+    Case('bulk_delete_by_production_order', '/admin/bulk_delete_by_production_order', 12, CONSTANT, method='POST',
+         data=lambda ids: {'production_orders': [f'{ids["saved_header_id"]()}:2']}),
+    Case('purge_job_status', lambda ids: f'/admin/purge_jobs/{ids["purge_job"]}', 3, CONSTANT),
+    Case('import_orders', '/admin/import_orders', 3, CONSTANT),
+    Case('import_job_status', lambda ids: f'/admin/import_jobs/{ids["import_job"]}', 3, CONSTANT),
+    Case('retry_import', lambda ids: f'/admin/import_jobs/{ids["import_job"]}/retry', 3, CONSTANT, method='POST'),
+    Case('import_job_rejects', lambda ids: f'/admin/import_jobs/{ids["import_job"]}/rejects', 3, CONSTANT),
+    Case('order_changes', '/api/changes?limit=1000', 6, LINEAR),
+    Case('order_changes', '/api/changes?limit=100&format=jsonl', 5, CONSTANT, label='order_changes_page'),
+    Case('admin_profiles', '/admin/profiles', 0, CONSTANT),
+    Case('admin_profile', lambda ids: f'/admin/profiles/{ids["profile"]()}', 0, CONSTANT),
+    Case('admin_profile_download', lambda ids: f'/admin/profiles/{ids["profile"]()}/download', 0, CONSTANT),
+    Case('health_live', '/health/live', 0, CONSTANT, user='anonymous'),
+    Case('health_ready', '/health/ready', 3, CONSTANT, user='anonymous'),
+]
+
+
+@dataclass
+class Measurement:
+    statements: int = 0
+    seconds: float = 0.0
+    status: int = 0
+
+
+@dataclass
+class Results:
+    by_scale: dict = field(default_factory=dict)  # scale -> {case id: Measurement}
+
+
+def seed_orders(db, start, count, workcenter_ids, users):
+    """Insert orders start..start+count through the same hooks the application uses.
+
+    users are (id, name, department, plant) tuples.
+    """
+    from models import ProductionOrder
+    from order_headers import assign_headers
+    from order_hooks import orders_inserted
+    now = datetime.utcnow()
+    records = []
+    for index in range(start, start + count):
+        pair = index // ORDERS_PER_PAIR
+        user_id, user_name, user_department, plant = users[pair % len(users)]
+        records.append({
+            'production_order': f'PO-{pair:06d}',
+            'workcenter_id': workcenter_ids[pair % len(workcenter_ids)],
+            'quantity': 10 if index % ORDERS_PER_PAIR < 2 else 15,
+            'order_type': 'IN' if index % ORDERS_PER_PAIR < 2 else 'OUT',
+            'remark': '',
+            'user_id': user_id,
+            'user_name': user_name,
+            'user_department': user_department,
+            'plant': plant,
+            # Spread over the last three weeks, newest last
+            'created_at': now - timedelta(days=21) + timedelta(seconds=index * 60),
+        })
+    assign_headers(records)
+    db.session.execute(ProductionOrder.__table__.insert(), records)
+    orders_inserted(records)
+    db.session.commit()
+
+
+@pytest.fixture(scope='session')
+def seeded(app, db):
+    """Users, master data and jobs referenced by the cases; returns the ids and a function adding orders"""
+    from models import User, WorkCenter, Department, PurgeJob, ImportJob, ProductionOrder, ProductionOrderHeader
+
+    with app.app_context():
+        operators = []
+        for number in range(OPERATORS):
+            user = User.query.filter_by(username=f'operator{number}').first() or User()
+            user.username = f'operator{number}'
+            user.name = f'Operator {number}'
+            user.department = ['Production', 'Quality Control'][number % 2]
+            user.excel_access = True
+            user.set_password('operator')
+            db.session.add(user)
+            operators.append(user)
+        purge_job = PurgeJob(pairs='[]', total_rows=0, status='done')
+        import_job = ImportJob(filename='budget.csv', status='done')
+        db.session.add_all([purge_job, import_job])
+        db.session.commit()
+
+        workcenter_ids = [workcenter.id for workcenter in WorkCenter.query.order_by(WorkCenter.id).limit(WORKCENTERS)]
+        users = [(user.id, *user.order_snapshot(), user.plant)
+                 for user in operators + [User.query.filter_by(username='admin').first()]]
+        ids = {
+            'operator': operators[0].id,
+            'workcenter': workcenter_ids[0],
+            'department': Department.query.filter_by(name='Production').first().id,
+            'purge_job': purge_job.id,
+            'import_job': import_job.id,
+            'today': datetime.utcnow().strftime('%Y-%m-%d'),
+        }
+
+    def spare(model, **fields):
+        def create():
+            with app.app_context():
+                row = model(**fields)
+                db.session.add(row)
+                db.session.commit()
+                return row.id
+        return create
+
+    def saved_order_ids():
+        with app.app_context():
+            return [order.id for order in ProductionOrder.query.filter_by(production_order='BUDGET-SAVE').limit(2)]
+
+    def saved_header_id():
+        with app.app_context():
+            return ProductionOrderHeader.query.filter_by(number='BUDGET-SAVE').one().id
+
+    ids['spare_user'] = lambda: spare(User, username=f'spare-{time.monotonic_ns()}', password_hash='x')()
+    ids['spare_workcenter'] = lambda: spare(WorkCenter, name=f'WC-SPARE-{time.monotonic_ns()}')()
+    ids['spare_department'] = lambda: spare(Department, name=f'Spare-{time.monotonic_ns()}')()
+    def profile_id():
+        client = app.test_client()
+        with client.session_transaction() as client_session:
+            client_session.update(user_id=1, username='admin', is_admin=True)
+        return client.get('/admin/dashboard?_profile=1').headers['X-Profile-Id']
+
+    ids['saved_order_ids'] = saved_order_ids
+    ids['profile'] = profile_id
+    ids['saved_header_id'] = saved_header_id
+
+    seeded_count = [0]
+
+    def grow_to(total):
+        with app.app_context():
+            seed_orders(db, seeded_count[0], total - seeded_count[0], workcenter_ids, users)
+        seeded_count[0] = total
+
+    return ids, grow_to
+
+
+class StatementCounter:
+    """Counts statements executed on the calling thread only (background jobs and fan-out threads aside)"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.thread = None
+        self.count = 0
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == self.thread:
+            self.count += 1
+
+    def __enter__(self):
+        self.thread = threading.get_ident()
+        self.count = 0
+        event.listen(self.engine, 'before_cursor_execute', self._before_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._before_execute)
+
+
+def login(app, username, password):
+    client = app.test_client()
+    response = client.post('/login', data={'username': username, 'password': password})
+    assert response.status_code == 302
+    return client
+
+
+def measure(app, db, clients, ids, case):
+    """Most statements and fastest time over REPEATS requests"""
+    measured = Measurement(seconds=float('inf'))
+    for _ in range(REPEATS):
+        path = case.path(ids) if callable(case.path) else case.path
+        data = case.data(ids) if callable(case.data) else case.data
+        body = case.json(ids) if callable(case.json) else case.json
+        client = clients[case.user]
+        with app.app_context():
+            engine = db.engine
+        with StatementCounter(engine) as counter:
+            started = time.perf_counter()
+            response = client.open(path, method=case.method, data=data, json=body)
+            response.get_data()  # streamed pages run their queries while the body is read
+            elapsed = time.perf_counter() - started
+        response.close()
+        measured.statements = max(measured.statements, counter.count)
+        measured.seconds = min(measured.seconds, elapsed)
+        measured.status = response.status_code
+    return measured
+
+
+@pytest.fixture(scope='session')
+def results(app, db, seeded, summary_sections):
+    ids, grow_to = seeded
+    clients = {
+        'admin': login(app, 'admin', 'admin123'),
+        'operator': login(app, 'operator0', 'operator'),
+        'anonymous': app.test_client(),
+    }
+    measured = Results()
+    for scale in (1, SCALE):
+        grow_to(BASE_ORDERS * scale)
+        # Warm-up so the first case does not pay for template compilation
+        for case in CASES:
+            if case.method == 'GET':
+                clients[case.user].get(case.path(ids) if callable(case.path) else case.path).get_data()
+        measured.by_scale[scale] = {case.id: measure(app, db, clients, ids, case) for case in CASES}
+
+    table = [f'{"case":40} {"stmts 1x":>9} {"stmts 10x":>9} {"ms 1x":>9} {"ms 10x":>9}']
+    for case in CASES:
+        small, large = measured.by_scale[1][case.id], measured.by_scale[SCALE][case.id]
+        table.append(f'{case.id:40} {small.statements:9} {large.statements:9} '
+                     f'{small.seconds * 1000:9.1f} {large.seconds * 1000:9.1f}')
+    summary_sections['query budgets'] = table
+    return measured
+
+
+def test_every_route_has_a_case(app):
+    covered = {case.endpoint for case in CASES}
+    missing = [rule.endpoint for rule in app.url_map.iter_rules()
+               if rule.endpoint not in covered and rule.endpoint not in SKIPPED]
+    assert not missing, f'Routes without a query budget case: {missing}'
+
+
+@pytest.mark.parametrize('case', CASES, ids=lambda case: case.id)
+def test_statement_budget(results, case):
+    small, large = results.by_scale[1][case.id], results.by_scale[SCALE][case.id]
+    assert large.status in case.status, f'{case.id} returned {large.status}'
+    assert large.statements <= case.max_statements, \
+        f'{case.id} ran {large.statements} statements, budget {case.max_statements}'
+    # Statements per request must not depend on the number of rows
+    assert large.statements <= small.statements + 1, \
+        f'{case.id} ran {small.statements} statements at 1x and {large.statements} at {SCALE}x'
+
+
+@pytest.mark.parametrize('case', CASES, ids=lambda case: case.id)
+def test_runtime_growth(results, case):
+    small, large = results.by_scale[1][case.id], results.by_scale[SCALE][case.id]
+    growth = large.seconds / max(small.seconds, TIME_FLOOR)
+    assert growth <= case.max_growth, \
+        f'{case.id} took {growth:.1f}x longer with {SCALE}x data (limit {case.max_growth}x)'
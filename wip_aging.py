@@ -0,0 +1,100 @@
+from datetime import datetime
+
+from sqlalchemy import case, func
+
+from app import db
+from models import ProductionOrder, WorkCenter
+from open_wip import join_open_wip
+
+# (key, label, upper bound in days); the last band is open-ended
+AGING_BANDS = [
+    ('0-1', '0-1 days', 1),
+    ('1-3', '1-3 days', 3),
+    ('3-7', '3-7 days', 7),
+    ('7-14', '1-2 weeks', 14),
+    ('14-30', '2-4 weeks', 30),
+    ('30+', 'Over 30 days', None),
+]
+
+
+def aging_band(age_days):
+    for key, label, upper in AGING_BANDS:
+        if upper is None or age_days < upper:
+            return key
+    return AGING_BANDS[-1][0]
+
+
+def aging_query(search='', workcenter_id=None):
+    """Last IN, last OUT and first unmatched IN per open (production_order, workcenter_id) pair.
+
+    Window functions over each pair's history, ordered by the
+    (production_order, workcenter_id, created_at) index. The first unmatched
+    IN is the earliest IN whose running IN total exceeds everything taken
+    OUT so far, i.e. the oldest stock still at the work center (FIFO).
+    """
+    pair = (ProductionOrder.production_order, ProductionOrder.workcenter_id)
+    is_in = ProductionOrder.order_type == 'IN'
+    in_quantity = case((is_in, ProductionOrder.quantity), else_=0)
+    out_quantity = case((is_in, 0), else_=ProductionOrder.quantity)
+
+    history = join_open_wip(db.session.query(
+        ProductionOrder.production_order,
+        ProductionOrder.workcenter_id,
+        ProductionOrder.order_type,
+        ProductionOrder.created_at,
+        func.sum(in_quantity).over(
+            partition_by=pair, order_by=(ProductionOrder.created_at, ProductionOrder.id), rows=(None, 0)
+        ).label('running_in'),
+        func.sum(in_quantity).over(partition_by=pair).label('total_in'),
+        func.sum(out_quantity).over(partition_by=pair).label('total_out'),
+    ))
+    if search:
+        history = history.filter(ProductionOrder.production_order.contains(search))
+    if workcenter_id:
+        history = history.filter(ProductionOrder.workcenter_id == workcenter_id)
+    history = history.subquery()
+
+    is_history_in = history.c.order_type == 'IN'
+    return db.session.query(
+        history.c.production_order,
+        history.c.workcenter_id,
+        WorkCenter.name,
+        func.max(history.c.total_in),
+        func.max(history.c.total_out),
+        func.max(case((is_history_in, history.c.created_at))),
+        func.max(case((~is_history_in, history.c.created_at))),
+        func.min(case((is_history_in & (history.c.running_in > history.c.total_out), history.c.created_at))),
+    ).join(WorkCenter, WorkCenter.id == history.c.workcenter_id).group_by(
+        history.c.production_order, history.c.workcenter_id, WorkCenter.name
+    )
+
+
+def wip_aging(search='', workcenter_id=None, now=None):
+    """Aging rows for every open pair, oldest stock first, plus counts and quantities per band"""
+    now = now or datetime.utcnow()
+    bands = {key: {'key': key, 'label': label, 'count': 0, 'quantity': 0} for key, label, _ in AGING_BANDS}
+    rows = []
+    for production_order, workcenter_id, workcenter_name, total_in, total_out, last_in, last_out, \
+            first_unmatched_in in aging_query(search, workcenter_id):
+        balance = int(total_in or 0) - int(total_out or 0)
+        # Shortages have no unmatched IN; age them from their last movement instead
+        aged_from = first_unmatched_in or max(filter(None, (last_in, last_out)), default=now)
+        age_days = (now - aged_from).total_seconds() / 86400
+        band = aging_band(age_days)
+        bands[band]['count'] += 1
+        bands[band]['quantity'] += balance
+        rows.append({
+            'production_order': production_order,
+            'workcenter_id': workcenter_id,
+            'workcenter_name': workcenter_name,
+            'total_in': int(total_in or 0),
+            'total_out': int(total_out or 0),
+            'balance': balance,
+            'last_in': last_in,
+            'last_out': last_out,
+            'first_unmatched_in': first_unmatched_in,
+            'age_days': age_days,
+            'band': band,
+        })
+    rows.sort(key=lambda row: row['age_days'], reverse=True)
+    return rows, [bands[key] for key, _, _ in AGING_BANDS]
@@ -0,0 +1,220 @@
+"""Excel export with one sheet per work center, built in parallel.
+
+Each work center's orders are read by their own query in chunks of
+EXCEL_EXPORT_CHUNK_SIZE. A pool of worker processes turns every chunk into
+worksheet rows while the next chunk is read, and the sheets are zipped
+into one xlsx in work center order, followed by the balance sheet. The
+export then takes about as long as the CPU work divided by the worker
+count, instead of growing with the total row count on one core.
+
+At most EXCEL_EXPORT_IN_FLIGHT chunks are queued or being built at a time,
+and each sheet is written to the workbook as soon as its last chunk is
+built, so only the sheet in progress and the chunks in flight are held in
+memory rather than the whole export.
+"""
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+
+from sqlalchemy import case, func
+
+import xlsx_parts
+from app import app, db
+from models import ProductionOrder, WorkCenter
+from open_wip import join_open_wip
+
+# Worker processes building sheet rows; 0 builds them in the request process
+EXCEL_EXPORT_WORKERS = int(os.environ.get("EXCEL_EXPORT_WORKERS", str(os.cpu_count() or 1)))
+# Rows per query fetch and per worker task
+EXCEL_EXPORT_CHUNK_SIZE = int(os.environ.get("EXCEL_EXPORT_CHUNK_SIZE", "5000"))
+# Chunks submitted and not yet written per export; the request waits for the oldest beyond this
+EXCEL_EXPORT_IN_FLIGHT = int(os.environ.get("EXCEL_EXPORT_IN_FLIGHT", str(2 * max(EXCEL_EXPORT_WORKERS, 1))))
+
+IST_OFFSET = timedelta(hours=5, minutes=30)
+ORDER_HEADERS = ['Production Order', 'Quantity', 'Type', 'Remark', 'Name', 'Department', 'Date & Time']
+BALANCE_HEADERS = ['Production Order', 'Work Center', 'Remarks', 'Total IN', 'Total OUT', 'Balance']
+BALANCE_SHEET_TITLE = 'Balance Report'
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class _Done:
+    """Stands in for a pool future when rows are built in the request process"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def result(self):
+        return self.value
+
+    def cancel(self):
+        return False
+
+
+def _export_pool():
+    """Worker processes shared by every export in this app process, started on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: workers start clean instead of inheriting this process's connections, threads and locks
+            _pool = ProcessPoolExecutor(EXCEL_EXPORT_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _submit(pool, rows, first_row):
+    if pool is None:
+        return _Done(xlsx_parts.rows_xml(rows, first_row, IST_OFFSET, xlsx_parts.TIME_FORMAT + ' IST'))
+    return pool.submit(xlsx_parts.rows_xml, rows, first_row, IST_OFFSET, xlsx_parts.TIME_FORMAT + ' IST')
+
+
+def _chunks(query):
+    """Plain row tuples in chunks of EXCEL_EXPORT_CHUNK_SIZE, fetched through a server-side cursor"""
+    result = db.session.execute(query.statement.execution_options(yield_per=EXCEL_EXPORT_CHUNK_SIZE))
+    for chunk in result.partitions():
+        yield [tuple(row) for row in chunk]
+
+
+def _workcenters(open_only):
+    """(id, name) of the work centers with orders to export, by name"""
+    query = db.session.query(WorkCenter.id, WorkCenter.name).join(
+        ProductionOrder, ProductionOrder.workcenter_id == WorkCenter.id
+    )
+    if open_only:
+        query = join_open_wip(query)
+    return query.distinct().order_by(WorkCenter.name, WorkCenter.id).all()
+
+
+def _order_query(workcenter_id, open_only):
+    query = db.session.query(
+        ProductionOrder.production_order,
+        ProductionOrder.quantity,
+        ProductionOrder.order_type,
+        func.coalesce(func.nullif(ProductionOrder.remark, ''), '-'),
+        func.coalesce(func.nullif(ProductionOrder.user_name, ''), '-'),
+        func.coalesce(func.nullif(ProductionOrder.user_department, ''), '-'),
+        ProductionOrder.created_at,
+    ).filter(ProductionOrder.workcenter_id == workcenter_id)
+    if open_only:
+        query = join_open_wip(query)
+    return query.order_by(ProductionOrder.created_at.desc(), ProductionOrder.id.desc())
+
+
+def _balance_rows(open_only):
+    """Balance sheet rows: totals per (production order, work center) with their distinct remarks"""
+    totals = db.session.query(
+        ProductionOrder.production_order,
+        WorkCenter.name,
+        ProductionOrder.workcenter_id,
+        func.sum(case((ProductionOrder.order_type == 'IN', ProductionOrder.quantity), else_=0)),
+        func.sum(case((ProductionOrder.order_type == 'IN', 0), else_=ProductionOrder.quantity)),
+    ).join(WorkCenter, WorkCenter.id == ProductionOrder.workcenter_id)
+    remarks = db.session.query(
+        ProductionOrder.production_order, ProductionOrder.workcenter_id, ProductionOrder.remark
+    ).filter(ProductionOrder.remark.isnot(None), ProductionOrder.remark != '')
+    if open_only:
+        totals = join_open_wip(totals)
+        remarks = join_open_wip(remarks)
+
+    remarks_by_key = {}
+    for production_order, workcenter_id, remark in remarks.distinct():
+        if remark.strip():
+            remarks_by_key.setdefault((production_order, workcenter_id), set()).add(remark.strip())
+
+    rows = []
+    for production_order, workcenter_name, workcenter_id, total_in, total_out in totals.group_by(
+        ProductionOrder.production_order, ProductionOrder.workcenter_id, WorkCenter.name
+    ).order_by(ProductionOrder.production_order, WorkCenter.name):
+        key_remarks = remarks_by_key.get((production_order, workcenter_id))
+        total_in, total_out = int(total_in or 0), int(total_out or 0)
+        rows.append((production_order, workcenter_name, ', '.join(sorted(key_remarks)) if key_remarks else '-',
+                     total_in, total_out, total_in - total_out))
+    return rows
+
+
+def _chunk_tasks(workcenters, open_only):
+    """(sheet index, rows, first row) of every chunk: the work center sheets in order, then the balances"""
+    for index, (workcenter_id, _) in enumerate(workcenters):
+        first_row = 2
+        for rows in _chunks(_order_query(workcenter_id, open_only)):
+            yield index, rows, first_row
+            first_row += len(rows)
+    balance_rows = _balance_rows(open_only)
+    for start in range(0, len(balance_rows), EXCEL_EXPORT_CHUNK_SIZE):
+        yield len(workcenters), balance_rows[start:start + EXCEL_EXPORT_CHUNK_SIZE], start + 2
+
+
+def _sheet_parts(pool, sheet_headers, tasks):
+    """Worksheet XML of each sheet in order, each yielded once all of its chunks are built.
+
+    Queries run here, one chunk at a time, while the workers build the rows
+    of earlier chunks; at most EXCEL_EXPORT_IN_FLIGHT chunks are submitted
+    and not yet collected.
+    """
+    in_flight = deque()  # (sheet index, future), oldest first
+    row_parts = {}  # sheet index -> built chunks of a sheet not yet written
+    next_sheet = 0
+
+    def collect_oldest():
+        index, future = in_flight.popleft()
+        row_parts.setdefault(index, []).append(future.result())
+
+    def finished_sheets(reading):
+        # Sheets before the one being read are done once none of their chunks is in flight
+        nonlocal next_sheet
+        while next_sheet < reading and not (in_flight and in_flight[0][0] == next_sheet):
+            yield xlsx_parts.worksheet_xml(sheet_headers[next_sheet], row_parts.pop(next_sheet, []))
+            next_sheet += 1
+
+    try:
+        for index, rows, first_row in tasks:
+            yield from finished_sheets(index)
+            while len(in_flight) >= EXCEL_EXPORT_IN_FLIGHT:
+                collect_oldest()
+                yield from finished_sheets(index)
+            in_flight.append((index, _submit(pool, rows, first_row)))
+        while in_flight:
+            collect_oldest()
+            yield from finished_sheets(len(sheet_headers))
+        yield from finished_sheets(len(sheet_headers))
+    finally:
+        for _, future in in_flight:
+            future.cancel()
+
+
+def export_workbook(output, open_only=False):
+    """Write the workbook to output (a path or binary file): one sheet per work center, then the balances.
+
+    Returns the number of sheets. Open WIP only restricts every sheet to the
+    pairs whose current balance is not zero, as in the two-sheet export.
+    """
+    pool = _export_pool() if EXCEL_EXPORT_WORKERS > 0 else None
+    workcenters = _workcenters(open_only)
+    used_titles = {BALANCE_SHEET_TITLE.lower()}
+    titles = [xlsx_parts.sheet_title(name, used_titles) for _, name in workcenters] + [BALANCE_SHEET_TITLE]
+    sheet_headers = [ORDER_HEADERS] * len(workcenters) + [BALANCE_HEADERS]
+
+    parts = _sheet_parts(pool, sheet_headers, _chunk_tasks(workcenters, open_only))
+    try:
+        xlsx_parts.assemble_workbook(output, titles, parts)
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); start a fresh pool on the next export
+        app.logger.error('Excel export worker pool broke; restarting it on the next export')
+        _reset_pool()
+        raise
+    finally:
+        # Cancels the chunks still queued if the workbook could not be finished
+        parts.close()
+    return len(titles)
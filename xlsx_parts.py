@@ -0,0 +1,180 @@
+"""Minimal xlsx writer that builds each worksheet part separately.
+
+Rows are rendered to worksheet XML in independent chunks, with inline
+strings instead of a shared string table, so chunks can be built in
+parallel (e.g. in a process pool); a worksheet part is its header row plus
+its chunks in order, and the parts are zipped into one workbook. This
+module imports nothing from the application, so a pool worker only loads it
+plus the entry module it re-imports under spawn: gunicorn's, or main.py,
+which skips the app import when loaded as __mp_main__.
+"""
+import re
+import zipfile
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+# Characters XML 1.0 does not allow, even escaped
+_ILLEGAL_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+_SHEET_NAME_CHARS = re.compile(r'[\[\]:*?/\\]')
+MAX_COLUMN_WIDTH = 50
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '{sheets}</Types>'
+)
+_SHEET_CONTENT_TYPE = (
+    '<Override PartName="/xl/worksheets/sheet{number}.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+)
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/></Relationships>'
+)
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets>{sheets}</sheets></workbook>'
+)
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '{sheets}<Relationship Id="rIdStyles" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+    'Target="styles.xml"/></Relationships>'
+)
+# Style 1 is the header style of the openpyxl exports: bold, fill 366092, centred
+_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="3"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill>'
+    '<fill><patternFill patternType="solid"><fgColor rgb="FF366092"/><bgColor rgb="FF366092"/></patternFill></fill>'
+    '</fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="1" fillId="2" borderId="0" xfId="0" applyFont="1" applyFill="1" applyAlignment="1">'
+    '<alignment horizontal="center"/></xf></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+
+def column_letter(index):
+    """0 -> A, 25 -> Z, 26 -> AA"""
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def sheet_title(name, used):
+    """A valid, unique sheet title (at most 31 characters, none of []:*?/\\)"""
+    base = _SHEET_NAME_CHARS.sub('-', str(name)).strip("'") or 'Sheet'
+    title = base[:31]
+    number = 2
+    while title.lower() in used:
+        suffix = f' ({number})'
+        title = base[:31 - len(suffix)] + suffix
+        number += 1
+    used.add(title.lower())
+    return title
+
+
+def _cell(reference, value, style=''):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return f'<c r="{reference}"{style} t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        return f'<c r="{reference}"{style}><v>{value}</v></c>'
+    text = escape(_ILLEGAL_XML.sub('', str(value)))
+    return f'<c r="{reference}"{style} t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def rows_xml(rows, first_row, time_offset=None, time_format=TIME_FORMAT):
+    """<row> elements for rows numbered from first_row, and the longest value per column.
+
+    Values are str, int, float or None; datetimes are shifted by time_offset
+    and written as text in time_format. Runs in pool workers, so it takes
+    and returns only plain, picklable values.
+    """
+    body = []
+    widths = []
+    for row_number, row in enumerate(rows, first_row):
+        cells = []
+        for index, value in enumerate(row):
+            if isinstance(value, datetime):
+                value = (value + time_offset if time_offset else value).strftime(time_format)
+            cells.append(_cell(f'{column_letter(index)}{row_number}', value))
+            if index >= len(widths):
+                widths.append(0)
+            if value is not None:
+                widths[index] = max(widths[index], len(str(value)))
+        body.append(f'<row r="{row_number}">{"".join(cells)}</row>')
+    return ''.join(body).encode('utf-8'), widths
+
+
+def worksheet_xml(headers, row_parts):
+    """The XML part of one worksheet: a styled header row, then the (xml, widths) pairs of rows_xml in order"""
+    widths = [len(str(header)) for header in headers]
+    for _, part_widths in row_parts:
+        for index, width in enumerate(part_widths):
+            widths[index] = max(widths[index], width)
+    columns = ''.join(
+        f'<col min="{index + 1}" max="{index + 1}" width="{min(width + 2, MAX_COLUMN_WIDTH)}" customWidth="1"/>'
+        for index, width in enumerate(widths)
+    )
+    header_cells = ''.join(
+        _cell(f'{column_letter(index)}1', header, ' s="1"') for index, header in enumerate(headers)
+    )
+    return b''.join([
+        ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+         '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+         f'<cols>{columns}</cols><sheetData><row r="1">{header_cells}</row>').encode('utf-8'),
+        *(part for part, _ in row_parts),
+        b'</sheetData></worksheet>',
+    ])
+
+
+def assemble_workbook(output, titles, parts):
+    """Zip one worksheet XML part per title into an xlsx written to output (a path or binary file).
+
+    parts is consumed lazily, in title order, so a sheet can still be in
+    progress while the ones before it are compressed.
+    """
+    sheets = list(titles)
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as workbook:
+        workbook.writestr('[Content_Types].xml', _CONTENT_TYPES.format(sheets=''.join(
+            _SHEET_CONTENT_TYPE.format(number=number) for number in range(1, len(sheets) + 1)
+        )))
+        workbook.writestr('_rels/.rels', _ROOT_RELS)
+        workbook.writestr('xl/workbook.xml', _WORKBOOK.format(sheets=''.join(
+            f'<sheet name="{escape(title, {chr(34): "&quot;"})}" sheetId="{number}" r:id="rId{number}"/>'
+            for number, title in enumerate(sheets, 1)
+        )))
+        workbook.writestr('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS.format(sheets=''.join(
+            f'<Relationship Id="rId{number}" '
+            'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+            f'Target="worksheets/sheet{number}.xml"/>'
+            for number in range(1, len(sheets) + 1)
+        )))
+        workbook.writestr('xl/styles.xml', _STYLES)
+        for number, part in enumerate(parts, 1):
+            workbook.writestr(f'xl/worksheets/sheet{number}.xml', part)